@@ -0,0 +1,82 @@
+# Copyright (c) 2025, Ahmad Hussnain and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import now_datetime
+
+# Redis hash holding the latest snapshot per Bank Account (field = Bank Account name).
+BALANCE_CACHE_KEY = "fints_latest_balance"
+
+
+class FinTSBalanceSnapshot(Document):
+    pass
+
+
+def record_balance_snapshot(balance=None, fints_doc=None, stmt_doc=None):
+    """
+        Stores a timestamped balance snapshot for the Bank Account of the given FinTS Settings.
+        Args:
+            balance (mt940.models.Balance): The booked balance returned by the bank (HISAL).
+            fints_doc (Document): The 'FinTS Settings' document instance.
+            stmt_doc (Document): The 'FinTS Statement Import' document that performed the sync.
+        Returns:
+            Document: The inserted 'FinTS Balance Snapshot' or None if there was no balance.
+    """
+    if balance is None or not fints_doc or not fints_doc.bank_account:
+        return None
+
+    snapshot = frappe.get_doc({
+        "doctype": "FinTS Balance Snapshot",
+        "bank_account": fints_doc.bank_account,
+        "fints_account": fints_doc.name,
+        "fints_statement_import": stmt_doc.name if stmt_doc else None,
+        "balance_date": balance.date,
+        "snapshot_timestamp": now_datetime(),
+        "balance": float(balance.amount.amount),
+        "currency": balance.amount.currency,
+    })
+    snapshot.insert(ignore_permissions=True)
+    return snapshot
+
+
+def invalidate_balance_cache(bank_account=None):
+    """
+        Drops the cached balance of a Bank Account so the next read goes to the latest snapshot.
+        The cache is only dropped once the snapshot is committed, a read in between would cache the old one again.
+        Args:
+            bank_account (str): The name of the 'Bank Account'.
+    """
+    if bank_account:
+        frappe.db.after_commit.add(lambda: frappe.cache().hdel(BALANCE_CACHE_KEY, bank_account))
+
+
+@frappe.whitelist()
+def get_latest_balance(bank_account=None):
+    """
+        Returns the latest stored balance of a Bank Account without contacting the bank.
+        Args:
+            bank_account (str): The name of the 'Bank Account'.
+        Returns:
+            dict: Balance, currency, balance date and snapshot timestamp or None if no snapshot exists.
+    """
+    if not bank_account:
+        frappe.throw(_("Missing Bank Account."))
+
+    frappe.has_permission("FinTS Balance Snapshot", "read", throw=True)
+
+    cached = frappe.cache().hget(BALANCE_CACHE_KEY, bank_account)
+    if cached is not None:
+        return cached
+
+    snapshot = frappe.db.get_value(
+        "FinTS Balance Snapshot",
+        {"bank_account": bank_account},
+        ["balance", "currency", "balance_date", "snapshot_timestamp"],
+        order_by="snapshot_timestamp desc",
+        as_dict=True,
+    )
+    if snapshot:
+        frappe.cache().hset(BALANCE_CACHE_KEY, bank_account, snapshot)
+    return snapshot
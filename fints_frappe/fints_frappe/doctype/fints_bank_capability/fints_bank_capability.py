@@ -0,0 +1,200 @@
+# Copyright (c) 2025, Ahmad Hussnain and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import cint, now_datetime
+
+import json
+import base64
+import hashlib
+
+# Redis hash holding the capabilities per bank (field = document name)
+CAPABILITY_CACHE_KEY = "fints_bank_capability"
+
+
+def get_hkkaz_segments():
+    """
+        Returns the supported HKKAZ segment classes by version. python-fints is imported on first use.
+    """
+    import fints.segments.statement
+
+    return {
+        5: fints.segments.statement.HKKAZ5,
+        6: fints.segments.statement.HKKAZ6,
+        7: fints.segments.statement.HKKAZ7,
+    }
+
+
+class FinTSBankCapability(Document):
+    def autoname(self):
+        self.name = get_capability_name(self.blz, self.endpoint_url)
+
+    def on_update(self):
+        frappe.cache().hdel(CAPABILITY_CACHE_KEY, self.name)
+
+
+def get_capability_name(blz=None, endpoint_url=None):
+    """
+        Returns the registry key of a bank: the BLZ plus a short hash of the endpoint URL.
+        Args:
+            blz (str): The bank code.
+            endpoint_url (str): The FinTS endpoint of the bank.
+        Returns:
+            str: The name of the 'FinTS Bank Capability' document.
+    """
+    endpoint = (endpoint_url or "").strip().rstrip("/").lower()
+    return "{0}-{1}".format(blz, hashlib.sha1(endpoint.encode("utf-8")).hexdigest()[:10])
+
+
+def get_bank_capability(fints_doc=None):
+    """
+        Returns the cached capabilities of the bank of a FinTS Settings document.
+        Args:
+            fints_doc (Document): The 'FinTS Settings' document instance.
+        Returns:
+            frappe._dict: The capability values or None if the bank is not known yet.
+    """
+    name = get_capability_name(fints_doc.blz, fints_doc.endpoint_url)
+    capability = frappe.cache().hget(CAPABILITY_CACHE_KEY, name)
+    if capability is None:
+        if not frappe.db.exists("FinTS Bank Capability", name):
+            return None
+        capability = frappe.get_doc("FinTS Bank Capability", name).as_dict()
+        frappe.cache().hset(CAPABILITY_CACHE_KEY, name, capability)
+    return frappe._dict(capability)
+
+
+def update_bank_capability(fints_doc=None, values=None):
+    """
+        Creates or updates the registry entry of a bank. Only changed values are written.
+        Args:
+            fints_doc (Document): The 'FinTS Settings' document instance.
+            values (dict): Field values to store.
+    """
+    name = get_capability_name(fints_doc.blz, fints_doc.endpoint_url)
+    if frappe.db.exists("FinTS Bank Capability", name):
+        capability = frappe.get_doc("FinTS Bank Capability", name)
+    else:
+        capability = frappe.new_doc("FinTS Bank Capability")
+        capability.blz = fints_doc.blz
+        capability.endpoint_url = fints_doc.endpoint_url
+
+    changed = False
+    for fieldname, value in (values or {}).items():
+        if value is not None and capability.get(fieldname) != value:
+            capability.set(fieldname, value)
+            changed = True
+
+    if changed or capability.is_new():
+        capability.last_refreshed = now_datetime()
+        capability.save(ignore_permissions=True)
+
+
+def record_client_capabilities(f=None, fints_doc=None, from_data=None, mechanisms=None, tan_medium_required=None,
+                               touchdown_pages=None):
+    """
+        Records what the client learned about the bank: BPD, segment versions, TAN mechanisms and touchdowns.
+        Cheap to call after every dialog, the BPD is only stored again when the bank sent a newer version.
+        Args:
+            f (FinTS3PinTanClient): The FinTS client after talking to the bank.
+            fints_doc (Document): The 'FinTS Settings' document instance.
+            from_data (bytes): The deconstructed client state. The BPD is only taken from it.
+            mechanisms (list): TAN mechanisms as [{"id": ..., "name": ...}].
+            tan_medium_required (bool): Whether the bank requires a TAN medium selection.
+            touchdown_pages (int): Number of touchdown pages of the last statement request.
+    """
+    try:
+        capability = get_bank_capability(fints_doc) or frappe._dict()
+        values = {}
+
+        if from_data and f.bpd_version and f.bpd_version != cint(capability.bpd_version):
+            values.update({
+                "bpd_version": f.bpd_version,
+                "bpd_state": get_shared_bpd_state(from_data, fints_doc),
+                "bank_name": f.bpa.bank_name if f.bpa else None,
+                "hkkaz_version": get_highest_segment_version(f, "HIKAZS", (5, 6, 7)),
+                "hkcaz_version": get_highest_segment_version(f, "HICAZS", (1,)),
+                "hksal_version": get_highest_segment_version(f, "HISALS", (5, 6, 7)),
+            })
+            # A value set by hand wins over the one the bank announces
+            if not cint(capability.statement_storage_days):
+                values["statement_storage_days"] = get_statement_storage_days(f) or None
+        if mechanisms:
+            values["tan_mechanisms"] = json.dumps(mechanisms)
+        if tan_medium_required is not None:
+            values["tan_medium_required"] = 1 if tan_medium_required else 0
+        if touchdown_pages:
+            if touchdown_pages > 1:
+                values["uses_touchdowns"] = 1
+            if touchdown_pages > cint(capability.max_touchdown_pages):
+                values["max_touchdown_pages"] = touchdown_pages
+
+        if values:
+            update_bank_capability(fints_doc, values)
+    except Exception:
+        # The registry is an optimisation, it must never break a bank dialog
+        frappe.log_error(title="FinTS Bank Capability")
+
+
+def get_highest_segment_version(f=None, parameter_segment=None, versions=None):
+    """
+        Returns the highest version of a business transaction that both the bank (BPD) and python-fints support.
+    """
+    segment = f.bpd.find_segment_highest_version(parameter_segment, versions)
+    return segment.header.version if segment else 0
+
+
+def get_statement_storage_days(f=None):
+    """
+        Returns the storage period (days) the bank announces for HKKAZ, 0 if it can't be read.
+        With 0 nothing is stored and the sync uses its default window.
+    """
+    try:
+        segment = f.bpd.find_segment_highest_version("HIKAZS", (5, 6, 7))
+        # python-fints has no model for HIKAZS: after max tasks, min signatures and security class
+        # comes the parameter group, its first element is the storage period ("Speicherzeitraum")
+        parameter = segment._additional_data[3]
+        return max(cint(parameter[0] if isinstance(parameter, (list, tuple)) else parameter), 0)
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        # No HIKAZS or a layout this version of python-fints doesn't parse like this
+        return 0
+
+
+def get_shared_bpd_state(from_data=None, fints_doc=None):
+    """
+        Serializes only the bank parameter data of a client state, without system ID, UPD or TAN selection of its user.
+    """
+    from fints.client import FinTS3PinTanClient, SYSTEM_ID_UNASSIGNED
+
+    shared = FinTS3PinTanClient(
+        bank_identifier=fints_doc.blz,
+        user_id=fints_doc.username,
+        pin=None,
+        server=fints_doc.endpoint_url,
+        product_id=fints_doc.get_password("product_id"),
+        from_data=from_data
+    )
+    shared.system_id = SYSTEM_ID_UNASSIGNED
+    shared.selected_security_function = None
+    shared.selected_tan_medium = None
+    return base64.b64encode(shared.deconstruct(including_private=False)).decode("ascii")
+
+
+def get_statement_command(f=None, fints_doc=None):
+    """
+        Returns the HKKAZ segment class to use, from the registry or by searching the BPD once.
+        Args:
+            f (FinTS3PinTanClient): The FinTS client handling the session.
+            fints_doc (Document): The 'FinTS Settings' document instance.
+        Returns:
+            type: HKKAZ5, HKKAZ6 or HKKAZ7.
+    """
+    hkkaz_segments = get_hkkaz_segments()
+    capability = get_bank_capability(fints_doc)
+    if capability and hkkaz_segments.get(cint(capability.hkkaz_version)):
+        return hkkaz_segments[cint(capability.hkkaz_version)]
+
+    hkkaz = f._find_highest_supported_command(*hkkaz_segments.values())
+    update_bank_capability(fints_doc, {"hkkaz_version": hkkaz.VERSION})
+    return hkkaz
@@ -0,0 +1,176 @@
+# Copyright (c) 2025, Ahmad Hussnain and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import cint, now_datetime
+
+import os
+import gzip
+import hmac
+import json
+import hashlib
+import traceback
+
+from fints_frappe.fints_frappe.doctype.fints_transaction_event.fints_transaction_event import (
+    assign_event_sequence, get_events_after)
+
+# One dispatcher at a time, a crashed one blocks the others for at most this many seconds
+DISPATCH_LOCK_TIMEOUT = 600
+# Batches delivered per sink and run, the next run continues at the cursor
+MAX_BATCHES_PER_RUN = 50
+
+
+class FinTSEventSink(Document):
+    def validate(self):
+        if cint(self.batch_size) < 1:
+            self.batch_size = 100
+        if self.sink_type == "Webhook" and self.webhook_url and not self.webhook_url.startswith(("http://", "https://")):
+            frappe.throw(_("The Webhook URL must start with http:// or https://."))
+        if self.sink_type == "File":
+            resolve_sink_file_path(self.file_path)
+
+
+def dispatch_transaction_events():
+    """
+        Scheduler and background job: delivers the outbox events after the cursor of every enabled sink.
+        A sink's cursor only moves after its batch has been delivered, so delivery is at least once;
+        consumers deduplicate by the event sequence.
+    """
+    lock = frappe.cache().lock(frappe.cache().make_key("fints_event_dispatch"), timeout=DISPATCH_LOCK_TIMEOUT,
+                               blocking_timeout=0)
+    if not lock.acquire():
+        # The running dispatcher reads up to the newest event anyway
+        return
+
+    try:
+        assign_event_sequence()
+        for sink_name in frappe.get_all("FinTS Event Sink", filters={"enabled": 1}, pluck="name"):
+            dispatch_sink(frappe.get_doc("FinTS Event Sink", sink_name))
+    finally:
+        try:
+            lock.release()
+        except Exception:
+            pass
+
+
+def dispatch_sink(sink=None):
+    """
+        Sends the pending events of one sink batch by batch and advances its cursor after each batch.
+        A failing sink keeps its cursor and the error, the other sinks are not affected.
+        Args:
+            sink (Document): The 'FinTS Event Sink' document instance.
+    """
+    cursor = cint(sink.last_event)
+    for _batch in range(MAX_BATCHES_PER_RUN):
+        events = get_events_after(cursor, cint(sink.batch_size) or 100)
+        if not events:
+            break
+
+        try:
+            send_batch(sink, events)
+        except Exception:
+            frappe.db.rollback()
+            frappe.db.set_value("FinTS Event Sink", sink.name, "last_error", traceback.format_exc(),
+                                update_modified=False)
+            frappe.db.commit()
+            frappe.log_error(title="FinTS Event Sink {0}".format(sink.name), message=traceback.format_exc())
+            return
+
+        cursor = events[-1]["sequence"]
+        frappe.db.set_value("FinTS Event Sink", sink.name, {
+            "last_event": cursor,
+            "last_dispatch": now_datetime(),
+            "last_error": ""
+        }, update_modified=False)
+        frappe.db.commit()
+
+
+def send_batch(sink=None, events=None):
+    """
+        Delivers one batch of events to a sink.
+        Args:
+            sink (Document): The 'FinTS Event Sink' document instance.
+            events (list): The events as returned by get_events_after.
+    """
+    body = encode_batch(sink, events)
+    meta = {
+        "first_event": events[0]["sequence"],
+        "last_event": events[-1]["sequence"],
+        "count": len(events),
+        "encoding": "gzip" if sink.compress else "identity"
+    }
+
+    if sink.sink_type == "Redis Stream":
+        fields = {key: str(value) for key, value in meta.items()}
+        fields["data"] = body
+        frappe.cache().xadd(sink.stream_key, fields, maxlen=cint(sink.stream_max_length) or None, approximate=True)
+    elif sink.sink_type == "Webhook":
+        send_webhook(sink, body, meta)
+    elif sink.sink_type == "File":
+        # Appending gzip members keeps the file one valid gzip stream
+        with open(get_sink_file_path(sink), "ab") as fh:
+            fh.write(body if sink.compress else body + b"\n")
+    else:
+        frappe.throw(_("Unknown sink type {0}.").format(sink.sink_type))
+
+
+def encode_batch(sink=None, events=None):
+    """
+        Returns the JSON of a batch, gzipped if the sink compresses.
+    """
+    body = json.dumps({"events": events}, default=str, separators=(",", ":")).encode("utf-8")
+    return gzip.compress(body) if sink.compress else body
+
+
+def send_webhook(sink=None, body=None, meta=None):
+    """
+        POSTs a batch to the webhook of a sink, signed with its secret. Non-2xx responses raise.
+    """
+    import requests
+
+    headers = {
+        "Content-Type": "application/json",
+        "X-FinTS-First-Event": str(meta["first_event"]),
+        "X-FinTS-Last-Event": str(meta["last_event"]),
+        "X-FinTS-Event-Count": str(meta["count"]),
+    }
+    if sink.compress:
+        headers["Content-Encoding"] = "gzip"
+    secret = sink.get_password("webhook_secret", raise_exception=False) if sink.webhook_secret else None
+    if secret:
+        headers["X-FinTS-Signature"] = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+    response = requests.post(sink.webhook_url, data=body, headers=headers, timeout=cint(sink.webhook_timeout) or 10)
+    response.raise_for_status()
+
+
+def get_sink_file_path(sink=None):
+    """
+        Returns the absolute path of a file sink and creates its folder.
+    """
+    path = resolve_sink_file_path(sink.file_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def resolve_sink_file_path(file_path=None):
+    """
+        Resolves the path of a file sink inside the private folder of the site. The worker may write elsewhere,
+        a sink may not: absolute paths, '..' and links leading out of the folder are rejected.
+        Args:
+            file_path (str): The 'File Path' of the sink.
+        Returns:
+            str: The absolute path.
+    """
+    path = (file_path or "").strip()
+    if not path or os.path.isabs(path) or ".." in path.replace("\\", "/").split("/"):
+        frappe.throw(_("The File Path must be relative to the private folder of the site and must not contain '..'."))
+
+    private_path = os.path.realpath(frappe.get_site_path("private"))
+    full_path = os.path.realpath(os.path.join(private_path, path))
+    if os.path.commonpath([private_path, full_path]) != private_path or full_path == private_path:
+        frappe.throw(_("The File Path must lie inside the private folder of the site."))
+    return full_path
+
@@ -0,0 +1,68 @@
+# Copyright (c) 2025, Ahmad Hussnain and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+import os
+import gzip
+import hmac
+import json
+import hashlib
+from unittest.mock import patch
+
+from fints_frappe.fints_frappe.doctype.fints_event_sink.fints_event_sink import (
+	encode_batch, resolve_sink_file_path, send_webhook)
+
+EVENTS = [{"sequence": 7, "event_type": "Transactions Imported", "transactions": [{"name": "BT-0001"}]},
+		  {"sequence": 8, "event_type": "Transactions Imported", "transactions": [{"name": "BT-0002"}]}]
+
+
+def make_webhook_sink(**values):
+	sink = frappe._dict(sink_type="Webhook", webhook_url="https://example.com/fints", webhook_secret="********",
+						webhook_timeout=5, compress=0)
+	sink.update(values)
+	sink.get_password = lambda *args, **kwargs: "s3cret"
+	return sink
+
+
+class TestFinTSEventSink(FrappeTestCase):
+	def send(self, sink):
+		body = encode_batch(sink, EVENTS)
+		meta = {"first_event": 7, "last_event": 8, "count": 2, "encoding": "gzip" if sink.compress else "identity"}
+		with patch("requests.post") as post:
+			send_webhook(sink, body, meta)
+		self.assertEqual(post.call_count, 1)
+		return body, post.call_args.kwargs
+
+	def test_webhook_signature(self):
+		body, request = self.send(make_webhook_sink())
+
+		self.assertEqual(request["data"], body)
+		self.assertEqual(json.loads(body)["events"][1]["sequence"], 8)
+		headers = request["headers"]
+		self.assertEqual(headers["X-FinTS-Signature"], hmac.new(b"s3cret", body, hashlib.sha256).hexdigest())
+		self.assertEqual((headers["X-FinTS-First-Event"], headers["X-FinTS-Last-Event"]), ("7", "8"))
+		self.assertNotIn("Content-Encoding", headers)
+
+	def test_webhook_signature_compressed(self):
+		# The signature covers the bytes on the wire, the gzipped body
+		body, request = self.send(make_webhook_sink(compress=1))
+
+		headers = request["headers"]
+		self.assertEqual(headers["Content-Encoding"], "gzip")
+		self.assertEqual(headers["X-FinTS-Signature"], hmac.new(b"s3cret", body, hashlib.sha256).hexdigest())
+		self.assertEqual(json.loads(gzip.decompress(body))["events"], EVENTS)
+
+	def test_webhook_without_secret(self):
+		_body, request = self.send(make_webhook_sink(webhook_secret=None))
+		self.assertNotIn("X-FinTS-Signature", request["headers"])
+
+	def test_file_path_inside_private_folder(self):
+		private_path = os.path.realpath(frappe.get_site_path("private"))
+		self.assertEqual(resolve_sink_file_path("fints/events.jsonl"),
+						 os.path.join(private_path, "fints", "events.jsonl"))
+		for file_path in ("", "/tmp/events.jsonl", "../events.jsonl", "fints/../../events.jsonl",
+						  os.path.join(private_path, "events.jsonl")):
+			with self.assertRaises(frappe.ValidationError):
+				resolve_sink_file_path(file_path)
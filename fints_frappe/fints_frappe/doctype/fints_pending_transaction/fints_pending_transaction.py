@@ -0,0 +1,152 @@
+# Copyright (c) 2025, Ahmad Hussnain and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import date_diff, flt, now_datetime
+
+import json
+
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_parallel import get_json_dictionary_hash
+
+# A pending item books within a few days of its value date
+PROMOTION_WINDOW_DAYS = 5
+
+
+class FinTSPendingTransaction(Document):
+    pass
+
+
+def store_pending_transactions(pending=None, fints_doc=None):
+    """
+        Replaces the pending (pre-booked) transactions of a Bank Account with the ones the bank reported last.
+        Rows that are still pending but no longer reported have booked unmatched or were cancelled, they are removed.
+        Args:
+            pending (list): The pending mt940.models.Transaction objects (statement_pending of HIKAZ),
+                or the transaction dictionaries of the pending entries of a CAMT file.
+            fints_doc (Document): The 'FinTS Settings' document instance.
+        Returns:
+            int: The number of newly staged pending transactions.
+    """
+    if pending is None or not fints_doc.bank_account:
+        return 0
+
+    import mt940
+
+    txn_dicts = {}
+    for txn_dict in json.loads(json.dumps(pending, cls=mt940.JSONEncoder)):
+        txn_dicts[get_json_dictionary_hash(txn_dict)] = txn_dict
+
+    staged = set(frappe.get_all("FinTS Pending Transaction",
+                                filters={"bank_account": fints_doc.bank_account, "status": "Pending"},
+                                pluck="hash"))
+    vanished = list(staged - set(txn_dicts))
+    if vanished:
+        frappe.db.delete("FinTS Pending Transaction",
+                         {"bank_account": fints_doc.bank_account, "hash": ["in", vanished], "status": "Pending"})
+
+    # Still reported as pending but already promoted: the bank lags behind its own booking.
+    # The same booking may be pending on another account too, hashes only count per account.
+    known = set(frappe.get_all("FinTS Pending Transaction",
+                               filters={"bank_account": fints_doc.bank_account, "hash": ["in", list(txn_dicts)]},
+                               pluck="hash")) if txn_dicts else set()
+    inserted = 0
+    for txn_hash, txn_dict in txn_dicts.items():
+        if txn_hash in known:
+            continue
+        frappe.get_doc({
+            "doctype": "FinTS Pending Transaction",
+            "bank_account": fints_doc.bank_account,
+            "fints_account": fints_doc.name,
+            "status": "Pending",
+            "date": txn_dict.get("date") or txn_dict.get("entry_date"),
+            "amount": flt(txn_dict.get("amount", {}).get("amount")),
+            "currency": txn_dict.get("amount", {}).get("currency"),
+            "reference": get_pending_reference(txn_dict),
+            "applicant_name": txn_dict.get("applicant_name", ""),
+            "applicant_iban": txn_dict.get("applicant_iban", ""),
+            "purpose": txn_dict.get("purpose", ""),
+            "hash": txn_hash,
+            "first_seen": now_datetime(),
+        }).insert(ignore_permissions=True)
+        inserted += 1
+    return inserted
+
+
+def promote_pending_transactions(bank_account=None, booked=None):
+    """
+        Marks the pending rows matching newly booked transactions as booked, in place.
+        A match has the same amount, the same reference (if both have one) and a date within PROMOTION_WINDOW_DAYS,
+        the closest date wins.
+        Args:
+            bank_account (str): The name of the 'Bank Account'.
+            booked (list): (txn_dict, bank_transaction_name) tuples of the inserted Bank Transactions.
+        Returns:
+            int: The number of promoted pending transactions.
+    """
+    if not bank_account or not booked:
+        return 0
+
+    amounts = list({flt(txn_dict.get("amount", {}).get("amount")) for txn_dict, name in booked})
+    candidates = frappe.get_all("FinTS Pending Transaction",
+                                filters={"bank_account": bank_account, "status": "Pending", "amount": ["in", amounts]},
+                                fields=["name", "date", "amount", "reference"])
+    if not candidates:
+        return 0
+
+    promoted = 0
+    for txn_dict, bank_transaction in booked:
+        amount = flt(txn_dict.get("amount", {}).get("amount"))
+        reference = get_pending_reference(txn_dict)
+        date = txn_dict.get("date") or txn_dict.get("entry_date")
+        matches = [row for row in candidates
+                   if flt(row.amount) == amount
+                   and (not reference or not row.reference or row.reference == reference)
+                   and date and row.date and abs(date_diff(date, row.date)) <= PROMOTION_WINDOW_DAYS]
+        if not matches:
+            continue
+
+        match = min(matches, key=lambda row: abs(date_diff(date, row.date)))
+        frappe.db.set_value("FinTS Pending Transaction", match.name, {
+            "status": "Booked",
+            "bank_transaction": bank_transaction,
+            "booked_on": now_datetime(),
+        }, update_modified=False)
+        candidates.remove(match)
+        promoted += 1
+    return promoted
+
+
+def get_pending_reference(txn_dict=None):
+    """
+        Returns the reference a pending and a booked transaction share: end-to-end reference or customer reference.
+    """
+    reference = txn_dict.get("end_to_end_reference") or txn_dict.get("customer_reference") or ""
+    # NONREF is the MT940 placeholder for 'no reference'
+    return "" if reference.upper() == "NONREF" else reference
+
+
+@frappe.whitelist()
+def get_pending_transactions(bank_account=None):
+    """
+        Returns the transactions of a Bank Account that are pending at the bank, without contacting the bank.
+        Args:
+            bank_account (str): The name of the 'Bank Account'.
+        Returns:
+            dict: The pending transactions and their total per currency.
+    """
+    if not bank_account:
+        frappe.throw(_("Missing Bank Account."))
+
+    frappe.has_permission("FinTS Pending Transaction", "read", throw=True)
+
+    transactions = frappe.get_all("FinTS Pending Transaction",
+                                  filters={"bank_account": bank_account, "status": "Pending"},
+                                  fields=["date", "amount", "currency", "reference", "applicant_name", "purpose",
+                                          "first_seen"],
+                                  order_by="date desc")
+    totals = {}
+    for row in transactions:
+        totals[row.currency] = flt(totals.get(row.currency)) + flt(row.amount)
+    return {"transactions": transactions, "totals": totals}
@@ -0,0 +1,73 @@
+# Copyright (c) 2025, Ahmad Hussnain and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from fints_frappe.fints_frappe.doctype.fints_pending_transaction.fints_pending_transaction import (
+	get_pending_reference, promote_pending_transactions, store_pending_transactions)
+
+PENDING = {"status": "D", "amount": {"amount": "-45.90", "currency": "EUR"}, "date": "2025-03-04",
+		   "end_to_end_reference": "E2E-0815", "applicant_name": "Versandhaus", "purpose": "Bestellung 4711"}
+
+
+def make_bank_account(account_name):
+	if not frappe.db.exists("Bank", "_Test FinTS Bank"):
+		frappe.get_doc({"doctype": "Bank", "bank_name": "_Test FinTS Bank"}).insert()
+	bank_account = frappe.db.exists("Bank Account", {"account_name": account_name, "bank": "_Test FinTS Bank"})
+	if bank_account:
+		return bank_account
+	return frappe.get_doc({"doctype": "Bank Account", "account_name": account_name,
+						   "bank": "_Test FinTS Bank"}).insert().name
+
+
+def get_pending_rows(bank_account):
+	return frappe.get_all("FinTS Pending Transaction", filters={"bank_account": bank_account},
+						  fields=["status", "amount", "reference", "bank_transaction"])
+
+
+class TestFinTSPendingTransaction(FrappeTestCase):
+	def setUp(self):
+		# fints_account stays empty, the pending rows are kept per Bank Account
+		self.fints_a = frappe._dict(name=None, bank_account=make_bank_account("_Test FinTS Pending A"))
+		self.fints_b = frappe._dict(name=None, bank_account=make_bank_account("_Test FinTS Pending B"))
+		frappe.db.delete("FinTS Pending Transaction",
+						 {"bank_account": ["in", [self.fints_a.bank_account, self.fints_b.bank_account]]})
+
+	def test_pending_per_account(self):
+		# The same booking pending on two accounts is staged for both
+		self.assertEqual(store_pending_transactions([dict(PENDING)], self.fints_a), 1)
+		self.assertEqual(store_pending_transactions([dict(PENDING)], self.fints_b), 1)
+		# Reported again: nothing new
+		self.assertEqual(store_pending_transactions([dict(PENDING)], self.fints_a), 0)
+
+		# Account A no longer reports it, account B keeps its row
+		store_pending_transactions([], self.fints_a)
+		self.assertEqual(get_pending_rows(self.fints_a.bank_account), [])
+		self.assertEqual(len(get_pending_rows(self.fints_b.bank_account)), 1)
+
+	def test_promote_closest_match(self):
+		store_pending_transactions([dict(PENDING), dict(PENDING, date="2025-03-01", end_to_end_reference="")],
+								   self.fints_a)
+		booked = dict(PENDING, date="2025-03-05")
+
+		self.assertEqual(promote_pending_transactions(self.fints_a.bank_account, [(booked, "BT-0001")]), 1)
+		rows = {row.reference: row for row in get_pending_rows(self.fints_a.bank_account)}
+		self.assertEqual(rows["E2E-0815"].status, "Booked")
+		self.assertEqual(rows["E2E-0815"].bank_transaction, "BT-0001")
+		self.assertEqual(rows[""].status, "Pending")
+
+	def test_promote_outside_window(self):
+		store_pending_transactions([dict(PENDING)], self.fints_a)
+		booked = dict(PENDING, date="2025-03-20")
+		self.assertEqual(promote_pending_transactions(self.fints_a.bank_account, [(booked, "BT-0001")]), 0)
+		# Another amount or another reference is another booking
+		self.assertEqual(promote_pending_transactions(
+			self.fints_a.bank_account, [(dict(PENDING, amount={"amount": "-45.00", "currency": "EUR"}), "BT-0002"),
+										(dict(PENDING, end_to_end_reference="E2E-0816"), "BT-0003")]), 0)
+
+	def test_pending_reference(self):
+		self.assertEqual(get_pending_reference({"end_to_end_reference": "E2E-0815", "customer_reference": "4711"}),
+						 "E2E-0815")
+		self.assertEqual(get_pending_reference({"customer_reference": "4711"}), "4711")
+		self.assertEqual(get_pending_reference({"customer_reference": "NONREF"}), "")
@@ -1,9 +1,23 @@
 # Copyright (c) 2025, Ahmad Hussnain and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, today
+
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_quota import (
+	LEARNED_LIMIT_DAYS, get_learned_access_limit)
 
 
 class TestFinTSSettings(FrappeTestCase):
-	pass
+	def test_learned_access_limit(self):
+		fints_doc = frappe._dict(learned_access_limit=2, access_limit_learned_on=add_days(today(), -1))
+		self.assertEqual(get_learned_access_limit(fints_doc), 2)
+
+	def test_learned_access_limit_expires(self):
+		fints_doc = frappe._dict(learned_access_limit=2,
+								 access_limit_learned_on=add_days(today(), -LEARNED_LIMIT_DAYS))
+		self.assertEqual(get_learned_access_limit(fints_doc), 0)
+
+	def test_no_learned_access_limit(self):
+		self.assertEqual(get_learned_access_limit(frappe._dict(learned_access_limit=0)), 0)
@@ -0,0 +1,73 @@
+import frappe
+from frappe import _
+
+# Drivers are imported on first use only: python-fints and mt940 stay out of workers that never talk to a bank
+BACKENDS = {
+    "PIN/TAN": "fints_frappe.fints_frappe.doctype.fints_statement_import.backends.pintan.PinTanBackend",
+    "File": "fints_frappe.fints_frappe.doctype.fints_statement_import.backends.file_import.FileBackend",
+    "Mock": "fints_frappe.fints_frappe.doctype.fints_statement_import.backends.mock.MockBackend",
+}
+DEFAULT_BACKEND = "PIN/TAN"
+
+# Driver instances of this process
+_backends = {}
+
+
+class BankBackend:
+    """
+        The operations the whitelisted endpoints of 'FinTS Statement Import' run against a bank.
+        Every method takes the name of the 'FinTS Statement Import' document and returns the endpoint response.
+        Drivers that talk to a bank count every dialog they open with count_bank_access.
+    """
+    name = None
+
+    def fetch_tan_mechanisms(self, docname=None):
+        return self.unsupported()
+
+    def select_tan_mechanism(self, docname=None, mechanism_id=None):
+        return self.unsupported()
+
+    def get_set_account_iban(self, docname=None):
+        return self.unsupported()
+
+    def fetch_transactions(self, docname=None, unattended=False):
+        return self.unsupported()
+
+    def submit_tan(self, docname=None, user_tan=None):
+        return self.unsupported()
+
+    def unsupported(self):
+        return {
+            "ok": False,
+            "tan_required": False,
+            "message": _("The {0} backend does not support this step.").format(self.name)
+        }
+
+
+def get_backend(name=None):
+    """
+        Returns the driver of a backend, importing its module on first use.
+        Args:
+            name (str): 'PIN/TAN', 'File' or 'Mock'. Defaults to 'PIN/TAN'.
+        Returns:
+            BankBackend: The driver instance.
+    """
+    name = name or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        frappe.throw(_("Unknown bank backend {0}.").format(name))
+
+    if name not in _backends:
+        _backends[name] = frappe.get_attr(BACKENDS[name])()
+    return _backends[name]
+
+
+def get_statement_backend(docname=None):
+    """
+        Returns the driver configured on the FinTS Settings of a statement import.
+        Args:
+            docname (str): The name of the 'FinTS Statement Import' document.
+        Returns:
+            BankBackend: The driver instance.
+    """
+    fints_account = frappe.db.get_value("FinTS Statement Import", docname, "fints_account") if docname else None
+    return get_backend(frappe.db.get_value("FinTS Settings", fints_account, "backend") if fints_account else None)
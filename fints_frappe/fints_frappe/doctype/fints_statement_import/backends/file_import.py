@@ -0,0 +1,43 @@
+import frappe
+
+from frappe import _
+
+from fints_frappe.fints_frappe.doctype.fints_statement_import.backends import BankBackend
+
+
+class FileBackend(BankBackend):
+    """
+        Statement file driver: MT940/STA or CAMT files attached to the statement import, no bank dialog.
+        The parsers are imported by the background job, not by the request that queues it.
+    """
+    name = "File"
+
+    def fetch_transactions(self, docname=None, unattended=False):
+        return self.import_statement_file(docname)
+
+    def import_statement_file(self, docname=None):
+        """
+            Queues the import of the attached statement file.
+        """
+        if not docname:
+            frappe.throw(_("Missing docname."))
+
+        stmt_doc = frappe.get_doc("FinTS Statement Import", docname)
+        stmt_doc.check_permission("write")
+        if not stmt_doc.fints_account:
+            frappe.throw(_("No FinTS Account set."))
+        if not stmt_doc.statement_file:
+            frappe.throw(_("Please attach a statement file first."))
+
+        # Large files take longer than a web request may, the job commits chunk by chunk
+        frappe.enqueue(
+            "fints_frappe.fints_frappe.doctype.fints_statement_import.fints_file_import.import_statement_file_job",
+            queue="long",
+            timeout=3600,
+            docname=docname
+        )
+        return {
+            "ok": True,
+            "tan_required": False,
+            "message": _("The file import has been queued. The result will appear in the Sync History.")
+        }
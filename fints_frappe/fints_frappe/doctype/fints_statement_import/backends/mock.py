@@ -0,0 +1,130 @@
+import frappe
+import random
+import hashlib
+
+from frappe import _
+from frappe.utils import add_days, date_diff
+
+from fints_frappe.fints_frappe.doctype.fints_statement_import.backends import BankBackend
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_helpers import (
+    append_sync_history, get_company_info, get_fetch_window, import_prepared_transactions)
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_parallel import (
+    number_transaction_hashes, prepare_dict_chunk)
+
+# IBAN reported for every mock account (the DE test IBAN of the Bundesbank)
+MOCK_IBAN = "DE02120300000000202051"
+MOCK_TAN_MECHANISM = "999"
+# At most this many transactions are generated per day
+MOCK_TRANSACTIONS_PER_DAY = 3
+MOCK_COUNTERPARTIES = [
+    ("Muster GmbH", "DE89370400440532013000", "Rechnung"),
+    ("Beispiel AG", "DE75512108001245126199", "Gutschrift"),
+    ("Stadtwerke Musterstadt", "DE12500105170648489890", "Abschlag Strom"),
+]
+
+
+class MockBackend(BankBackend):
+    """
+        Local driver without a bank: every step succeeds and fetches return deterministic synthetic transactions.
+        For development and tests, it never imports python-fints.
+    """
+    name = "Mock"
+
+    def fetch_tan_mechanisms(self, docname=None):
+        get_mock_statement(docname)
+        return {
+            "ok": True,
+            "tan_required": False,
+            "mechanisms": [{"id": MOCK_TAN_MECHANISM, "name": "Mock TAN"}],
+            "message": _("Found {0} TAN mechanism(s).").format(1)
+        }
+
+    def select_tan_mechanism(self, docname=None, mechanism_id=None):
+        stmt_doc = get_mock_statement(docname)
+        stmt_doc.mechanism_connected = True
+        stmt_doc.selected_mechanism_id = mechanism_id or MOCK_TAN_MECHANISM
+        stmt_doc.save(ignore_permissions=True)
+        return {
+            "ok": True,
+            "tan_required": False,
+            "message": _("TAN mechanism selected.")
+        }
+
+    def get_set_account_iban(self, docname=None):
+        stmt_doc = get_mock_statement(docname)
+        stmt_doc.account_get = True
+        stmt_doc.selected_account_iban = MOCK_IBAN
+        stmt_doc.save(ignore_permissions=True)
+        return {
+            "ok": True,
+            "tan_required": False,
+            "message": _("Account {0} selected.").format(MOCK_IBAN)
+        }
+
+    def fetch_transactions(self, docname=None, unattended=False):
+        stmt_doc = get_mock_statement(docname)
+        fints_doc = frappe.get_doc("FinTS Settings", stmt_doc.fints_account)
+
+        start_date, end_date = get_fetch_window(stmt_doc)
+        txn_dicts = []
+        for offset in range(max(date_diff(end_date, start_date) + 1, 0)):
+            txn_dicts.extend(get_mock_transactions(fints_doc.bank_account, add_days(start_date, offset)))
+
+        company_info = get_company_info(fints_doc)
+        txn_dicts, rows = prepare_dict_chunk(txn_dicts, company_info)
+        number_transaction_hashes(txn_dicts, rows)
+        json_data, new_transactions = import_prepared_transactions(txn_dicts, rows, company_info)
+
+        if stmt_doc.transaction_mode == "Backfill":
+            stmt_doc.backfill_next_date = add_days(end_date, 1)
+        append_sync_history(stmt_doc, txn_dicts, json_data, start_date, end_date, source="Mock")
+        stmt_doc.save(ignore_permissions=True)
+
+        return {
+            "ok": True,
+            "tan_required": False,
+            "message": _("{0} mock transaction(s) generated, {1} imported.").format(
+                len(txn_dicts), len(new_transactions))
+        }
+
+    def submit_tan(self, docname=None, user_tan=None):
+        return self.fetch_transactions(docname)
+
+
+def get_mock_statement(docname=None):
+    """
+        Returns the statement import document of a mock step.
+    """
+    if not docname:
+        frappe.throw(_("Missing docname."))
+
+    stmt_doc = frappe.get_doc("FinTS Statement Import", docname)
+    if not stmt_doc.fints_account:
+        frappe.throw(_("No FinTS Account set."))
+    return stmt_doc
+
+
+def get_mock_transactions(bank_account=None, date=None):
+    """
+        Returns the synthetic transactions of one day in the shape of the mt940 JSON.
+        They are seeded by bank account and date, so a refetch yields the same hashes and is deduplicated.
+    """
+    seed = hashlib.sha256("{0}|{1}".format(bank_account, date).encode("utf-8")).hexdigest()
+    rng = random.Random(seed)
+    transactions = []
+    for index in range(rng.randint(0, MOCK_TRANSACTIONS_PER_DAY)):
+        name, iban, purpose = rng.choice(MOCK_COUNTERPARTIES)
+        status = rng.choice(("C", "D"))
+        amount = "{0:.2f}".format(rng.randint(100, 250000) / 100)
+        transactions.append({
+            "status": status,
+            "amount": {"amount": ("-" if status == "D" else "") + amount, "currency": "EUR"},
+            "date": str(date),
+            "entry_date": str(date),
+            "posting_text": "MOCK",
+            "purpose": "{0} {1}".format(purpose, seed[index * 8:index * 8 + 8].upper()),
+            "applicant_name": name,
+            "applicant_iban": iban,
+            "end_to_end_reference": "MOCK-{0}-{1}".format(seed[:12], index),
+        })
+    return transactions
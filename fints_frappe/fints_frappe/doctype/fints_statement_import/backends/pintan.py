@@ -0,0 +1,526 @@
+import frappe
+import base64
+import traceback
+
+from frappe import _
+
+# python-fints
+from fints.client import FinTS3PinTanClient, NeedTANResponse, NeedRetryResponse
+
+from fints_frappe.fints_frappe.doctype.fints_bank_capability.fints_bank_capability import (
+    get_bank_capability, record_client_capabilities)
+from fints_frappe.fints_frappe.doctype.fints_statement_import.backends import BankBackend
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_helpers import (
+    backfill_transactions, fetch_statement, get_fetch_window, pause_dialog_for_tan, send_statement_tan,
+    transactions_manage_response)
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_quota import count_bank_access
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_recorder import (
+    record_bank_responses, record_call)
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_statement_import import reset_connection
+
+
+class PinTanBackend(BankBackend):
+    """
+        python-fints FinTS 3.0 PIN/TAN driver. The client state and the paused dialog live on the statement import.
+    """
+    name = "PIN/TAN"
+
+    def fetch_tan_mechanisms(self, docname=None):
+        """
+            Fetches the TAN mechanisms of the login from the bank. A known bank only contributes its BPD from
+            the capability registry, the mechanisms are always fetched for the login.
+        """
+        try:
+            if not docname:
+                frappe.throw(_("Missing docname for FinTS Statement Import."))
+
+            stmt_doc = frappe.get_doc("FinTS Statement Import", docname)
+            if not stmt_doc.fints_account:
+                frappe.throw(_("Please set 'FinTS Account' first."))
+
+            # Grab FinTS Settings
+            fints_doc = frappe.get_doc("FinTS Settings", stmt_doc.fints_account)
+
+            # A bank that is already known (same BLZ and endpoint) doesn't send its BPD again. Only the BPD is shared:
+            # the TAN mechanisms, TAN media, UPD and system ID belong to the login and are fetched for it below.
+            capability = get_bank_capability(fints_doc)
+            shared_bpd = base64.b64decode(capability.bpd_state) if capability and capability.bpd_state else None
+
+            # Brand new FinTS Client
+            client = FinTS3PinTanClient(
+                bank_identifier=fints_doc.blz,
+                user_id=fints_doc.username,
+                pin=fints_doc.get_password("password"),
+                server=fints_doc.endpoint_url,
+                product_id=fints_doc.get_password("product_id"),
+                from_data=shared_bpd
+            )
+
+            if not client.get_current_tan_mechanism():
+                with count_bank_access(docname):
+                    client.fetch_tan_mechanisms()
+                mechanisms = client.get_tan_mechanisms()  # OrderedDict
+                if len(list(mechanisms.items())) > 1:
+                    # Convert mechs to a list/dict for JSON
+                    mechanism_list = []
+                    for key, val in mechanisms.items():
+                        mechanism_list.append({
+                            "id": key,
+                            "name": val.name or f"Mechanism {key}"
+                        })
+
+                    # Store updated session state of this client
+                    # including_private=True represents
+                    # When you restore the client later, it knows everything, including account details.
+                    # it will store the bank information in the state
+                    new_data = client.deconstruct(including_private=True)
+                    stmt_doc.from_data_state = base64.b64encode(new_data).decode("ascii")
+                    stmt_doc.save(ignore_permissions=True)
+                    record_client_capabilities(client, fints_doc, from_data=new_data, mechanisms=mechanism_list,
+                                               tan_medium_required=False)
+
+                    return {
+                        "ok": True,
+                        "mechanisms": mechanism_list,
+                        "message": _("Found {0} TAN mechanism(s).").format(len(mechanism_list))
+                    }
+            if client.selected_tan_medium is None and client.is_tan_media_required():
+                record_client_capabilities(client, fints_doc, tan_medium_required=True)
+                return {
+                    "ok": False,
+                    "mechanisms": [],
+                    "message": _(
+                        "The following bank requires a TAN medium selection mechanism, which will be implemented at a later stage.")
+                }
+        except Exception as e:
+            frappe.throw(str(e))
+
+    def select_tan_mechanism(self, docname=None, mechanism_id=None):
+        """
+            Selects a TAN mechanism on the stored client state.
+        """
+        try:
+            if not docname or not mechanism_id:
+                frappe.throw(_("Missing docname or mechanism_id."))
+
+            # Load docs
+            stmt_doc = frappe.get_doc("FinTS Statement Import", docname)
+            if not stmt_doc.fints_account:
+                frappe.throw(_("No FinTS Account set on doc."))
+
+            fints_doc = frappe.get_doc("FinTS Settings", stmt_doc.fints_account)
+
+            if not stmt_doc.from_data_state:
+                frappe.throw(
+                    _("The mechanism will not be set because there is no saved connection state for the fetch mechanism. Please reset the connection and perform both Step 1 and Step 2 from the beginning."))
+
+            # Possibly restore previous from_data
+            from_data_bytes = base64.b64decode(stmt_doc.from_data_state)
+            client = FinTS3PinTanClient(
+                bank_identifier=fints_doc.blz,
+                user_id=fints_doc.username,
+                pin=fints_doc.get_password("password"),
+                server=fints_doc.endpoint_url,
+                product_id=fints_doc.get_password("product_id"),
+                from_data=from_data_bytes
+            )
+
+            client.set_tan_mechanism(mechanism_id)
+
+            new_data = client.deconstruct(including_private=True)
+            stmt_doc.from_data = base64.b64encode(new_data).decode("ascii")
+
+            stmt_doc.mechanism_connected = True
+            stmt_doc.selected_mechanism_id = mechanism_id
+
+            stmt_doc.save(ignore_permissions=True)
+
+            return {
+                "ok": True,
+                "message": _("TAN mechanism {0} set successfully.").format(mechanism_id)
+            }
+        except Exception as e:
+            # frappe.db.rollback()
+            frappe.logger().error("select_tan_mechanism error: " + traceback.format_exc())
+            frappe.throw(str(e))
+
+    def get_set_account_iban(self, docname=None):
+        """
+            Resumes or opens the dialog and selects the account. Must run under fints_account_lock.
+        """
+        try:
+            if not docname:
+                frappe.throw(_("Missing docname for FinTS Statement Import."))
+
+            stmt_doc = frappe.get_doc("FinTS Statement Import", docname)
+            if not stmt_doc.fints_account:
+                frappe.throw(_("Please set 'FinTS Account' first."))
+
+            # Grab FinTS Settings
+            fints_doc = frappe.get_doc("FinTS Settings", stmt_doc.fints_account)
+
+            if not (stmt_doc.mechanism_connected or stmt_doc.selected_mechanism_id):
+                frappe.throw(
+                    _("Step 1 is missing. The \"Get Account\" function only works if Step 1 is completed. Please first retrieve the mechanisms and assign them."));
+
+            if not stmt_doc.from_data_state:
+                frappe.throw(
+                    _("The account get will not work because there is no saved connection state for the fetch mechanism. Please reset the connection and perform both Step 1 and Step 2 from the beginning."))
+
+            # Possibly restore previous from_data
+            from_data_bytes = base64.b64decode(stmt_doc.from_data_state)
+            f = FinTS3PinTanClient(
+                bank_identifier=fints_doc.blz,
+                user_id=fints_doc.username,
+                pin=fints_doc.get_password("password"),
+                server=fints_doc.endpoint_url,
+                product_id=fints_doc.get_password("product_id"),
+                from_data=from_data_bytes
+            )
+
+            # If there is not any dialog data Open a new session with with client
+            if stmt_doc.from_data_state and not stmt_doc.pause_dialog_state:
+                # Open a new session with the client.
+                with count_bank_access(docname), f:
+                    # Since PSD2, a TAN might be needed for dialog initialization. Let's check if there is one required
+                    # If "f.init_tan_response" exists, it means the bank is waiting for the user to enter a TAN.
+                    if isinstance(f.init_tan_response, NeedTANResponse):
+                        # Once you pause it, you cannot issue any more commands in that session until it's resumed.
+                        # It freezes the current banking session (where you might be in the middle of entering a TAN)
+                        # so you can stop temporarily and resume later without losing progress.
+                        # including_private=True means:
+                        # When you restore the client later, it knows everything, including account details.
+                        # it will store the bank information in the state
+                        dialog_data = f.pause_dialog()
+                        from_data = f.deconstruct(including_private=True)
+                        tan_response_data = f.init_tan_response.get_data()  # Return a compressed datablob representing this object.
+
+                        # Convert to Base64 for easy storage
+                        from_data_encoded = base64.b64encode(from_data).decode("ascii")
+                        dialog_data_encoded = base64.b64encode(dialog_data).decode("ascii")
+                        tan_data_encoded = base64.b64encode(tan_response_data).decode("ascii")
+
+                        # Challenge & Decoupled
+                        challenge = f.init_tan_response.challenge or "A TAN is Required"
+                        decoupled = f.init_tan_response.decoupled
+
+                        # Save the state in the
+                        stmt_doc.from_data_state = from_data_encoded
+                        stmt_doc.pause_dialog_state = dialog_data_encoded
+                        stmt_doc.tan_data_response = tan_data_encoded
+                        stmt_doc.challenge = challenge
+                        stmt_doc.save(ignore_permissions=True)
+
+                        # Decoupled means: the TAN is handled separately (outside your app).
+                        # You don’t need to enter the TAN manually because it is confirmed in
+                        # another place, like your bank’s mobile app.
+                        return {
+                            "ok": False,  # required
+                            "tan_required": True,  # required
+                            "message": "A Tan is required",  # required
+                            "challenge": challenge,
+                            "decoupled": decoupled
+                        }
+                    else:
+                        accounts = f.get_sepa_accounts()
+
+                        if isinstance(accounts, NeedTANResponse):
+                            dialog_data = f.pause_dialog()
+                            from_data = f.deconstruct(including_private=True)
+                            tan_response_data = accounts.get_data()
+
+                            # Convert to Base64 for easy storage
+                            from_data_encoded = base64.b64encode(from_data).decode("ascii")
+                            dialog_data_encoded = base64.b64encode(dialog_data).decode("ascii")
+                            tan_data_encoded = base64.b64encode(tan_response_data).decode("ascii")
+
+                            # Challenge & Decoupled
+                            challenge = f.init_tan_response.challenge or "A TAN is Required"
+                            decoupled = f.init_tan_response.decoupled
+
+                            # Save the state in the
+                            stmt_doc.from_data_state = from_data_encoded
+                            stmt_doc.pause_dialog_state = dialog_data_encoded
+                            stmt_doc.tan_data_response = tan_data_encoded
+                            stmt_doc.challenge = challenge
+                            stmt_doc.save(ignore_permissions=True)
+
+                            # Decoupled means: the TAN is handled separately (outside your app).
+                            # You don’t need to enter the TAN manually because it is confirmed in
+                            # another place, like your bank’s mobile app.
+                            return {
+                                "ok": False,  # required
+                                "tan_required": True,  # required
+                                "message": "A Tan is required",  # required
+                                "challenge": challenge,
+                                "decoupled": decoupled
+                            }
+                        else:
+                            account = accounts[0]
+
+                            dialog_data = f.pause_dialog()
+                            from_data = f.deconstruct(including_private=True)
+                            # Convert to Base64 for easy storage
+                            from_data_encoded = base64.b64encode(from_data).decode("ascii")
+                            dialog_data_encoded = base64.b64encode(dialog_data).decode("ascii")
+                            # Save the state in the
+                            stmt_doc.account_get = True
+                            stmt_doc.selected_account_iban = account.iban
+                            stmt_doc.from_data_state = from_data_encoded
+                            stmt_doc.pause_dialog_state = dialog_data_encoded
+                            stmt_doc.save(ignore_permissions=True)
+                            return {
+                                "ok": True,
+                                "tan_required": False,
+                                "message": "The account {0} has been selected.".format(account.iban)
+                            }
+            else:
+                # Restore the previous pause session
+                dialog_data_bytes = base64.b64decode(stmt_doc.pause_dialog_state)
+                with count_bank_access(docname), f.resume_dialog(dialog_data_bytes):
+                    accounts = f.get_sepa_accounts()
+
+                    if isinstance(accounts, NeedTANResponse):
+                        dialog_data = f.pause_dialog()
+                        from_data = f.deconstruct(including_private=True)
+                        tan_response_data = accounts.get_data()
+
+                        # Convert to Base64 for easy storage
+                        from_data_encoded = base64.b64encode(from_data).decode("ascii")
+                        dialog_data_encoded = base64.b64encode(dialog_data).decode("ascii")
+                        tan_data_encoded = base64.b64encode(tan_response_data).decode("ascii")
+
+                        # Challenge & Decoupled
+                        challenge = f.init_tan_response.challenge or "A TAN is Required"
+                        decoupled = f.init_tan_response.decoupled
+
+                        # Save the state in the
+                        stmt_doc.from_data_state = from_data_encoded
+                        stmt_doc.pause_dialog_state = dialog_data_encoded
+                        stmt_doc.tan_data_response = tan_data_encoded
+                        stmt_doc.challenge = challenge
+                        stmt_doc.save(ignore_permissions=True)
+
+                        # Decoupled means: the TAN is handled separately (outside your app).
+                        # You don’t need to enter the TAN manually because it is confirmed in
+                        # another place, like your bank’s mobile app.
+                        return {
+                            "ok": False,  # required
+                            "tan_required": True,  # required
+                            "message": "A Tan is required",  # required
+                            "challenge": challenge,
+                            "decoupled": decoupled
+                        }
+                    else:
+                        account = accounts[0]
+
+                        dialog_data = f.pause_dialog()
+                        from_data = f.deconstruct(including_private=True)
+                        # Convert to Base64 for easy storage
+                        from_data_encoded = base64.b64encode(from_data).decode("ascii")
+                        dialog_data_encoded = base64.b64encode(dialog_data).decode("ascii")
+                        # Save the state in the
+                        stmt_doc.account_get = True
+                        stmt_doc.selected_account_iban = account.iban
+                        stmt_doc.from_data_state = from_data_encoded
+                        stmt_doc.pause_dialog_state = dialog_data_encoded
+                        stmt_doc.save(ignore_permissions=True)
+                        return {
+                            "ok": True,
+                            "tan_required": False,
+                            "message": "The account {0} has been selected.".format(account.iban)
+                        }
+        except Exception as e:
+            frappe.db.rollback()
+            reset_connection(docname)
+            frappe.throw(str(e))
+
+    def fetch_transactions(self, docname=None, unattended=False):
+        """
+            Resumes the paused dialog and fetches the transactions. Must run under fints_account_lock.
+            unattended counts the dialog as an automated access.
+        """
+        try:
+            if not docname:
+                frappe.throw(_("Missing docname."))
+
+            stmt_doc = frappe.get_doc("FinTS Statement Import", docname)
+            if not stmt_doc.fints_account:
+                frappe.throw(_("No FinTS Account set."))
+
+            fints_doc = frappe.get_doc("FinTS Settings", stmt_doc.fints_account)
+
+            if not (stmt_doc.mechanism_connected or stmt_doc.account_get
+                    or stmt_doc.selected_mechanism_id or stmt_doc.selected_account_iban):
+                frappe.throw(
+                    _("To fetch transactions, both Step 1 and Step 2 are required. Please complete these steps before fetching transactions."))
+
+            if not (stmt_doc.from_data_state or stmt_doc.pause_dialog_state):
+                frappe.throw(
+                    _("To fetch transactions, ensure that the previous connection state and dialog state are saved. If not, first reset the connection and perform both Step 1 and Step 2 from the beginning."))
+
+            start_date, end_date = get_fetch_window(stmt_doc, fints_doc)
+            if stmt_doc.transaction_mode == "Backfill" and start_date > end_date:
+                return {
+                    "ok": True,
+                    "tan_required": False,
+                    "message": _("The backfill up to {0} has already been completed.").format(end_date)
+                }
+
+            # Here it means both mechanism has been done and the FinTS state and Dialog pause state exists
+            from_data_bytes = base64.b64decode(stmt_doc.from_data_state)
+            dialog_data_bytes = base64.b64decode(stmt_doc.pause_dialog_state)
+            f = FinTS3PinTanClient(
+                bank_identifier=fints_doc.blz,
+                user_id=fints_doc.username,
+                pin=fints_doc.get_password("password"),
+                server=fints_doc.endpoint_url,
+                product_id=fints_doc.get_password("product_id"),
+                from_data=from_data_bytes
+            )
+
+            with count_bank_access(docname, unattended), \
+                    record_bank_responses(f, stmt_doc, fints_doc, dialog_data_bytes), \
+                    f.resume_dialog(dialog_data_bytes):
+                record_call(f, "get_sepa_accounts")
+                accounts = f.get_sepa_accounts()
+
+                if isinstance(accounts, NeedTANResponse):
+                    dialog_data = f.pause_dialog()
+                    from_data = f.deconstruct(including_private=True)
+                    tan_response_data = accounts.get_data()
+
+                    # Convert to Base64 for easy storage
+                    from_data_encoded = base64.b64encode(from_data).decode("ascii")
+                    dialog_data_encoded = base64.b64encode(dialog_data).decode("ascii")
+                    tan_data_encoded = base64.b64encode(tan_response_data).decode("ascii")
+
+                    # Challenge & Decoupled
+                    challenge = f.init_tan_response.challenge or "A TAN is Required"
+                    decoupled = f.init_tan_response.decoupled
+
+                    # Save the state in the
+                    stmt_doc.from_data_state = from_data_encoded
+                    stmt_doc.pause_dialog_state = dialog_data_encoded
+                    stmt_doc.tan_data_response = tan_data_encoded
+                    stmt_doc.challenge = challenge
+                    stmt_doc.save(ignore_permissions=True)
+
+                    # Decoupled means: the TAN is handled separately (outside your app).
+                    # You don’t need to enter the TAN manually because it is confirmed in
+                    # another place, like your bank’s mobile app.
+                    return {
+                        "ok": False,  # required
+                        "tan_required": True,  # required
+                        "message": "A Tan is required",  # required
+                        "challenge": challenge,
+                        "decoupled": decoupled
+                    }
+                else:
+                    account = accounts[0]
+
+                    if stmt_doc.transaction_mode == "Backfill":
+                        return backfill_transactions(f, fints_doc, stmt_doc, account)
+
+                    # We will Fetch the transactions
+                    transactions = fetch_statement(f, fints_doc, account, start_date, end_date)
+                    if isinstance(transactions, NeedTANResponse):
+                        dialog_data = f.pause_dialog()
+                        from_data = f.deconstruct(including_private=True)
+                        tan_response_data = transactions.get_data()
+
+                        # Convert to Base64 for easy storage
+                        from_data_encoded = base64.b64encode(from_data).decode("ascii")
+                        dialog_data_encoded = base64.b64encode(dialog_data).decode("ascii")
+                        tan_data_encoded = base64.b64encode(tan_response_data).decode("ascii")
+
+                        # Challenge & Decoupled
+                        challenge = transactions.challenge or "A TAN is Required"
+                        decoupled = transactions.decoupled
+
+                        # Save the state in the
+                        stmt_doc.from_data_state = from_data_encoded
+                        stmt_doc.pause_dialog_state = dialog_data_encoded
+                        stmt_doc.tan_data_response = tan_data_encoded
+                        stmt_doc.challenge = challenge
+                        stmt_doc.save(ignore_permissions=True)
+
+                        # Decoupled means: the TAN is handled separately (outside your app).
+                        # You don’t need to enter the TAN manually because it is confirmed in
+                        # another place, like your bank’s mobile app.
+                        return {
+                            "ok": False,  # required
+                            "tan_required": True,  # required
+                            "message": "A Tan is required",  # required
+                            "challenge": challenge,
+                            "decoupled": decoupled
+                        }
+                    else:
+                        return transactions_manage_response(f, fints_doc, stmt_doc, transactions, start_date, end_date,
+                                                            account=account)
+        except Exception as e:
+            # reset_connection commits, nothing of the failed run (half a batch, its outbox event) may go with it
+            frappe.db.rollback()
+            reset_connection(docname)
+            return {
+                "ok": False,
+                "message": "An error occurred while fetching transactions. The connection has been reset. Please try again."
+            }
+
+    def submit_tan(self, docname=None, user_tan=None):
+        """
+            Resumes the paused dialog and sends the TAN. Must run under fints_account_lock.
+        """
+        try:
+            if not docname:
+                frappe.throw(_("The docname is required."))
+            if not user_tan:
+                frappe.throw(_("The User TAN is required."))
+
+            if not frappe.db.exists("FinTS Statement Import", docname):
+                frappe.throw(_("The docname has not been found."))
+
+            stmt_doc = frappe.get_doc("FinTS Statement Import", docname)
+            if not stmt_doc.fints_account or not frappe.db.exists("FinTS Settings", stmt_doc.fints_account):
+                frappe.throw(_("No valid FinTS Account on the Statement Import doc."))
+
+            fints_doc = frappe.get_doc("FinTS Settings", stmt_doc.fints_account)
+
+            if not (stmt_doc.pause_dialog_state or stmt_doc.from_data_state or stmt_doc.tan_data_response):
+                frappe.throw(
+                    _("The system has not found any TAN state, Pause Dialog state or FinTS State for the submission. Please reset the connection to establish a fresh connection."))
+
+            from_data_bytes = base64.b64decode(stmt_doc.from_data_state)
+            dialog_data_bytes = base64.b64decode(stmt_doc.pause_dialog_state)
+            tan_data_bytes = base64.b64decode(stmt_doc.tan_data_response)
+
+            f = FinTS3PinTanClient(
+                bank_identifier=fints_doc.blz,
+                user_id=fints_doc.username,
+                pin=fints_doc.get_password("password"),
+                server=fints_doc.endpoint_url,
+                product_id=fints_doc.get_password("product_id"),
+                from_data=from_data_bytes
+            )
+
+            # Recreate the NeedTANResponse object
+            tan_request = NeedRetryResponse.from_data(tan_data_bytes)
+
+            with count_bank_access(docname), \
+                    record_bank_responses(f, stmt_doc, fints_doc, dialog_data_bytes, tan=user_tan), \
+                    f.resume_dialog(dialog_data_bytes):
+                try:
+                    transactions = send_statement_tan(f, fints_doc, tan_request, user_tan)
+                    if isinstance(transactions, NeedTANResponse):
+                        # Decoupled and not confirmed in the banking app yet, the user submits again
+                        return pause_dialog_for_tan(f, stmt_doc, transactions)
+                    return transactions_manage_response(f, fints_doc, stmt_doc, transactions,
+                                                        start_date=tan_request.command_seg.date_start,
+                                                        end_date=tan_request.command_seg.date_end, is_tan_response=True)
+                except Exception as e:
+                    msg = "Oops! An error occurred while sending the TAN. The system has automatically reset the connection. Please start fresh from the beginning."
+                    frappe.throw(msg)
+        except Exception as e:
+            frappe.db.rollback()
+            reset_connection(docname)
+            frappe.throw(str(e))
@@ -0,0 +1,258 @@
+import frappe
+from frappe import _
+from frappe.utils import getdate
+
+import os
+import json
+import mmap
+import traceback
+import xml.etree.ElementTree as ElementTree
+
+from fints_frappe.fints_frappe.doctype.fints_pending_transaction.fints_pending_transaction import (
+    store_pending_transactions)
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_helpers import (
+    append_sync_history, get_company_info, import_prepared_transactions)
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_lock import (
+    FinTSSyncInProgressError, fints_account_lock)
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_parallel import (
+    prepare_chunks, prepare_dict_chunk, prepare_mt940_chunk)
+
+# Statements are parsed and imported in chunks of about this size, a chunk never splits a statement
+CHUNK_BYTES = 2 * 1024 * 1024
+# CAMT entries per imported chunk
+CAMT_CHUNK_ENTRIES = 2000
+# Only booked CAMT entries become Bank Transactions, pending ones are staged, anything else (INFO) is skipped
+CAMT_BOOKED = "BOOK"
+CAMT_PENDING = "PDNG"
+# A job can wait longer than a click for the running sync of the account
+FILE_IMPORT_LOCK_WAIT = 600
+
+
+def import_statement_file(docname=None):
+    """
+        Imports the attached MT940/STA or CAMT file of a 'FinTS Statement Import' document.
+        The file is read from disk chunk by chunk (memory-mapped for MT940, iterparse for CAMT) and every chunk
+        goes through the same hash, dedup and insert path as a FinTS fetch. Each chunk is committed.
+        Pending CAMT entries (camt.052) replace the staged pending transactions of the account, like a fetch does.
+        Must run under fints_account_lock, a concurrent sync would check the same hashes and insert them twice.
+        Args:
+            docname (str): The name of the 'FinTS Statement Import' document.
+        Returns:
+            dict: Response with the number of parsed and inserted transactions.
+    """
+    stmt_doc = frappe.get_doc("FinTS Statement Import", docname)
+    fints_doc = frappe.get_doc("FinTS Settings", stmt_doc.fints_account)
+    file_doc = frappe.get_doc("File", {"file_url": stmt_doc.statement_file})
+    path = file_doc.get_full_path()
+
+    summary = {"file": file_doc.file_name, "format": detect_statement_format(path), "chunks": 0, "parsed": 0,
+               "inserted": 0, "start_date": None, "end_date": None}
+
+    # Parsing, hashing and mapping run in a process pool, chunk results come back in file order
+    company_info = get_company_info(fints_doc)
+    pending = []
+    if summary["format"] == "CAMT":
+        prepared = prepare_chunks(prepare_dict_chunk, iter_camt_chunks(path, pending=pending), company_info)
+    else:
+        prepared = prepare_chunks(prepare_mt940_chunk, iter_mt940_text_chunks(path), company_info)
+
+    for txn_dicts, rows in prepared:
+        if not txn_dicts:
+            continue
+        _, new_transactions = import_prepared_transactions(txn_dicts, rows, company_info)
+        summary["chunks"] += 1
+        summary["parsed"] += len(txn_dicts)
+        summary["inserted"] += len(new_transactions)
+        for txn_dict in txn_dicts:
+            if txn_dict.get("date"):
+                date = str(getdate(txn_dict.get("date")))
+                summary["start_date"] = min(summary["start_date"] or date, date)
+                summary["end_date"] = max(summary["end_date"] or date, date)
+        frappe.db.commit()
+
+    # After the booked import, pending items that booked in the file are promoted already.
+    # A file without pending entries (camt.053, MT940) says nothing about them and leaves them staged.
+    if pending:
+        store_pending_transactions(pending, fints_doc)
+        summary["pending"] = len(pending)
+
+    # Reload, a sync may have saved the document while the file was imported
+    stmt_doc = frappe.get_doc("FinTS Statement Import", docname)
+    append_sync_history(stmt_doc, summary["parsed"], json.dumps(summary, indent=4),
+                        summary["start_date"], summary["end_date"], source="File")
+    stmt_doc.save(ignore_permissions=True)
+    frappe.db.commit()
+
+    return {
+        "ok": True,
+        "message": _("{0} transaction(s) parsed, {1} imported from {2}.").format(
+            summary["parsed"], summary["inserted"], file_doc.file_name)
+    }
+
+
+def import_statement_file_job(docname=None):
+    """
+        Background job around import_statement_file, holds the lock of the FinTS account while it runs.
+        Errors, and a sync that holds the account longer than FILE_IMPORT_LOCK_WAIT, go to the Error Log.
+    """
+    try:
+        with fints_account_lock(docname, wait=FILE_IMPORT_LOCK_WAIT):
+            import_statement_file(docname)
+    except FinTSSyncInProgressError:
+        frappe.log_error(title="FinTS Statement File Import",
+                         message=_("A sync of {0} was still running, please import the file again.").format(docname))
+    except Exception:
+        frappe.db.rollback()
+        frappe.log_error(title="FinTS Statement File Import", message=traceback.format_exc())
+
+
+def detect_statement_format(path=None):
+    """
+        Returns 'CAMT' for XML files and 'MT940' for everything else, based on the first bytes.
+    """
+    with open(path, "rb") as fh:
+        head = fh.read(512).lstrip(b"\xef\xbb\xbf \r\n\t")
+    return "CAMT" if head.startswith(b"<") else "MT940"
+
+
+def iter_mt940_text_chunks(path=None, chunk_bytes=CHUNK_BYTES):
+    """
+        Yields the text of an MT940/STA file in chunks that never split a statement.
+        The file is memory-mapped, only the current chunk is decoded.
+        Args:
+            path (str): Full path of the file.
+            chunk_bytes (int): Approximate size of a chunk.
+        Yields:
+            str: The MT940 text of one chunk.
+    """
+    if not os.path.getsize(path):
+        return
+
+    with open(path, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        chunk_start = 0
+        while chunk_start < len(mm):
+            chunk_end = find_statement_boundary(mm, chunk_start + chunk_bytes)
+            # MT940 is S.W.I.F.T charset, a subset of ISO 8859 (same choice as python-fints)
+            yield mm[chunk_start:chunk_end].decode("iso-8859-1")
+            chunk_start = chunk_end
+
+
+def find_statement_boundary(mm=None, position=0):
+    """
+        Returns the offset of the first statement start (a line beginning with ':20:') at or after position,
+        or the end of the file.
+    """
+    if position >= len(mm):
+        return len(mm)
+    found = mm.find(b"\n:20:", position)
+    return len(mm) if found == -1 else found + 1
+
+
+def iter_camt_chunks(path=None, chunk_entries=CAMT_CHUNK_ENTRIES, pending=None):
+    """
+        Yields the booked entries (Ntry) of a CAMT.052/053 file as transaction dictionaries, chunk by chunk.
+        The XML is stream-parsed, every processed entry is cleared from the tree.
+        Args:
+            path (str): Full path of the file.
+            chunk_entries (int): Booked entries per chunk.
+            pending (list): Receives the pending entries as transaction dictionaries, they are dropped if not given.
+        Yields:
+            list: Transaction dictionaries in the shape of the mt940 JSON export.
+    """
+    chunk = []
+    # Open elements, the parent of a finished entry is the last one
+    stack = []
+    for event, element in ElementTree.iterparse(path, events=("start", "end")):
+        if event == "start":
+            stack.append(element)
+            continue
+        stack.pop()
+        if local_name(element.tag) != "Ntry":
+            continue
+
+        status = get_entry_status(element)
+        if status == CAMT_BOOKED:
+            chunk.append(camt_entry_to_dict(element))
+        elif status == CAMT_PENDING and pending is not None:
+            pending.append(camt_entry_to_dict(element))
+        # Drop the entry from the tree, memory stays flat however many entries the file has
+        if stack:
+            stack[-1].remove(element)
+        if len(chunk) >= chunk_entries:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def get_entry_status(entry=None):
+    """
+        Returns the status of a CAMT entry: BOOK, PDNG, INFO, ...
+        Up to version 06 it is the text of Sts, since then the code in Sts/Cd. Sts is mandatory, an entry without
+        one is taken as booked.
+    """
+    return (find_text(entry, "Sts/Cd") or find_text(entry, "Sts") or CAMT_BOOKED).upper()
+
+
+def local_name(tag=None):
+    """
+        Strips the XML namespace from a tag.
+    """
+    return tag.rsplit("}", 1)[-1]
+
+
+def find_text(element=None, path=None):
+    """
+        Returns the text of the first descendant matching a '/' separated path of local names.
+    """
+    texts = find_texts(element, path)
+    return texts[0] if texts else ""
+
+
+def find_texts(element=None, path=None):
+    """
+        Returns the texts of all descendants matching a '/' separated path of local names, in document order.
+    """
+    current = [element]
+    for name in path.split("/"):
+        current = [child for parent in current for child in parent if local_name(child.tag) == name]
+    return [(child.text or "").strip() for child in current]
+
+
+def camt_entry_to_dict(entry=None):
+    """
+        Maps a CAMT entry to the keys create_and_check_bank_transaction_entry reads from the mt940 JSON.
+        The hash is taken from the canonical transaction (see get_canonical_transaction), so a booking imported
+        from a CAMT file and fetched as MT940 is only created once.
+        A batch booking is one entry with a TxDtls per transaction. MT940 books it as one line, so it stays one
+        transaction here too (and keeps the same hash); counterparty and references come from its first TxDtls
+        and the remittance lines of all of them form the purpose.
+    """
+    status = "D" if find_text(entry, "CdtDbtInd") == "DBIT" else "C"
+    amount_element = next((child for child in entry if local_name(child.tag) == "Amt"), None)
+    amount = (amount_element.text or "0").strip() if amount_element is not None else "0"
+    currency = amount_element.get("Ccy") if amount_element is not None else None
+
+    # The counterparty is the debtor of a credit and the creditor of a debit
+    party = "Dbtr" if status == "C" else "Cdtr"
+    details = "NtryDtls/TxDtls"
+    return {
+        "status": status,
+        "amount": {"amount": ("-" if status == "D" else "") + amount, "currency": currency},
+        "date": find_text(entry, "ValDt/Dt") or find_text(entry, "BookgDt/Dt"),
+        "entry_date": find_text(entry, "BookgDt/Dt"),
+        "bank_reference": find_text(entry, "AcctSvcrRef"),
+        "posting_text": find_text(entry, "AddtlNtryInf"),
+        # Unstructured remittance may come in several lines, MT940 has them as one purpose
+        "purpose": " ".join(find_texts(entry, details + "/RmtInf/Ustrd")),
+        "applicant_name": find_text(entry, details + "/RltdPties/" + party + "/Nm"),
+        "applicant_iban": find_text(entry, details + "/RltdPties/" + party + "Acct/Id/IBAN"),
+        "applicant_bin": find_text(entry, details + "/RltdAgts/" + party + "Agt/FinInstnId/BIC")
+                         or find_text(entry, details + "/RltdAgts/" + party + "Agt/FinInstnId/BICFI"),
+        "end_to_end_reference": find_text(entry, details + "/Refs/EndToEndId"),
+        "customer_reference": find_text(entry, details + "/Refs/MsgId"),
+        "applicant_creditor_id": find_text(entry, details + "/RltdPties/Cdtr/Id/PrvtId/Othr/Id")
+                                 if find_text(entry, details + "/RltdPties/Cdtr/Id/PrvtId/Othr/SchmeNm/Prtry") == "SEPA"
+                                 else "",
+        "purpose_code": find_text(entry, details + "/Purp/Cd"),
+    }
@@ -1,14 +1,48 @@
 import frappe
-from frappe.utils import now_datetime
+from frappe import _
+from frappe.utils import add_days, cint, date_diff, flt, getdate, now_datetime, today
 
+import re
 import json
 import base64
-import hashlib
-import mt940
+import traceback
+
+from fints_frappe.fints_frappe.doctype.fints_bank_capability.fints_bank_capability import (
+    get_bank_capability, get_statement_command, record_client_capabilities)
+from fints_frappe.fints_frappe.doctype.fints_balance_snapshot.fints_balance_snapshot import (
+    invalidate_balance_cache, record_balance_snapshot)
+from fints_frappe.fints_frappe.doctype.fints_pending_transaction.fints_pending_transaction import (
+    promote_pending_transactions, store_pending_transactions)
+from fints_frappe.fints_frappe.doctype.fints_transaction_aggregate.fints_transaction_aggregate import (
+    update_transaction_aggregates)
+from fints_frappe.fints_frappe.doctype.fints_transaction_event.fints_transaction_event import (
+    record_transaction_event)
+from fints_frappe.fints_frappe.doctype.fints_transaction_rule.fints_transaction_rule import get_rule_matcher
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_parallel import (
+    map_bank_transaction, prepare_transactions)
+
+# Most banks reject or time out on HKKAZ windows much longer than a quarter
+DEFAULT_BACKFILL_CHUNK_DAYS = 90
+# Realtime event of the backfill job, published to the open forms of the statement import
+BACKFILL_PROGRESS_EVENT = "fints_backfill_progress"
+# How far back a sync may reach for its checkpoint if the bank announces no storage period (PSD2 SCA exemption)
+DEFAULT_SYNC_REACH_DAYS = 90
+# Opening (:60F:/:60M:) and closing (:62F:/:62M:) balance tags of an MT940 statement, "@@" separates lines in FinTS
+BALANCE_TAG_RE = re.compile(r"(?:^|[\r\n@]):(?P<tag>6[02])[FM]:(?P<status>[DC])(?P<year>\d{2})(?P<month>\d{2})"
+                            r"(?P<day>\d{2})(?P<currency>[A-Z]{3})(?P<amount>[0-9,]{1,16})")
+
+
+class StatementTransactions(list):
+    """
+        The booked transactions of an HKKAZ response, with the pending (pre-booked) ones next to them
+        and the opening and closing balance of every statement.
+    """
+    pending = None
+    balances = None
 
 
 def transactions_manage_response(f=None, fints_doc=None, stmt_doc=None, transactions=None,
-                                 start_date=None, end_date=None, is_tan_response=False):
+                                 start_date=None, end_date=None, is_tan_response=False, account=None):
     """
         Processes and manages the response for fetched transactions from a FinTS session.
         Args:
@@ -19,152 +53,626 @@ def transactions_manage_response(f=None, fints_doc=None, stmt_doc=None, transact
             start_date (date): The start date of the transaction period (datetime.date).
             end_date (date): The end date of the transaction period (datetime.date).
             is_tan_response (bool): Flag indicating if this response is part of a TAN request.
+            account (SEPAAccount): The account of the resumed dialog. If given, the balance is fetched as well.
         Returns:
             dict: Response containing success status and TAN requirement.
     """
-    print("\n\n Found", len(transactions), "transactions \n\n")
-    print("\n\n Transactions raw format:", transactions, "\n\n")
+    # Commands MUST NOT be issued after pause_dialog(), so the balance rides on the same dialog here
+    balance = fetch_balance(f, account) if account else None
 
-    json_data = json.dumps(transactions, cls=mt940.JSONEncoder, indent=4)
-    print(f"\n\n json_data:{json_data} \n\n")
     # Save the Dialog State for the future operations
     dialog_data = f.pause_dialog()
     from_data = f.deconstruct(including_private=True)
     # Convert to Base64 for easy storage
     from_data_encoded = base64.b64encode(from_data).decode("ascii")
     dialog_data_encoded = base64.b64encode(dialog_data).decode("ascii")
-    # ==================================
-    # Hash each JSON object
-    # ==================================
-    company_info = {
+
+    # Whatever the dialog taught us about the bank (newer BPD, touchdown pages) goes to the registry
+    record_client_capabilities(f, fints_doc, from_data=from_data,
+                               touchdown_pages=getattr(f, "_touchdown_counter", 1) - 1)
+
+    json_data, new_transactions = import_transactions(transactions, fints_doc)
+
+    if stmt_doc.transaction_mode == "Backfill":
+        # Historical chunks never move the closing balance checkpoint, only the backfill checkpoint
+        closing_balance = None
+        continuity_status = ""
+        stmt_doc.backfill_next_date = add_days(end_date, 1)
+    else:
+        # Statement balances: verify continuity against the previous sync before moving the checkpoint
+        closing_balance = get_final_closing_balance(transactions)
+        continuity_status = check_balance_continuity(stmt_doc, closing_balance, getattr(transactions, "balances", None),
+                                                     start_date)
+        # After the booked import: pending items that booked in this response are promoted already
+        store_pending_transactions(getattr(transactions, "pending", None), fints_doc)
+
+    append_sync_history(stmt_doc, transactions, json_data, start_date, end_date,
+                        closing_balance=closing_balance, continuity_status=continuity_status)
+    record_balance_snapshot(balance, fints_doc=fints_doc, stmt_doc=stmt_doc)
+    # A new sync makes the cached balance stale
+    invalidate_balance_cache(fints_doc.bank_account)
+    stmt_doc.from_data_state = from_data_encoded
+    stmt_doc.pause_dialog_state = dialog_data_encoded
+    if is_tan_response:
+        stmt_doc.tan_data_response = ""
+        stmt_doc.challenge = ""
+    stmt_doc.save(ignore_permissions=True)
+
+    return {
+        "ok": True,
+        "tan_required": False,
+        "message": "The transactions have been fetched."
+    }
+
+
+def fetch_statement(f=None, fints_doc=None, account=None, start_date=None, end_date=None, hkkaz=None):
+    """
+        Fetches the transactions of an account like FinTS3PinTanClient.get_transactions, but keeps the
+        pending transactions of the response apart from the booked ones.
+        Args:
+            f (FinTS3PinTanClient): The FinTS client handling the session.
+            fints_doc (Document): The 'FinTS Settings' document instance.
+            account (SEPAAccount): The account to fetch.
+            start_date (date): First day to fetch.
+            end_date (date): Last day to fetch.
+            hkkaz (type): The HKKAZ segment class, looked up for the bank if not given.
+        Returns:
+            StatementTransactions|NeedTANResponse: The booked transactions or the TAN challenge.
+    """
+    from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_recorder import record_call
+
+    hkkaz = hkkaz or get_statement_command(f, fints_doc)
+    record_call(f, "fetch_statement", start_date=str(start_date), end_date=str(end_date), hkkaz_version=hkkaz.VERSION)
+    with f._get_dialog() as dialog:
+        return f._fetch_with_touchdowns(
+            dialog,
+            lambda touchdown: hkkaz(
+                account=hkkaz._fields['account'].type.from_sepa_account(account),
+                all_accounts=False,
+                date_start=start_date,
+                date_end=end_date,
+                touchdown_point=touchdown,
+            ),
+            process_statement_responses,
+            'HIKAZ'
+        )
+
+
+def send_statement_tan(f=None, fints_doc=None, tan_request=None, user_tan=None, hkkaz=None):
+    """
+        Sends the TAN of a paused statement request (HKKAZ) in the resumed dialog and fetches the statement,
+        following its touchdowns like fetch_statement.
+        Args:
+            f (FinTS3PinTanClient): The FinTS client of the resumed dialog.
+            fints_doc (Document): The 'FinTS Settings' document instance.
+            tan_request (NeedRetryResponse): The TAN request restored from the statement import.
+            user_tan (str): The TAN entered by the user.
+            hkkaz (type): The HKKAZ segment class, looked up for the bank if not given.
+        Returns:
+            StatementTransactions|NeedTANResponse: The booked transactions or, decoupled, the still open challenge.
+    """
+    from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_recorder import record_call
+
+    # HKKAZ (Kontoauszug Request - Account Statement Request)
+    # This is the request segment sent by the ERPNext to the bank.
+    hkkaz = hkkaz or get_statement_command(f, fints_doc)
+    record_call(f, "send_tan", tan_request=tan_request, hkkaz_version=hkkaz.VERSION)
+
+    # Manually setting the missing attributes before calling send_tan()
+    # HIKAZ => Kontoauszug Response - Account Statement Response
+    # This is the response segment from the bank when requesting an account statement.
+    f._touchdown_args = ['HIKAZ']
+    f._touchdown_kwargs = {}
+    f._touchdown_responses = []
+    f._touchdown_counter = 1
+    f._touchdown_dialog = f._get_dialog()
+    # Booked and pending (vorgemerkte) transactions are parsed separately
+    f._touchdown_response_processor = process_statement_responses
+    f._touchdown_segment_factory = lambda touchdown: hkkaz(
+        account=tan_request.command_seg.account,
+        all_accounts=False,
+        date_start=tan_request.command_seg.date_start,
+        date_end=tan_request.command_seg.date_end,
+        touchdown_point=touchdown,
+    )
+    return f.send_tan(tan_request, user_tan)
+
+
+def process_statement_responses(responses=None):
+    """
+        Touchdown response processor for HIKAZ: parses statement_booked and statement_pending separately.
+        Args:
+            responses (list): The HIKAZ segments of all touchdowns.
+        Returns:
+            StatementTransactions: The booked transactions, the pending ones in .pending, the statement balances
+            in .balances.
+    """
+    from fints.utils import mt940_to_array
+
+    # MT940 is S.W.I.F.T charset, a subset of ISO 8859 (same choice as python-fints)
+    booked = ''.join([seg.statement_booked.decode('iso-8859-1') for seg in responses])
+    transactions = StatementTransactions(mt940_to_array(booked))
+    pending = ''.join([seg.statement_pending.decode('iso-8859-1') for seg in responses if seg.statement_pending])
+    transactions.pending = mt940_to_array(pending) if pending else []
+    # mt940 keeps only the balances of the last statement, continuity needs each one
+    transactions.balances = get_statement_balances(booked)
+    return transactions
+
+
+def get_statement_balances(mt940_data=None):
+    """
+        Returns the opening and closing balance of every statement (or touchdown page) of MT940 data, in order.
+        Args:
+            mt940_data (str): The raw MT940 statements.
+        Returns:
+            list: {"opening": Balance, "closing": Balance} per statement, mt940.models.Balance objects.
+    """
+    from mt940.models import Balance, Date
+
+    balances = []
+    opening = None
+    for match in BALANCE_TAG_RE.finditer(mt940_data or ""):
+        balance = Balance(match.group("status"), match.group("amount"),
+                          Date(year=match.group("year"), month=match.group("month"), day=match.group("day")),
+                          currency=match.group("currency"))
+        if match.group("tag") == "60":
+            opening = balance
+        elif opening is not None:
+            balances.append({"opening": opening, "closing": balance})
+            opening = None
+    return balances
+
+
+def import_transactions(transactions=None, fints_doc=None):
+    """
+        Hashes the fetched transactions and creates the Bank Transactions that do not exist yet.
+        The CPU-bound part (normalise, hash, map) runs in a process pool for large lists in background jobs,
+        see fints_parallel.
+        Args:
+            transactions (list): The list of mt940.models.Transaction objects.
+            fints_doc (Document): The 'FinTS Settings' document instance.
+        Returns:
+            tuple: The (json_data, new_transactions) where json_data is the hashed JSON for the sync history.
+    """
+    company_info = get_company_info(fints_doc)
+    txn_dicts, rows = prepare_transactions(transactions, company_info)
+    return import_prepared_transactions(txn_dicts, rows, company_info)
+
+
+def import_prepared_transactions(txn_dicts=None, rows=None, company_info=None):
+    """
+        Creates the Bank Transactions of transactions prepared by fints_parallel. Only the database work is done here.
+        Args:
+            txn_dicts (list): The hashed transaction dictionaries.
+            rows (list): The Bank Transaction fields of each dictionary, in the same order.
+            company_info (dict): Contains company-related details like company name and bank account.
+        Returns:
+            tuple: The (json_data, new_transactions) where json_data is the hashed JSON for the sync history.
+    """
+    new_transactions = []
+    if len(txn_dicts) > 0:
+        new_transactions = create_and_check_bank_transaction_entry(txn_dicts, company_info=company_info, rows=rows)
+    return json.dumps(txn_dicts, indent=4), new_transactions
+
+
+def get_company_info(fints_doc=None):
+    """
+        Returns the company and bank account the transactions of a FinTS Settings document are booked on.
+    """
+    return {
         "company": fints_doc.company,
         "bank_account": fints_doc.bank_account
     }
-    transactions_unhashed = json.loads(json_data)
-    if len(transactions_unhashed) > 0:
-        for txn_dict in transactions_unhashed:
-            txn_dict["hash"] = get_json_dictionary_hash(txn_dict)
-
-        create_and_check_bank_transaction_entry(transactions_unhashed, company_info=company_info)
-        json_data = json.dumps(transactions_unhashed, indent=4)
-        print(f"\n\n transactions_unhashed:{json_data} \n\n")
-    # ==================================
-    # End - Hash each JSON object
-    # ==================================
 
-    # Save the state in the
+
+def append_sync_history(stmt_doc=None, transactions=None, json_data=None, start_date=None, end_date=None,
+                        closing_balance=None, continuity_status="", source="FinTS"):
+    """
+        Inserts a sync history row and updates the sync meta information of the statement import.
+        The rows are no table field of the statement import: every row carries a JSON payload, loading and rewriting
+        all of them on each save would cost more than the sync. They are inserted here only and read page by page
+        through get_sync_history.
+        Args:
+            stmt_doc (Document): The 'FinTS Statement Import' document instance.
+            transactions (list|int): The list of fetched transaction records or their number.
+            json_data (str): The hashed transactions as JSON.
+            start_date (date): The start date of the transaction period (datetime.date).
+            end_date (date): The end date of the transaction period (datetime.date).
+            closing_balance (mt940.models.Balance): The final closing balance of the statements.
+            continuity_status (str): The result of the balance continuity check.
+            source (str): 'FinTS' for a bank dialog, 'File' for an uploaded statement file, 'Mock' for the mock backend.
+    """
     timestamp = now_datetime()
     stmt_doc.sync_count += 1
-    stmt_doc.sync_timestamp = timestamp
-    stmt_doc.append("sync_history", {
+    if source != "File":
+        # The sync date is the last bank round-trip, concurrent fetches coalesce on it
+        stmt_doc.sync_timestamp = timestamp
+    last_idx = frappe.get_all("FinTS Statement Sync Item",
+                              filters={"parent": stmt_doc.name, "parenttype": "FinTS Statement Import",
+                                       "parentfield": "sync_history"},
+                              pluck="idx", order_by="idx desc", limit=1)
+    frappe.get_doc({
+        "doctype": "FinTS Statement Sync Item",
+        "parent": stmt_doc.name,
+        "parenttype": "FinTS Statement Import",
+        "parentfield": "sync_history",
+        "idx": cint(last_idx[0] if last_idx else 0) + 1,
         "sync_timestamp": timestamp,
-        "total": len(transactions),
+        "sync_source": source,
+        "total": transactions if isinstance(transactions, int) else len(transactions),
         "start_date": start_date,
         "end_date": end_date,
-        "sync_json": json_data
-    })
-    stmt_doc.from_data_state = from_data_encoded
-    stmt_doc.pause_dialog_state = dialog_data_encoded
-    if is_tan_response:
-        stmt_doc.tan_data_response = ""
-        stmt_doc.challenge = ""
+        "sync_json": json_data,
+        "closing_balance": flt(closing_balance.amount.amount) if closing_balance else None,
+        "continuity_status": continuity_status
+    }).db_insert()
+
+
+def backfill_transactions(f=None, fints_doc=None, stmt_doc=None, account=None):
+    """
+        Fetches a long date range in chunks of 'Backfill Chunk Days' inside one resumed dialog.
+        Every chunk is imported and checkpointed (committed) on its own, so an interrupted backfill
+        resumes at the first chunk that has not been imported. Runs in the backfill job, the progress
+        is published after each chunk.
+        Args:
+            f (FinTS3PinTanClient): The FinTS client handling the session.
+            fints_doc (Document): The 'FinTS Settings' document instance.
+            stmt_doc (Document): The 'FinTS Statement Import' document instance.
+            account (SEPAAccount): The account of the resumed dialog.
+        Returns:
+            dict: Response containing success status and TAN requirement.
+    """
+    from fints.client import NeedTANResponse
+
+    chunk_start, last_date = get_backfill_range(stmt_doc)
+    # The bank's storage period says how far back statements go, not how long one request may be
+    chunk_days = cint(stmt_doc.backfill_chunk_days) or DEFAULT_BACKFILL_CHUNK_DAYS
+    chunks = 0
+    total_chunks = -(-(date_diff(last_date, chunk_start) + 1) // chunk_days)
+
+    while chunk_start <= last_date:
+        chunk_end = min(getdate(add_days(chunk_start, chunk_days - 1)), last_date)
+        transactions = fetch_statement(f, fints_doc, account, chunk_start, chunk_end)
+
+        if isinstance(transactions, NeedTANResponse):
+            # The chunk is imported by submit_tan_for_statement, the next click continues after it
+            return pause_dialog_for_tan(f, stmt_doc, transactions)
+
+        json_data, new_transactions = import_transactions(transactions, fints_doc)
+        append_sync_history(stmt_doc, transactions, json_data, chunk_start, chunk_end)
+        stmt_doc.backfill_next_date = add_days(chunk_end, 1)
+        stmt_doc.save(ignore_permissions=True)
+        # Checkpoint: the imported chunk survives an interruption of the following ones
+        frappe.db.commit()
+
+        chunks += 1
+        publish_backfill_progress(stmt_doc.name, {
+            "chunk": chunks,
+            "chunks": total_chunks,
+            "start_date": str(chunk_start),
+            "end_date": str(chunk_end),
+            "inserted": len(new_transactions)
+        })
+        chunk_start = getdate(stmt_doc.backfill_next_date)
+
+    dialog_data = f.pause_dialog()
+    from_data = f.deconstruct(including_private=True)
+    stmt_doc.from_data_state = base64.b64encode(from_data).decode("ascii")
+    stmt_doc.pause_dialog_state = base64.b64encode(dialog_data).decode("ascii")
     stmt_doc.save(ignore_permissions=True)
 
     return {
         "ok": True,
         "tan_required": False,
-        "message": "The transactions have been fetched."
+        "message": _("The backfill has been completed. {0} chunk(s) have been fetched.").format(chunks)
+    }
+
+
+def publish_backfill_progress(docname=None, progress=None):
+    """
+        Publishes the progress or the result of the backfill job to the open forms of a statement import.
+        Args:
+            docname (str): The name of the 'FinTS Statement Import' document.
+            progress (dict): The chunk counters, or {"done": True, "response": ...} at the end.
+    """
+    progress = dict(progress or {}, docname=docname)
+    frappe.publish_realtime(BACKFILL_PROGRESS_EVENT, progress, doctype="FinTS Statement Import", docname=docname)
+
+
+def get_fetch_window(stmt_doc=None, fints_doc=None):
+    """
+        Returns the date range a fetch covers for the transaction mode of a statement import.
+        Args:
+            stmt_doc (Document): The 'FinTS Statement Import' document instance.
+            fints_doc (Document): The 'FinTS Settings' document instance, its bank limits how far a sync reaches back.
+        Returns:
+            tuple: The (start_date, end_date) to fetch. For a completed backfill start_date lies after end_date.
+    """
+    if stmt_doc.transaction_mode == "Fetch Last 120 Days":
+        start_date, end_date = getdate(add_days(today(), -120)), getdate(today())
+    elif stmt_doc.transaction_mode == "Custom":
+        start_date, end_date = getdate(stmt_doc.start_date), getdate(stmt_doc.last_date)
+    elif stmt_doc.transaction_mode == "Backfill":
+        start_date, end_date = get_backfill_range(stmt_doc)
+    else:
+        start_date, end_date = getdate(add_days(today(), -30)), getdate(today())
+
+    # Continuity: fetch only what is missing since the last recorded closing balance.
+    # A custom range or a backfill is what the user asked for, it is never touched.
+    if stmt_doc.transaction_mode not in ("Custom", "Backfill"):
+        capability = get_bank_capability(fints_doc) if fints_doc else None
+        start_date, end_date = resolve_sync_window(stmt_doc, start_date, end_date,
+                                                   reach_days=capability.statement_storage_days if capability else None)
+    return start_date, end_date
+
+
+def get_backfill_range(stmt_doc=None):
+    """
+        Returns the remaining range of a backfill, starting at the checkpoint if it lies inside the range.
+        Args:
+            stmt_doc (Document): The 'FinTS Statement Import' document instance.
+        Returns:
+            tuple: The (start_date, last_date) that still has to be fetched.
+    """
+    start_date = getdate(stmt_doc.start_date)
+    last_date = getdate(stmt_doc.last_date)
+    if stmt_doc.backfill_next_date and getdate(stmt_doc.backfill_next_date) > start_date:
+        start_date = getdate(stmt_doc.backfill_next_date)
+    return start_date, last_date
+
+
+def pause_dialog_for_tan(f=None, stmt_doc=None, tan_response=None):
+    """
+        Pauses the dialog and stores the client, dialog and TAN state until the user submits the TAN.
+        Args:
+            f (FinTS3PinTanClient): The FinTS client handling the session.
+            stmt_doc (Document): The 'FinTS Statement Import' document instance.
+            tan_response (NeedTANResponse): The TAN request of the bank.
+        Returns:
+            dict: Response asking the user for the TAN.
+    """
+    dialog_data = f.pause_dialog()
+    from_data = f.deconstruct(including_private=True)
+    tan_response_data = tan_response.get_data()
+
+    # Challenge & Decoupled
+    challenge = tan_response.challenge or "A TAN is Required"
+    decoupled = tan_response.decoupled
+
+    # Save the state in the
+    stmt_doc.from_data_state = base64.b64encode(from_data).decode("ascii")
+    stmt_doc.pause_dialog_state = base64.b64encode(dialog_data).decode("ascii")
+    stmt_doc.tan_data_response = base64.b64encode(tan_response_data).decode("ascii")
+    stmt_doc.challenge = challenge
+    stmt_doc.save(ignore_permissions=True)
+
+    return {
+        "ok": False,  # required
+        "tan_required": True,  # required
+        "message": "A Tan is required",  # required
+        "challenge": challenge,
+        "decoupled": decoupled
     }
 
 
-def get_json_dictionary_hash(txn_dict):
+def resolve_sync_window(stmt_doc=None, start_date=None, end_date=None, reach_days=None):
+    """
+        Narrows or widens the fetch window of a sync based on the last recorded closing balance.
+        If the last closing date lies inside the window, only the delta since that date is fetched.
+        If it lies before the window, the window is extended back to it so the missing range is backfilled.
+        A balance gap found by the last sync (continuity_gap_date) is fetched again the same way.
+        The window is never extended further back than the bank keeps statements (reach_days).
+        Args:
+            stmt_doc (Document): The 'FinTS Statement Import' document instance.
+            start_date (date): The start date given by the transaction mode (datetime.date).
+            end_date (date): The end date given by the transaction mode (datetime.date).
+            reach_days (int): Days the bank serves statements for, DEFAULT_SYNC_REACH_DAYS if not given.
+        Returns:
+            tuple: The (start_date, end_date) to fetch.
+    """
+    if not stmt_doc.last_closing_date:
+        return start_date, end_date
+
+    # The closing date itself is fetched again, bookings made after the last sync on that day are not lost.
+    # Already imported ones are skipped by the hash check.
+    resume_date = getdate(stmt_doc.last_closing_date)
+    if stmt_doc.continuity_gap_date:
+        resume_date = min(resume_date, getdate(stmt_doc.continuity_gap_date))
+    if resume_date > end_date:
+        return start_date, end_date
+
+    # Older than the bank's storage period the request fails or asks for a TAN, continuity is reported as a Gap then
+    earliest = min(start_date, getdate(add_days(end_date, -(cint(reach_days) or DEFAULT_SYNC_REACH_DAYS))))
+    return max(resume_date, earliest), end_date
+
+
+def get_final_closing_balance(transactions=None):
+    """
+        Returns the final closing balance (:62F:) of the fetched MT940 statements.
+        Args:
+            transactions (list): The list of mt940.models.Transaction objects.
+        Returns:
+            mt940.models.Balance: The final closing balance or None if the statements carry none.
+    """
+    if not transactions:
+        return None
+    # All transactions share the parsed mt940.models.Transactions collection, which holds the statement tags.
+    # The last statement's closing balance wins, that's the balance at the end of the window.
+    return transactions[0].transactions.data.get("final_closing_balance")
+
+
+def check_balance_continuity(stmt_doc=None, closing_balance=None, statement_balances=None, start_date=None):
+    """
+        Verifies that the statements of a sync continue the previous one: the opening balance (:60F:) of the first
+        statement after the checkpoint must be the stored closing balance, and every following statement must open
+        with the closing balance of the one before. Moves the checkpoint (last closing balance and date) on the
+        statement import. On a mismatch the date of the last verified balance is kept in continuity_gap_date,
+        the next sync fetches again from there instead of the full window.
+        A custom range is not the end of the account history, it is neither checked nor moves the checkpoint.
+        Args:
+            stmt_doc (Document): The 'FinTS Statement Import' document instance.
+            closing_balance (mt940.models.Balance): The final closing balance of this sync.
+            statement_balances (list): The opening and closing balance of every statement, see get_statement_balances.
+            start_date (date): The start date of the fetched window (datetime.date).
+        Returns:
+            str: Initial, Continuous, Gap, Mismatch or an empty string if there is nothing to check.
+    """
+    if not closing_balance or stmt_doc.transaction_mode == "Custom":
+        # Nothing booked in the window, the previous checkpoint is still valid
+        return ""
+
+    gap_date = None
+    if not stmt_doc.last_closing_date:
+        status = "Initial"
+    elif start_date and getdate(start_date) > getdate(stmt_doc.last_closing_date):
+        # The window did not reach back to the checkpoint (older than the bank keeps), continuity is unknown
+        status = "Gap"
+    else:
+        gap_date = find_balance_gap(statement_balances, stmt_doc.last_closing_date, stmt_doc.last_closing_balance)
+        status = "Mismatch" if gap_date else "Continuous"
+
+    if stmt_doc.continuity_gap_date and start_date and getdate(start_date) <= getdate(stmt_doc.continuity_gap_date):
+        # The gap has been fetched again, whatever it was missing is imported now
+        stmt_doc.continuity_gap_date = None
+    if gap_date:
+        stmt_doc.continuity_gap_date = gap_date
+
+    stmt_doc.last_closing_balance = flt(closing_balance.amount.amount, 2)
+    stmt_doc.last_closing_date = closing_balance.date
+    return status
+
+
+def find_balance_gap(statement_balances=None, checkpoint_date=None, checkpoint_balance=0):
+    """
+        Walks the statements after a checkpoint and returns where the balance chain breaks.
+        Statements before the checkpoint day were fetched for an older gap and are skipped. The checkpoint day
+        itself is fetched again: bookings made after the last sync change its closing balance, that one counts.
+        Args:
+            statement_balances (list): The opening and closing balance of every statement, see get_statement_balances.
+            checkpoint_date (date): The date of the stored closing balance.
+            checkpoint_balance (float): The stored closing balance.
+        Returns:
+            date: The date of the last verified balance before the break or None if the chain is continuous.
+    """
+    checkpoint_date = getdate(checkpoint_date)
+    expected, expected_date = flt(checkpoint_balance, 2), checkpoint_date
+    for statement in statement_balances or []:
+        closing_date = getdate(statement["closing"].date)
+        if closing_date < checkpoint_date:
+            continue
+        if closing_date > checkpoint_date and flt(statement["opening"].amount.amount, 2) != expected:
+            return expected_date
+        expected, expected_date = flt(statement["closing"].amount.amount, 2), closing_date
+    return None
+
+
+def fetch_balance(f=None, account=None):
+    """
+        Fetches the booked balance (HKSAL) inside the currently resumed dialog.
+        A balance that needs its own TAN is not requested at all: the dialog is paused and stored right after,
+        and a dialog with a TAN pending for HKSAL can't be resumed for the next statement.
+        Args:
+            f (FinTS3PinTanClient): The FinTS client handling the session.
+            account (SEPAAccount): The account to fetch the balance for.
+        Returns:
+            mt940.models.Balance: The booked balance or None if the bank did not provide one.
+    """
+    from fints.client import NeedTANResponse
+    from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_recorder import record_call
+
+    try:
+        if balance_requires_tan(f, account):
+            # The last stored snapshot stays the latest one
+            return None
+        record_call(f, "get_balance")
+        balance = f.get_balance(account)
+    except Exception:
+        # The balance is a by-product of the sync, it must never break the transaction import
+        frappe.logger().error("fetch_balance error: " + traceback.format_exc())
+        return None
+
+    if isinstance(balance, NeedTANResponse):
+        # Only sent with a TAN segment if the BPD asks for one, balance_requires_tan has ruled that out
+        return None
+    return balance
+
+
+def balance_requires_tan(f=None, account=None):
     """
-       Generate a SHA-256 hash for a given dictionary (JSON object).
-       Args:
-           txn_dict (dict): The transaction dictionary to be hashed.
-       Returns:
-           str: The SHA-256 hash as a hexadecimal string.
+        Checks in the BPD (HIPINS) whether the bank wants a TAN for the balance request, the same
+        decision python-fints takes before sending HKSAL.
+        Args:
+            f (FinTS3PinTanClient): The FinTS client handling the session.
+            account (SEPAAccount): The account to fetch the balance for.
+        Returns:
+            bool: True if HKSAL would be sent with a TAN request.
     """
-    canonical_str = json.dumps(txn_dict, sort_keys=True)
-    return hashlib.sha256(canonical_str.encode("utf-8")).hexdigest()
+    from fints.segments.saldo import HKSAL5, HKSAL6, HKSAL7
+
+    hksal = f._find_highest_supported_command(HKSAL5, HKSAL6, HKSAL7)
+    seg = hksal(account=hksal._fields['account'].type.from_sepa_account(account), all_accounts=False)
+    return bool(f._need_twostep_tan_for_segment(seg))
 
 
-def create_and_check_bank_transaction_entry(transactions, company_info):
+def create_and_check_bank_transaction_entry(transactions, company_info, rows=None):
     """
          Creates bank transaction entries in ERPNext if they do not already exist.
          Args:
              transactions (list): A list of transaction dictionaries.
              company_info (dict): Contains company-related details like company name and bank account.
+             rows (list): The already mapped Bank Transaction fields of each transaction (optional).
          Returns:
-             None
+             list: The transaction dictionaries for which a new Bank Transaction has been created.
      """
+    new_transactions = []
     if len(transactions) > 0:
-        for txn_dict in transactions:
-            if not frappe.db.exists("Bank Transaction", {"custom_hash": txn_dict.get("hash")}):
-                print(f"\n\n Bank Transaction does not exists. \n\n")
-
-                deposit = float(txn_dict.get("amount", {}).get("amount", 0)) if txn_dict.get("status") == "C" else 0
-                withdrawal = abs(float(txn_dict.get("amount", {}).get("amount", 0))) if txn_dict.get(
-                    "status") == "D" else 0
-                transaction_type = ""
-                if txn_dict.get("status") == "D":
-                    transaction_type = "Debit"
-                elif txn_dict.get("status") == "C":
-                    transaction_type = "Credit"
-
-                party = ""
-                customer_id = frappe.db.get_value("Customer", txn_dict.get("applicant_name"), "name")
-                if customer_id:
-                    party = customer_id
-
-                bank_transaction = frappe.get_doc({
-                    "doctype": "Bank Transaction",
-                    "company": company_info.get("company", ""),
-                    "bank_account": company_info.get("bank_account", ""),
-                    "date": txn_dict.get("date" ""),
-                    "entry_date": txn_dict.get("entry_date", ""),
-                    "guessed_entry_date": txn_dict.get("guessed_entry_date", ""),
-                    "status": "Unreconciled",
-                    "transaction_type": transaction_type,
-                    "transaction_reference": txn_dict.get("transaction_reference", ""),
-                    "transaction_code": txn_dict.get("transaction_code", ""),
-                    "deposit": deposit,
-                    "withdrawal": withdrawal,
-                    "currency": txn_dict.get("amount", {}).get("currency"),
-                    "description": txn_dict.get('purpose', ""),
-                    "posting_text": txn_dict.get("posting_text", ""),
-                    "reference_number": txn_dict.get("customer_reference", ""),
-                    "bank_reference": txn_dict.get("bank_reference", ""),
-                    "party_type": "Customer",
-                    "party": party,
-                    "bank_party_name": txn_dict.get("applicant_name", ""),
-                    "bank_party_iban": txn_dict.get("applicant_iban", ""),
-                    "bank_party_bin": txn_dict.get("applicant_bin", ""),
-                    "funds_code": txn_dict.get("funds_code", ""),
-                    "hash": txn_dict.get("hash", ""),
-                    "id": txn_dict.get("id", ""),
-                    "primary_note": txn_dict.get("prima_nota", ""),
-                    "extra_details": txn_dict.get("extra_details", ""),
-                    "return_debit_notes": txn_dict.get("return_debit_notes", ""),
-                    "recipient_name": txn_dict.get("recipient_name", ""),
-                    "additional_purpose": txn_dict.get("additional_purpose", ""),
-                    "gvc_applicant_iban": txn_dict.get("gvc_applicant_iban", ""),
-                    "gvc_applicant_bin": txn_dict.get("gvc_applicant_bin", ""),
-                    "end_to_end_reference": txn_dict.get("end_to_end_reference", ""),
-                    "additional_position_reference": txn_dict.get("additional_position_reference", ""),
-                    "applicant_creditor_id": txn_dict.get("applicant_creditor_id", ""),
-                    "purpose_code": txn_dict.get("purpose_code", ""),
-                    "additional_position_date": txn_dict.get("additional_position_date", ""),
-                    "deviate_applicant": txn_dict.get("deviate_applicant", ""),
-                    "deviate_recipient": txn_dict.get("deviate_recipient", ""),
-                    "first_one_off_recurring": txn_dict.get("FRST_ONE_OFF_RECC", ""),
-                    "old_sepa_ci": txn_dict.get("old_SEPA_CI", ""),
-                    "old_sepa_additional_position_reference": txn_dict.get(
-                        "old_SEPA_additional_position_reference", ""),
-                    "settlement_tag": txn_dict.get("settlement_tag", ""),
-                    "debitor_identifier": txn_dict.get("debitor_identifier", ""),
-                    "compensation_amount": txn_dict.get("compensation_amount", ""),
-                    "original_amount": txn_dict.get("original_amount", ""),
-                })
+        if rows is None:
+            rows = [map_bank_transaction(txn_dict, company_info) for txn_dict in transactions]
+
+        # One query per batch instead of one exists() and one Customer lookup per transaction
+        existing_hashes = get_existing_transaction_hashes([txn_dict.get("hash") for txn_dict in transactions])
+        applicant_names = list({txn_dict.get("applicant_name") for txn_dict in transactions
+                                if txn_dict.get("applicant_name")})
+        customers = set(frappe.get_all("Customer", filters={"name": ["in", applicant_names]},
+                                       pluck="name")) if applicant_names else set()
+
+        # Compiled once per process and rule change, applied to every row of the batch
+        matcher = get_rule_matcher()
+
+        booked = []
+        booked_rows = []
+        for txn_dict, row in zip(transactions, rows):
+            if txn_dict.get("hash") not in existing_hashes:
+                if txn_dict.get("applicant_name") in customers:
+                    row["party"] = txn_dict.get("applicant_name")
+                if matcher:
+                    matcher.apply(txn_dict, row)
+
+                bank_transaction = frappe.get_doc(row)
                 bank_transaction.save(ignore_permissions=True)
                 bank_transaction.submit()
+                existing_hashes.add(txn_dict.get("hash"))
+                new_transactions.append(txn_dict)
+                booked.append((txn_dict, bank_transaction.name))
+                booked_rows.append((row, bank_transaction.name))
+
+        # Same transaction as the inserts, the aggregates never count a row that was rolled back
+        update_transaction_aggregates(new_transactions, company_info.get("bank_account"))
+        promote_pending_transactions(company_info.get("bank_account"), booked)
+        # Outbox for downstream consumers, committed (or rolled back) together with the batch
+        record_transaction_event(company_info, booked_rows)
+    return new_transactions
+
+
+def get_existing_transaction_hashes(hashes=None):
+    """
+        Returns the hashes that already have a Bank Transaction.
+        Args:
+            hashes (list): The transaction hashes to check.
+        Returns:
+            set: The subset of hashes that already exist.
+    """
+    hashes = [h for h in set(hashes or []) if h]
+    if not hashes:
+        return set()
+    return set(frappe.get_all("Bank Transaction", filters={"hash": ["in", hashes]}, pluck="hash"))
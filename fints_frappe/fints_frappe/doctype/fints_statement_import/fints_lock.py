@@ -0,0 +1,136 @@
+import frappe
+from frappe import _
+from frappe.utils import get_datetime
+
+import threading
+from contextlib import contextmanager
+
+# A lock outlives a crashed worker for at most this many seconds
+LOCK_TIMEOUT = 300
+# A live holder renews its lock this often, a backfill may hold it for hours
+LOCK_RENEW_INTERVAL = LOCK_TIMEOUT / 3
+# How long a concurrent trigger waits (queues) for the running sync before giving up
+LOCK_WAIT = 10
+
+
+class FinTSSyncInProgressError(frappe.ValidationError):
+    pass
+
+
+class LockHeartbeat:
+    """
+        Renews a held lock from a daemon thread, so it only expires LOCK_TIMEOUT after its worker died.
+        The lock has to be created with thread_local=False, its token is read by this thread.
+    """
+
+    def __init__(self, lock=None, interval=LOCK_RENEW_INTERVAL):
+        self.lock = lock
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="fints-lock-heartbeat", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                # Resets the expiry to LOCK_TIMEOUT, fails if the lock is no longer ours
+                self.lock.reacquire()
+            except Exception:
+                return
+
+
+def get_lock_key(fints_account=None):
+    """
+        Returns the site specific Redis key of the per-account sync lock.
+        Args:
+            fints_account (str): The name of the 'FinTS Settings' document.
+        Returns:
+            str: The Redis key.
+    """
+    return frappe.cache().make_key("fints_sync_lock:{0}".format(fints_account))
+
+
+@contextmanager
+def fints_account_lock(docname=None, wait=LOCK_WAIT):
+    """
+        Serializes everything that resumes the paused dialog of a FinTS account.
+        Two workers resuming the same 'pause_dialog_state' both talk to the bank and then overwrite
+        each other's dialog state, so only one of them may hold the dialog at a time. Others wait
+        up to `wait` seconds and then get a FinTSSyncInProgressError.
+        The lock is renewed while it is held. The work is committed before the lock is released, so the next
+        holder reads the dialog state this one left; on an error it is rolled back instead.
+        Args:
+            docname (str): The name of the 'FinTS Statement Import' document.
+            wait (int): Seconds to wait for the running sync.
+    """
+    fints_account = frappe.db.get_value("FinTS Statement Import", docname, "fints_account")
+    if not fints_account:
+        frappe.throw(_("No FinTS Account set."))
+
+    lock = frappe.cache().lock(get_lock_key(fints_account), timeout=LOCK_TIMEOUT, blocking_timeout=wait,
+                               thread_local=False)
+    if not lock.acquire():
+        raise FinTSSyncInProgressError(_("A sync for FinTS Account {0} is already in progress.").format(fints_account))
+
+    heartbeat = LockHeartbeat(lock)
+    heartbeat.start()
+    try:
+        # End the current read snapshot, the previous holder may have committed a new dialog state meanwhile
+        frappe.db.commit()
+        yield
+        frappe.db.commit()
+    except BaseException:
+        # Nothing of a failed run may be committed by whoever commits next, e.g. half a dialog state
+        frappe.db.rollback()
+        raise
+    finally:
+        heartbeat.stop()
+        try:
+            lock.release()
+        except Exception:
+            # The lock expired (LOCK_TIMEOUT) and may already belong to someone else, nothing to release
+            pass
+
+
+def is_sync_in_progress(fints_account=None):
+    """
+        Checks whether a worker holds the lock of a FinTS account. Nothing is stored in the database,
+        a worker that was killed leaves no status behind, its lock simply expires.
+        Args:
+            fints_account (str): The name of the 'FinTS Settings' document.
+        Returns:
+            bool: True while a sync holds the dialog.
+    """
+    # The key is site specific already, shared=True keeps the cache from prefixing it again
+    return bool(fints_account and frappe.cache().exists(get_lock_key(fints_account), shared=True))
+
+
+def synced_since(docname=None, requested_at=None):
+    """
+        Checks whether a concurrent sync finished after a trigger was requested.
+        Args:
+            docname (str): The name of the 'FinTS Statement Import' document.
+            requested_at (datetime): The time the trigger was requested.
+        Returns:
+            bool: True if the transactions have been fetched in the meantime.
+    """
+    sync_timestamp = frappe.db.get_value("FinTS Statement Import", docname, "sync_timestamp")
+    return bool(sync_timestamp and get_datetime(sync_timestamp) >= requested_at)
+
+
+def sync_in_progress_response():
+    """
+        Returns the response for a trigger that could not get the lock.
+    """
+    return {
+        "ok": False,
+        "tan_required": False,
+        "in_progress": True,
+        "message": _("A sync is already in progress for this FinTS Account. Please try again in a moment.")
+    }
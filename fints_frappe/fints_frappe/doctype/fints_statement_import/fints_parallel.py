@@ -0,0 +1,286 @@
+import frappe
+from frappe.utils import cint
+
+import os
+import re
+import json
+import hashlib
+import unicodedata
+import multiprocessing
+from collections import deque
+from decimal import Decimal
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+# Below this many transactions a process pool costs more than it saves
+PARALLEL_MIN_TRANSACTIONS = 2000
+# Transactions per worker task
+CHUNK_TRANSACTIONS = 1000
+# Placeholders banks send for a missing end-to-end reference, MT940 and CAMT don't agree on one
+EMPTY_REFERENCES = ("", "NOTPROVIDED", "NONREF")
+# Spelled out before accents are stripped, MT940 (S.W.I.F.T charset) usually carries the spelled-out form
+TRANSLITERATION = {"Ä": "AE", "Ö": "OE", "Ü": "UE"}
+
+# The workers only run the pure functions of this module, they never touch the database.
+# forkserver children don't inherit the open DB connection of the worker that starts the pool.
+POOL_CONTEXT = "forkserver"
+
+
+def get_pool_size():
+    """
+        Returns the number of parse processes: 'fints_parse_processes' from the site config or the number of cores.
+        A web request always parses in its own process: a gunicorn worker must not start a pool of its own,
+        the pool only runs in background jobs (file import, backfill) and the scheduler.
+    """
+    if getattr(frappe.local, "request", None):
+        return 1
+    return cint(frappe.conf.get("fints_parse_processes")) or os.cpu_count() or 1
+
+
+def prepare_transactions(transactions=None, company_info=None):
+    """
+        Normalises, fingerprints and maps mt940 transactions to Bank Transaction rows.
+        Large lists are spread over a process pool in chunks, the result keeps the order of the input.
+        Args:
+            transactions (list): The list of mt940.models.Transaction objects.
+            company_info (dict): Contains company-related details like company name and bank account.
+        Returns:
+            tuple: The (txn_dicts, rows) lists, the hashed transaction dictionaries and their Bank Transaction fields.
+    """
+    import mt940
+
+    transactions = list(transactions or [])
+    # mt940 objects don't pickle reliably, the workers get them as JSON
+    chunks = (json.dumps(transactions[i:i + CHUNK_TRANSACTIONS], cls=mt940.JSONEncoder)
+              for i in range(0, len(transactions), CHUNK_TRANSACTIONS))
+
+    txn_dicts, rows = [], []
+    for chunk_dicts, chunk_rows in prepare_chunks(prepare_json_chunk, chunks, company_info,
+                                                  parallel=len(transactions) >= PARALLEL_MIN_TRANSACTIONS):
+        txn_dicts.extend(chunk_dicts)
+        rows.extend(chunk_rows)
+    return txn_dicts, rows
+
+
+def prepare_chunks(func=None, chunks=None, company_info=None, parallel=True):
+    """
+        Runs func(chunk, company_info) for every chunk and yields the results in the order of the chunks.
+        At most two tasks per process are in flight, so a long chunk iterator is never read ahead completely.
+        Args:
+            func (function): One of the prepare_*_chunk functions of this module.
+            chunks (iterable): The chunks to prepare.
+            company_info (dict): Contains company-related details like company name and bank account.
+            parallel (bool): Use a process pool if more than one process is configured.
+        Yields:
+            tuple: The (txn_dicts, rows) of each chunk, hashed with number_transaction_hashes.
+    """
+    # Identical bookings are numbered across chunks, a chunk border must not change their hashes
+    occurrences = {}
+    for txn_dicts, rows in run_chunks(partial(func, company_info=company_info), chunks,
+                                      get_pool_size() if parallel else 1):
+        number_transaction_hashes(txn_dicts, rows, occurrences)
+        yield txn_dicts, rows
+
+
+def run_chunks(task=None, chunks=None, processes=1):
+    """
+        Runs task(chunk) for every chunk, in a process pool if processes > 1, and yields the results in order.
+    """
+    if processes <= 1:
+        for chunk in chunks:
+            yield task(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context(POOL_CONTEXT)) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(task, chunk))
+            if len(pending) >= processes * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def prepare_mt940_chunk(mt940_text=None, company_info=None):
+    """
+        Worker task: parses raw MT940 text and prepares its transactions.
+    """
+    import mt940
+    from fints.utils import mt940_to_array
+
+    transactions = mt940_to_array(mt940_text)
+    return prepare_json_chunk(json.dumps(transactions, cls=mt940.JSONEncoder), company_info)
+
+
+def prepare_json_chunk(json_text=None, company_info=None):
+    """
+        Worker task: prepares transactions exported by mt940.JSONEncoder.
+    """
+    return prepare_dict_chunk(json.loads(json_text), company_info)
+
+
+def prepare_dict_chunk(txn_dicts=None, company_info=None):
+    """
+        Worker task: fingerprints transaction dictionaries in place and maps them to Bank Transaction fields.
+        The fingerprint becomes the hash once number_transaction_hashes has numbered identical bookings.
+    """
+    for txn_dict in txn_dicts:
+        txn_dict["hash"] = get_transaction_fingerprint(txn_dict)
+    return txn_dicts, [map_bank_transaction(txn_dict, company_info) for txn_dict in txn_dicts]
+
+
+def get_canonical_transaction(txn_dict=None):
+    """
+        Returns the fields of a transaction that MT940 and CAMT statements both carry, normalised.
+        The same booking from either format (or from the stored Bank Transaction) gives the same dictionary,
+        fields only one format knows (:20: reference, prima nota, funds code, ...) are left out. So is the counterparty,
+        depending on its version mt940 reports the ?31 IBAN as part of the name.
+        Args:
+            txn_dict (dict): A transaction dictionary in the shape of the mt940 JSON export.
+        Returns:
+            dict: The canonical transaction.
+    """
+    amount = txn_dict.get("amount") or {}
+    end_to_end_reference = (txn_dict.get("end_to_end_reference") or "").strip().upper()
+    return {
+        "status": txn_dict.get("status") or "",
+        "amount": "{0:.2f}".format(Decimal(str(amount.get("amount") or 0))),
+        "currency": (amount.get("currency") or "").upper(),
+        "date": str(txn_dict.get("date") or "")[:10],
+        "entry_date": str(txn_dict.get("entry_date") or "")[:10],
+        "end_to_end_reference": "" if end_to_end_reference in EMPTY_REFERENCES else end_to_end_reference,
+        "purpose": normalize_text(txn_dict.get("purpose")),
+    }
+
+
+def normalize_text(value=None):
+    """
+        Returns the letters and digits of a text, upper case and without accents.
+        Line breaks, spacing and umlauts differ between MT940 and CAMT, the characters in between don't.
+    """
+    text = (value or "").upper()
+    for char, replacement in TRANSLITERATION.items():
+        text = text.replace(char, replacement)
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^A-Z0-9]", "", text)
+
+
+def get_transaction_fingerprint(txn_dict=None):
+    """
+        Returns the SHA-256 hash of the canonical transaction.
+    """
+    return get_json_dictionary_hash(get_canonical_transaction(txn_dict))
+
+
+def number_transaction_hashes(txn_dicts=None, rows=None, occurrences=None):
+    """
+        Turns the fingerprints of prepared transactions into their hashes, in place.
+        Two identical bookings (same day, amount, reference and purpose) share a fingerprint, the n-th of them
+        gets the fingerprint numbered with n as hash. A statement lists all bookings of a day, so a refetch or
+        the other format numbers them the same way.
+        Args:
+            txn_dicts (list): The fingerprinted transaction dictionaries.
+            rows (list): Their Bank Transaction fields.
+            occurrences (dict): Fingerprint counts of the transactions numbered before, updated.
+        Returns:
+            dict: The updated occurrences.
+    """
+    if occurrences is None:
+        occurrences = {}
+    for txn_dict, row in zip(txn_dicts, rows):
+        fingerprint = txn_dict.get("hash")
+        occurrences[fingerprint] = occurrences.get(fingerprint, 0) + 1
+        txn_dict["hash"] = get_numbered_hash(fingerprint, occurrences[fingerprint])
+        row["hash"] = txn_dict["hash"]
+    return occurrences
+
+
+def get_numbered_hash(fingerprint=None, occurrence=1):
+    """
+        Returns the hash of the n-th booking with a fingerprint, the first one keeps the fingerprint.
+    """
+    if occurrence <= 1:
+        return fingerprint
+    return hashlib.sha256("{0}:{1}".format(fingerprint, occurrence).encode("utf-8")).hexdigest()
+
+
+def get_json_dictionary_hash(txn_dict):
+    """
+       Generate a SHA-256 hash for a given dictionary (JSON object).
+       Args:
+           txn_dict (dict): The transaction dictionary to be hashed.
+       Returns:
+           str: The SHA-256 hash as a hexadecimal string.
+    """
+    canonical_str = json.dumps(txn_dict, sort_keys=True)
+    return hashlib.sha256(canonical_str.encode("utf-8")).hexdigest()
+
+
+def map_bank_transaction(txn_dict=None, company_info=None):
+    """
+        Maps a hashed transaction dictionary to the fields of a Bank Transaction.
+        The party needs a Customer lookup and is set by create_and_check_bank_transaction_entry.
+        Args:
+            txn_dict (dict): The transaction dictionary.
+            company_info (dict): Contains company-related details like company name and bank account.
+        Returns:
+            dict: The Bank Transaction fields.
+    """
+    deposit = float(txn_dict.get("amount", {}).get("amount", 0)) if txn_dict.get("status") == "C" else 0
+    withdrawal = abs(float(txn_dict.get("amount", {}).get("amount", 0))) if txn_dict.get(
+        "status") == "D" else 0
+    transaction_type = ""
+    if txn_dict.get("status") == "D":
+        transaction_type = "Debit"
+    elif txn_dict.get("status") == "C":
+        transaction_type = "Credit"
+
+    return {
+        "doctype": "Bank Transaction",
+        "company": company_info.get("company", ""),
+        "bank_account": company_info.get("bank_account", ""),
+        "date": txn_dict.get("date", ""),
+        "entry_date": txn_dict.get("entry_date", ""),
+        "guessed_entry_date": txn_dict.get("guessed_entry_date", ""),
+        "status": "Unreconciled",
+        "transaction_type": transaction_type,
+        "transaction_reference": txn_dict.get("transaction_reference", ""),
+        "transaction_code": txn_dict.get("transaction_code", ""),
+        "deposit": deposit,
+        "withdrawal": withdrawal,
+        "currency": txn_dict.get("amount", {}).get("currency"),
+        "description": txn_dict.get('purpose', ""),
+        "posting_text": txn_dict.get("posting_text", ""),
+        "reference_number": txn_dict.get("customer_reference", ""),
+        "bank_reference": txn_dict.get("bank_reference", ""),
+        "party_type": "Customer",
+        "party": "",
+        "bank_party_name": txn_dict.get("applicant_name", ""),
+        "bank_party_iban": txn_dict.get("applicant_iban", ""),
+        "bank_party_bin": txn_dict.get("applicant_bin", ""),
+        "funds_code": txn_dict.get("funds_code", ""),
+        "hash": txn_dict.get("hash", ""),
+        "id": txn_dict.get("id", ""),
+        "primary_note": txn_dict.get("prima_nota", ""),
+        "extra_details": txn_dict.get("extra_details", ""),
+        "return_debit_notes": txn_dict.get("return_debit_notes", ""),
+        "recipient_name": txn_dict.get("recipient_name", ""),
+        "additional_purpose": txn_dict.get("additional_purpose", ""),
+        "gvc_applicant_iban": txn_dict.get("gvc_applicant_iban", ""),
+        "gvc_applicant_bin": txn_dict.get("gvc_applicant_bin", ""),
+        "end_to_end_reference": txn_dict.get("end_to_end_reference", ""),
+        "additional_position_reference": txn_dict.get("additional_position_reference", ""),
+        "applicant_creditor_id": txn_dict.get("applicant_creditor_id", ""),
+        "purpose_code": txn_dict.get("purpose_code", ""),
+        "additional_position_date": txn_dict.get("additional_position_date", ""),
+        "deviate_applicant": txn_dict.get("deviate_applicant", ""),
+        "deviate_recipient": txn_dict.get("deviate_recipient", ""),
+        "first_one_off_recurring": txn_dict.get("FRST_ONE_OFF_RECC", ""),
+        "old_sepa_ci": txn_dict.get("old_SEPA_CI", ""),
+        "old_sepa_additional_position_reference": txn_dict.get(
+            "old_SEPA_additional_position_reference", ""),
+        "settlement_tag": txn_dict.get("settlement_tag", ""),
+        "debitor_identifier": txn_dict.get("debitor_identifier", ""),
+        "compensation_amount": txn_dict.get("compensation_amount", ""),
+        "original_amount": txn_dict.get("original_amount", ""),
+    }
@@ -0,0 +1,200 @@
+import frappe
+from frappe.utils import cint, now_datetime
+
+import os
+import re
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Seconds between two stack samples of the syncing thread
+SAMPLE_INTERVAL = 0.01
+# The sampler stops after this many samples (about ten minutes), a stuck sync can't grow the profile forever
+MAX_SAMPLES = 60000
+# Slowest statements (by total time) and hottest functions kept in the summary
+TOP_QUERIES = 20
+TOP_FUNCTIONS = 20
+# Statements are stored without their values and cut to this length
+QUERY_TEXT_LENGTH = 500
+
+
+class StackSampler:
+    """
+        Samples the Python stack of one thread from a daemon thread, in the folded format of flame graphs.
+        Only code objects are read, never local variables, so no bank data ends up in a profile.
+    """
+
+    def __init__(self, thread_id=None, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = {}
+        self.sample_count = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="fints-profiler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval) and self.sample_count < MAX_SAMPLES:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{0} ({1}:{2})".format(code.co_name, get_short_path(code.co_filename),
+                                                    code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+                self.sample_count += 1
+
+    def folded(self):
+        """
+            Returns the samples as folded stacks ('outer;inner count' per line), hottest first.
+        """
+        return "\n".join("{0} {1}".format(stack, count)
+                         for stack, count in sorted(self.stacks.items(), key=lambda item: item[1], reverse=True))
+
+    def top_functions(self, limit=TOP_FUNCTIONS):
+        """
+            Returns the functions the thread spent most samples in (self time), with their share of all samples.
+        """
+        leaves = {}
+        for stack, count in self.stacks.items():
+            leaf = stack.rsplit(";", 1)[-1]
+            leaves[leaf] = leaves.get(leaf, 0) + count
+        return [{"function": leaf, "samples": count, "share": round(count / self.sample_count, 4)}
+                for leaf, count in sorted(leaves.items(), key=lambda item: item[1], reverse=True)[:limit]]
+
+
+class QueryCounter:
+    """
+        Counts and times the statements that go through frappe.db.sql while active.
+    """
+
+    def __init__(self):
+        self.queries = {}
+        self.count = 0
+        self.total_time = 0.0
+
+    def __enter__(self):
+        self.db = frappe.db
+        # frappe.recorder may have patched the connection already, restore exactly what was there
+        self.patched = self.db.__dict__.get("sql")
+        self.original = self.db.sql
+        self.db.sql = self.sql
+        return self
+
+    def __exit__(self, *args):
+        if self.patched is not None:
+            self.db.sql = self.patched
+        else:
+            del self.db.sql
+
+    def sql(self, query, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.original(query, *args, **kwargs)
+        finally:
+            self.record(query, time.perf_counter() - start)
+
+    def record(self, query=None, duration=0.0):
+        text = re.sub(r"\s+", " ", str(query)).strip()[:QUERY_TEXT_LENGTH]
+        stats = self.queries.setdefault(text, {"query": text, "count": 0, "total_time": 0.0, "max_time": 0.0})
+        stats["count"] += 1
+        stats["total_time"] += duration
+        stats["max_time"] = max(stats["max_time"], duration)
+        self.count += 1
+        self.total_time += duration
+
+    def slowest(self, limit=TOP_QUERIES):
+        """
+            Returns the statements with the highest total time.
+        """
+        return [dict(stats, total_time=round(stats["total_time"], 6), max_time=round(stats["max_time"], 6))
+                for stats in sorted(self.queries.values(), key=lambda stats: stats["total_time"], reverse=True)[:limit]]
+
+
+def get_short_path(filename=None):
+    """
+        Returns a file name relative to the apps folder of the bench, or its last two parts.
+    """
+    parts = (filename or "").replace("\\", "/").split("/")
+    if "apps" in parts:
+        return "/".join(parts[len(parts) - parts[::-1].index("apps"):])
+    return "/".join(parts[-2:])
+
+
+@contextmanager
+def profile_sync(docname=None):
+    """
+        Profiles the wrapped sync if 'Profile Next Sync' is set on the statement import.
+        The stack samples are attached as a folded-stack file, the summary with the slowest statements
+        goes to the sync history row the run created and the toggle is cleared. A run that creates no row
+        (e.g. one that stops for a TAN) keeps the toggle for the next one. Without the toggle this costs one query.
+        Args:
+            docname (str): The name of the 'FinTS Statement Import' document.
+    """
+    if not cint(frappe.db.get_value("FinTS Statement Import", docname, "profile_next_sync")):
+        yield
+        return
+
+    started_at = now_datetime()
+    start = time.perf_counter()
+    sampler = StackSampler()
+    sampler.start()
+    try:
+        with QueryCounter() as counter:
+            yield
+    finally:
+        sampler.stop()
+
+    save_sync_profile(docname, started_at, time.perf_counter() - start, sampler, counter)
+
+
+def save_sync_profile(docname=None, started_at=None, duration=0.0, sampler=None, counter=None):
+    """
+        Attaches a finished profile to the newest sync history row created since started_at.
+        Returns:
+            str: The name of the sync history row or None if the run created none.
+    """
+    rows = frappe.get_all("FinTS Statement Sync Item",
+                          filters={"parent": docname, "parenttype": "FinTS Statement Import",
+                                   "parentfield": "sync_history", "sync_timestamp": [">=", started_at]},
+                          pluck="name", order_by="idx desc", limit=1)
+    if not rows:
+        return None
+
+    file_doc = frappe.get_doc({
+        "doctype": "File",
+        "file_name": "fints-profile-{0}-{1}.folded".format(docname, started_at.strftime("%Y%m%d%H%M%S")),
+        "attached_to_doctype": "FinTS Statement Import",
+        "attached_to_name": docname,
+        "is_private": 1,
+        "content": sampler.folded().encode("utf-8")
+    })
+    file_doc.insert(ignore_permissions=True)
+
+    summary = {
+        "duration": round(duration, 3),
+        "samples": sampler.sample_count,
+        "sample_interval": sampler.interval,
+        "query_count": counter.count,
+        "query_time": round(counter.total_time, 3),
+        "pid": os.getpid(),
+        "top_functions": sampler.top_functions(),
+        "slow_queries": counter.slowest()
+    }
+    frappe.db.set_value("FinTS Statement Sync Item", rows[0], {
+        "profile_file": file_doc.file_url,
+        "profile_summary": json.dumps(summary, indent=4)
+    }, update_modified=False)
+    frappe.db.set_value("FinTS Statement Import", docname, "profile_next_sync", 0, update_modified=False)
+    return rows[0]
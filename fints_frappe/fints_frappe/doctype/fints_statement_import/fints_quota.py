@@ -0,0 +1,212 @@
+import frappe
+from frappe.utils import add_days, cint, date_diff, get_datetime, getdate, now_datetime, time_diff_in_seconds, today
+
+import traceback
+from contextlib import contextmanager
+
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_lock import is_sync_in_progress
+
+# PSD2 RTS Art. 36(5)(b): up to four accesses per day without the customer actively requesting them
+DEFAULT_DAILY_ACCESS_LIMIT = 4
+# Automated syncs enqueued per scheduler run, the most active accounts go first
+MAX_AUTO_SYNCS_PER_RUN = 10
+# A learned limit is dropped after this many days without a new TAN challenge, then the configured one is tried again
+LEARNED_LIMIT_DAYS = 7
+# Activity (booked transactions) is measured over this many days
+ACTIVITY_DAYS = 14
+# Transaction modes an automated sync may run, a custom range or a backfill needs the user
+AUTO_SYNC_MODES = ("Fetch Last 30 Days", "Fetch Last 120 Days")
+
+
+def get_access_quota(fints_account=None):
+    """
+        Returns the access counters of a FinTS account for today and its effective unattended limit.
+        The limit is the configured 'Daily Access Limit', lowered to what the bank recently allowed this login.
+        Args:
+            fints_account (str): The name of the 'FinTS Settings' document.
+        Returns:
+            frappe._dict: limit, accesses, unattended_accesses, remaining and last_unattended_access.
+    """
+    fints_doc = frappe.get_doc("FinTS Settings", fints_account)
+    limit = cint(fints_doc.daily_access_limit) or DEFAULT_DAILY_ACCESS_LIMIT
+    learned_limit = get_learned_access_limit(fints_doc)
+    if learned_limit:
+        limit = min(limit, learned_limit)
+
+    # The counters belong to quota_date, a new day starts with a full budget
+    is_today = fints_doc.quota_date and getdate(fints_doc.quota_date) == getdate(today())
+    accesses = cint(fints_doc.accesses_today) if is_today else 0
+    unattended = cint(fints_doc.unattended_accesses_today) if is_today else 0
+    return frappe._dict({
+        "limit": limit,
+        "accesses": accesses,
+        "unattended_accesses": unattended,
+        "remaining": max(limit - unattended, 0),
+        "last_unattended_access": fints_doc.last_unattended_access if is_today else None
+    })
+
+
+@contextmanager
+def count_bank_access(docname=None, unattended=False):
+    """
+        Counts the bank dialog the block opens or resumes against the quota of the FinTS account.
+        A dialog that fails reached the bank as well: its caller rolls the run back, the access is counted
+        and committed after that rollback.
+        Args:
+            docname (str): The name of the 'FinTS Statement Import' document.
+            unattended (bool): True for automated syncs the user did not trigger.
+    """
+    try:
+        yield
+    except BaseException:
+        frappe.db.after_rollback.add(lambda: record_failed_bank_access(docname, unattended))
+        raise
+    record_bank_access(docname, unattended)
+
+
+def record_failed_bank_access(docname=None, unattended=False):
+    """
+        after_rollback callback of count_bank_access: counts the access of the rolled back run on its own.
+    """
+    record_bank_access(docname, unattended)
+    frappe.db.commit()
+
+
+def record_bank_access(docname=None, unattended=False):
+    """
+        Counts a bank dialog of a statement import against the quota of its FinTS account.
+        Args:
+            docname (str): The name of the 'FinTS Statement Import' document.
+            unattended (bool): True for automated syncs the user did not trigger.
+    """
+    fints_account = frappe.db.get_value("FinTS Statement Import", docname, "fints_account")
+    if not fints_account:
+        return
+
+    quota = get_access_quota(fints_account)
+    values = {
+        "quota_date": today(),
+        "accesses_today": quota.accesses + 1,
+        "unattended_accesses_today": quota.unattended_accesses + (1 if unattended else 0)
+    }
+    if unattended:
+        values["last_unattended_access"] = now_datetime()
+    frappe.db.set_value("FinTS Settings", fints_account, values, update_modified=False)
+
+
+def learn_access_limit(docname=None, response=None):
+    """
+        An unattended sync that the bank answers with a TAN challenge shows the bank's real limit for this login,
+        it is stored with its date on the FinTS account and replaces an older one. Must run under fints_account_lock,
+        after the sync's access has been counted.
+        Args:
+            docname (str): The name of the 'FinTS Statement Import' document.
+            response (dict): The response of the unattended sync.
+    """
+    if not (response or {}).get("tan_required"):
+        return
+    fints_account = frappe.db.get_value("FinTS Statement Import", docname, "fints_account")
+    if not fints_account:
+        return
+
+    # Everything before the challenged access went through without a TAN. Limits differ per login (SCA exemption,
+    # contract), so it is not shared with other accounts of the bank.
+    quota = get_access_quota(fints_account)
+    frappe.db.set_value("FinTS Settings", fints_account, {
+        "learned_access_limit": max(quota.unattended_accesses - 1, 1),
+        "access_limit_learned_on": today()
+    }, update_modified=False)
+
+
+def get_learned_access_limit(fints_doc=None):
+    """
+        Returns the unattended access limit learned for a FinTS account, 0 if none was learned or it has expired.
+        The syncs never exceed a learned limit, so a higher one can't be observed. After LEARNED_LIMIT_DAYS without
+        a TAN challenge the limit expires and the configured one is tried again; a challenge learns it anew.
+        Args:
+            fints_doc (Document): The 'FinTS Settings' document instance.
+        Returns:
+            int: The learned limit.
+    """
+    if not cint(fints_doc.learned_access_limit) or not fints_doc.access_limit_learned_on:
+        return 0
+    if date_diff(today(), fints_doc.access_limit_learned_on) >= LEARNED_LIMIT_DAYS:
+        return 0
+    return cint(fints_doc.learned_access_limit)
+
+
+def get_account_activity(bank_account=None):
+    """
+        Returns the number of transactions booked on a Bank Account during the last ACTIVITY_DAYS days.
+    """
+    counts = frappe.get_all("FinTS Transaction Aggregate",
+                            filters={"bank_account": bank_account, "dimension": "Day",
+                                     "posting_date": [">=", add_days(today(), -ACTIVITY_DAYS)]},
+                            pluck="transaction_count")
+    return sum(cint(count) for count in counts)
+
+
+def is_auto_sync_due(quota=None, now=None):
+    """
+        Spreads the remaining budget evenly over the rest of the day: with n accesses left and
+        t seconds to midnight, an account is due t/n seconds after its last unattended access.
+    """
+    if quota.remaining <= 0:
+        return False
+    if not quota.last_unattended_access:
+        return True
+
+    seconds_left = time_diff_in_seconds(get_datetime(add_days(today(), 1)), now)
+    interval = seconds_left / quota.remaining
+    return time_diff_in_seconds(now, quota.last_unattended_access) >= interval
+
+
+def schedule_auto_syncs():
+    """
+        Scheduler entry: enqueues the automated syncs that are due, most active accounts first.
+        Statement imports waiting for a TAN, without a dialog state or with a user-driven mode are skipped.
+    """
+    now = now_datetime()
+    candidates = []
+    seen_accounts = set()
+    for stmt in frappe.get_all("FinTS Statement Import",
+                               filters={"auto_sync": 1, "transaction_mode": ["in", AUTO_SYNC_MODES]},
+                               fields=["name", "fints_account", "pause_dialog_state", "tan_data_response"],
+                               order_by="sync_timestamp asc"):
+        # One automated sync per FinTS account and run, they share the quota
+        if stmt.fints_account in seen_accounts or stmt.tan_data_response or not stmt.pause_dialog_state \
+                or is_sync_in_progress(stmt.fints_account):
+            continue
+
+        quota = get_access_quota(stmt.fints_account)
+        if not is_auto_sync_due(quota, now):
+            continue
+
+        seen_accounts.add(stmt.fints_account)
+        bank_account = frappe.db.get_value("FinTS Settings", stmt.fints_account, "bank_account")
+        candidates.append((get_account_activity(bank_account), stmt.name))
+
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+    for activity, docname in candidates[:MAX_AUTO_SYNCS_PER_RUN]:
+        frappe.enqueue(
+            "fints_frappe.fints_frappe.doctype.fints_statement_import.fints_quota.run_auto_sync",
+            queue="long",
+            timeout=1800,
+            job_id="fints_auto_sync:{0}".format(docname),
+            deduplicate=True,
+            docname=docname
+        )
+
+
+def run_auto_sync(docname=None):
+    """
+        Background job: fetches the transactions of a statement import as an unattended access.
+    """
+    # Local import, fints_statement_import imports this module
+    from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_statement_import import sync_transactions
+
+    try:
+        sync_transactions(docname, unattended=True)
+    except Exception:
+        frappe.db.rollback()
+        frappe.log_error(title="FinTS Auto Sync", message=traceback.format_exc())
@@ -0,0 +1,382 @@
+# Copyright (c) 2025, Ahmad Hussnain and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.utils import getdate, now_datetime
+
+import os
+import re
+import hmac
+import json
+import gzip
+import time
+import base64
+import hashlib
+from contextlib import contextmanager
+
+# python-fints
+from fints.client import DATA_BLOB_MAGIC_RETRY, FinTS3PinTanClient, NeedRetryResponse, NeedTANResponse
+from fints.message import FinTSInstituteMessage
+from fints.utils import Password, compress_datablob, decompress_datablob
+
+from fints_frappe.fints_frappe.doctype.fints_bank_capability.fints_bank_capability import (
+    get_bank_capability, get_hkkaz_segments)
+
+# 2: the calls of the recorded run are stored and replayed, identifiers are pseudonymised
+RECORDING_VERSION = 2
+
+# IBANs of the account holder and of every counterparty in the :86: fields
+IBAN_PATTERN = re.compile(rb"\b[A-Z]{2}[0-9]{2}[A-Z0-9]{11,30}\b")
+# Account number (with optional subaccount) in front of the country code and BLZ of an account (KTV/KTI)
+ACCOUNT_PATTERN = re.compile(rb"(?<=[+:])([0-9]{1,30})(?=(?::[0-9A-Za-z]{0,30})?:280:[0-9]{8}\b)")
+# The BLZ after the country code, in accounts, the key names of HNVSK/HNSHK and HKIDN
+BLZ_PATTERN = re.compile(rb"(?<=[+:]280:)([0-9]{8})\b")
+# MT940 lines end with CRLF, some banks use "@@" inside FinTS
+MT940_LINE_END = rb"(?:\r?\n|@@)"
+# :25: account identification (BLZ/account number) of an MT940 statement
+MT940_ACCOUNT_PATTERN = re.compile(rb":25:([^\r\n@]*)")
+# :86: details of a booking, up to the next tag or the end of the statement
+MT940_DETAILS_PATTERN = re.compile(rb":86:(.*?)(?=" + MT940_LINE_END + rb"(?::[0-9]{2}[A-Z]?:|-(?:" + MT940_LINE_END
+                                   + rb"|[:'@]|$)))", re.DOTALL)
+MT940_SUBFIELD_PATTERN = re.compile(rb"(\?[0-9]{2})")
+# Subfields of :86: that are kept: posting text (00), prima nota (10), return debit key (34).
+# Purpose (20-29, 60-63), counterparty BLZ/BIC (30), account (31) and name (32, 33) are pseudonymised.
+MT940_KEPT_SUBFIELDS = (b"?00", b"?10", b"?34")
+# SEPA identifiers in the purpose (EREF+, SVWZ+, ...), kept so the purpose still splits on replay
+SEPA_TAG_PATTERN = re.compile(rb"([A-Z]{4}\+)")
+# HIUPD with its data elements, the customer ID (3) and the account holder names (6, 7) are pseudonymised
+UPD_PATTERN = re.compile(rb"HIUPD:(?:\?.|[^'?])*'", re.DOTALL)
+UPD_PRIVATE_ELEMENTS = (3, 6, 7)
+
+
+class RecordingConnection:
+    """
+        Wraps the transport of a FinTS3PinTanClient and keeps a scrubbed copy of every request/response pair,
+        and of the client calls (see record_call) that caused them.
+    """
+
+    def __init__(self, connection, secrets=None):
+        self.connection = connection
+        self.secrets = [s.encode("iso-8859-1") for s in (secrets or []) if s]
+        self.exchanges = []
+        self.calls = []
+        # Pseudonyms are keyed with a salt that is never stored, a short BLZ or account number can't be looked up
+        self.salt = os.urandom(16)
+
+    def send(self, msg):
+        # The PIN renders as *** while protected, the TAN and the identifiers are scrubbed below
+        with Password.protect():
+            request = msg.render_bytes()
+
+        started = time.monotonic()
+        response = self.connection.send(msg)
+        elapsed = time.monotonic() - started
+
+        self.exchanges.append({
+            "request": self.scrub(request),
+            "response": self.scrub(response.render_bytes()),
+            "elapsed": round(elapsed, 4)
+        })
+        return response
+
+    def add_call(self, call=None, arguments=None):
+        """
+            Notes a client call, the replay repeats the calls in this order.
+        """
+        arguments = dict(arguments or {})
+        if isinstance(arguments.get("tan_request"), NeedRetryResponse):
+            arguments["tan_request"] = base64.b64encode(self.scrub_tan_request(arguments["tan_request"])).decode("ascii")
+        arguments.update({"call": call, "exchange": len(self.exchanges)})
+        self.calls.append(arguments)
+
+    def scrub(self, data):
+        """
+            Masks secrets and pseudonymises account data without changing the length of the data,
+            binary fields (@len@) keep their framing so the segments still parse on replay.
+            IBANs, account numbers and BLZ, the :25: and :86: fields of the statements (counterparty, purpose)
+            and the names in the UPD are pseudonymised, a value gets the same pseudonym throughout the recording.
+            Args:
+                data (bytes): The rendered message.
+            Returns:
+                bytes: The scrubbed message.
+        """
+        for secret in self.secrets:
+            data = data.replace(secret, b"X" * len(secret))
+        data = MT940_DETAILS_PATTERN.sub(lambda m: b":86:" + self.scrub_details(m.group(1)), data)
+        data = MT940_ACCOUNT_PATTERN.sub(lambda m: b":25:" + self.pseudonymize_words(m.group(1)), data)
+        data = UPD_PATTERN.sub(lambda m: self.scrub_upd(m.group(0)), data)
+        data = ACCOUNT_PATTERN.sub(lambda m: self.pseudonymize(m.group(1)), data)
+        data = BLZ_PATTERN.sub(lambda m: self.pseudonymize(m.group(1)), data)
+        return IBAN_PATTERN.sub(lambda m: m.group(0)[:4] + self.pseudonymize(m.group(0)[4:]), data)
+
+    def scrub_details(self, details):
+        """
+            Pseudonymises the :86: subfields that identify the counterparty or carry the purpose.
+            Unstructured details are free text and pseudonymised completely, except for the GVC.
+        """
+        parts = MT940_SUBFIELD_PATTERN.split(details)
+        if len(parts) == 1:
+            return details[:3] + self.pseudonymize(details[3:])
+
+        # parts: GVC, then alternating subfield marker and content
+        for index in range(2, len(parts), 2):
+            if parts[index - 1] not in MT940_KEPT_SUBFIELDS:
+                parts[index] = b"".join(part if SEPA_TAG_PATTERN.fullmatch(part) else self.pseudonymize(part)
+                                        for part in SEPA_TAG_PATTERN.split(parts[index]))
+        return b"".join(parts)
+
+    def scrub_upd(self, segment):
+        """
+            Pseudonymises the customer ID and the account holder names of an HIUPD segment.
+        """
+        elements = re.split(rb"(?<!\?)\+", segment)
+        for index in UPD_PRIVATE_ELEMENTS:
+            if index < len(elements) - 1:
+                elements[index] = self.pseudonymize(elements[index])
+        return b"+".join(elements)
+
+    def scrub_tan_request(self, tan_request):
+        """
+            Returns the data of a TAN request with its segments scrubbed like a message.
+        """
+        version, data = decompress_datablob(DATA_BLOB_MAGIC_RETRY, tan_request.get_data())
+        data["segments_bin"] = self.scrub(data["segments_bin"])
+        return compress_datablob(DATA_BLOB_MAGIC_RETRY, version, data)
+
+    def pseudonymize_words(self, value):
+        """
+            Pseudonymises every run of letters and digits on its own, e.g. BLZ and account number of '12030000/123'.
+        """
+        return re.sub(rb"[0-9A-Za-z]+", lambda m: self.pseudonymize(m.group(0)), value)
+
+    def pseudonymize(self, value):
+        """
+            Replaces every letter and digit by a pseudonym of the same kind, keyed by the whole value.
+            Separators, spaces and line breaks stay, so the value keeps its length and structure.
+            Args:
+                value (bytes): The value to pseudonymise.
+            Returns:
+                bytes: The pseudonym.
+        """
+        digest = hmac.new(self.salt, value, hashlib.sha256).digest()
+        while len(digest) < len(value):
+            digest += hashlib.sha256(digest).digest()
+
+        pseudonym = bytearray()
+        for char, key in zip(value, digest):
+            if 48 <= char <= 57:
+                pseudonym.append(48 + key % 10)
+            elif 65 <= char <= 90:
+                pseudonym.append(65 + key % 26)
+            elif 97 <= char <= 122 or char >= 128:
+                # Umlauts are single bytes in ISO 8859-1, they become a plain letter
+                pseudonym.append(97 + key % 26)
+            else:
+                pseudonym.append(char)
+        return bytes(pseudonym)
+
+
+class ReplayConnection:
+    """
+        Transport that answers with the recorded responses, in order, without a network.
+    """
+
+    def __init__(self, exchanges):
+        self.exchanges = list(exchanges)
+        self.position = 0
+
+    def send(self, msg):
+        if self.position >= len(self.exchanges):
+            raise ValueError("The recording has no response left for message {0}.".format(self.position + 1))
+
+        exchange = self.exchanges[self.position]
+        self.position += 1
+        return FinTSInstituteMessage(segments=exchange["response"])
+
+
+@contextmanager
+def record_bank_responses(f, stmt_doc, fints_doc, dialog_data=None, tan=None):
+    """
+        Records the dialog of the client while the block runs, if enabled on the statement import.
+        The recording is attached to the document as a private gzip file, also when the block fails:
+        then it is attached once the failed run has been rolled back and goes with the next commit.
+        Args:
+            f (FinTS3PinTanClient): The client whose transport is recorded.
+            stmt_doc (Document): The 'FinTS Statement Import' document instance.
+            fints_doc (Document): The 'FinTS Settings' document instance.
+            dialog_data (bytes): The paused dialog state the block resumes.
+            tan (str): The TAN sent in the block, scrubbed from the requests.
+    """
+    if not stmt_doc.record_bank_responses:
+        yield None
+        return
+
+    recorder = RecordingConnection(f.connection, secrets=[
+        fints_doc.username, fints_doc.get_password("password"), tan,
+        stmt_doc.selected_account_iban
+    ])
+    f.connection = recorder
+    failed = False
+    try:
+        yield recorder
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        f.connection = recorder.connection
+        if recorder.exchanges and failed:
+            # A failed run is rolled back by its caller, the recording is attached after that rollback
+            frappe.db.after_rollback.add(lambda: save_recording(recorder, stmt_doc, fints_doc, dialog_data))
+        elif recorder.exchanges:
+            save_recording(recorder, stmt_doc, fints_doc, dialog_data)
+
+
+def save_recording(recorder, stmt_doc, fints_doc, dialog_data=None):
+    """
+        Attaches the recorded exchanges to the statement import.
+        Args:
+            recorder (RecordingConnection): The recorder holding the exchanges.
+            stmt_doc (Document): The 'FinTS Statement Import' document instance.
+            fints_doc (Document): The 'FinTS Settings' document instance.
+            dialog_data (bytes): The paused dialog state the recording starts from.
+        Returns:
+            str: The URL of the attached file.
+    """
+    # The shared BPD of the registry holds no user data, the replay client starts from it
+    capability = get_bank_capability(fints_doc)
+    recording = {
+        "version": RECORDING_VERSION,
+        "recorded_at": str(now_datetime()),
+        "blz": recorder.pseudonymize((fints_doc.blz or "").encode("ascii")).decode("ascii"),
+        "transaction_mode": stmt_doc.transaction_mode,
+        "start_date": str(stmt_doc.start_date or ""),
+        "last_date": str(stmt_doc.last_date or ""),
+        "bpd_state": capability.bpd_state if capability else None,
+        "dialog_state": base64.b64encode(dialog_data).decode("ascii") if dialog_data else None,
+        "calls": recorder.calls,
+        "exchanges": [{
+            "request": base64.b64encode(exchange["request"]).decode("ascii"),
+            "response": base64.b64encode(exchange["response"]).decode("ascii"),
+            "elapsed": exchange["elapsed"]
+        } for exchange in recorder.exchanges]
+    }
+
+    file_doc = frappe.get_doc({
+        "doctype": "File",
+        "file_name": "fints-recording-{0}-{1}.json.gz".format(
+            stmt_doc.name, now_datetime().strftime("%Y%m%d%H%M%S")),
+        "attached_to_doctype": stmt_doc.doctype,
+        "attached_to_name": stmt_doc.name,
+        "is_private": 1,
+        "content": gzip.compress(json.dumps(recording).encode("utf-8"))
+    })
+    file_doc.insert(ignore_permissions=True)
+    return file_doc.file_url
+
+
+def load_recording(content):
+    """
+        Reads a recording written by save_recording.
+        Args:
+            content (bytes|str): The gzip content or a path to the file.
+        Returns:
+            dict: The recording with the exchanges decoded to bytes.
+    """
+    if isinstance(content, str):
+        with open(content, "rb") as fh:
+            content = fh.read()
+
+    recording = json.loads(gzip.decompress(content))
+    if recording.get("version") != RECORDING_VERSION:
+        raise ValueError("Unsupported recording version {0}.".format(recording.get("version")))
+
+    for exchange in recording["exchanges"]:
+        exchange["request"] = base64.b64decode(exchange["request"])
+        exchange["response"] = base64.b64decode(exchange["response"])
+    return recording
+
+
+def record_call(f=None, call=None, **arguments):
+    """
+        Notes a client call in the recording of the client, if one is running. The replay repeats the calls
+        in the order they were made, with these arguments.
+        Args:
+            f (FinTS3PinTanClient): The client that makes the call.
+            call (str): One of the calls replay_recording knows.
+            arguments: JSON values, and the NeedRetryResponse of a TAN as tan_request.
+    """
+    connection = getattr(f, "connection", None)
+    if isinstance(connection, RecordingConnection):
+        connection.add_call(call, arguments)
+
+
+def replay_recording(content):
+    """
+        Feeds a recording back through a FinTS3PinTanClient, offline and deterministically, by repeating
+        the recorded calls (accounts, statement chunks, balance, TAN submission) in their order.
+        Useful as a benchmark fixture:
+        bench execute fints_frappe...fints_recorder.replay_recording --args "['/path/recording.json.gz']"
+        Args:
+            content (bytes|str): The gzip content or a path to the file.
+        Returns:
+            dict: Number of calls, exchanges and transactions, and the recorded and replayed durations.
+    """
+    from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_helpers import (
+        fetch_statement, send_statement_tan)
+
+    recording = load_recording(content)
+    if not recording.get("bpd_state"):
+        raise ValueError("The recording has no BPD, the bank was not in the capability registry when it was made.")
+
+    f = FinTS3PinTanClient(
+        bank_identifier=recording["blz"],
+        user_id="replay",
+        pin="replay",
+        server="https://replay.invalid/",
+        product_id="replay",
+        from_data=base64.b64decode(recording["bpd_state"])
+    )
+    f.connection = ReplayConnection(recording["exchanges"])
+    hkkaz_segments = get_hkkaz_segments()
+
+    started = time.monotonic()
+    if recording.get("dialog_state"):
+        dialog = f.resume_dialog(base64.b64decode(recording["dialog_state"]))
+    else:
+        dialog = f
+    account = None
+    transactions = 0
+    calls = 0
+    with dialog:
+        for call in recording["calls"]:
+            if call["call"] == "get_sepa_accounts":
+                result = f.get_sepa_accounts()
+                if not isinstance(result, NeedTANResponse):
+                    account = result[0]
+            elif call["call"] == "fetch_statement":
+                result = fetch_statement(f, None, account, getdate(call["start_date"]),
+                                         getdate(call["end_date"]),
+                                         hkkaz=hkkaz_segments[call["hkkaz_version"]])
+            elif call["call"] == "get_balance":
+                result = f.get_balance(account)
+            elif call["call"] == "send_tan":
+                tan_request = NeedRetryResponse.from_data(base64.b64decode(call["tan_request"]))
+                result = send_statement_tan(f, None, tan_request, "replay",
+                                            hkkaz=hkkaz_segments[call["hkkaz_version"]])
+            else:
+                raise ValueError("Unknown call {0} in the recording.".format(call["call"]))
+
+            calls += 1
+            # The recorded run stopped for a TAN here as well
+            if isinstance(result, NeedTANResponse):
+                break
+            if call["call"] in ("fetch_statement", "send_tan"):
+                transactions += len(result)
+
+    return {
+        "calls": calls,
+        "exchanges": f.connection.position,
+        "transactions": transactions,
+        "recorded_seconds": round(sum(e["elapsed"] for e in recording["exchanges"]), 4),
+        "replayed_seconds": round(time.monotonic() - started, 4)
+    }
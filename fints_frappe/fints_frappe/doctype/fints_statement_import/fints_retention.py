@@ -0,0 +1,249 @@
+import frappe
+from frappe.utils import add_days, add_to_date, cint, flt, get_datetime, now_datetime
+
+import json
+import traceback
+
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_lock import (
+    FinTSSyncInProgressError, fints_account_lock)
+
+# Defaults of the retention policy fields of FinTS Settings
+DEFAULT_PAYLOAD_RETENTION_DAYS = 90
+DEFAULT_SESSION_RETENTION_DAYS = 30
+DEFAULT_RECORDING_RETENTION_DAYS = 14
+# A TAN challenge nobody answered within this many hours has expired at the bank, and its dialog with it
+STALE_TAN_HOURS = 24
+# Delivered outbox events are kept this long, 'fints_event_retention_days' in the site config overrides it
+DEFAULT_EVENT_RETENTION_DAYS = 30
+# The retention job doesn't wait for a running sync, the next run catches up
+RETENTION_LOCK_WAIT = 0
+# Each month of the sync history is compacted under this savepoint, a failing month doesn't undo the others
+COMPACTION_SAVEPOINT = "fints_compaction"
+SESSION_STATE_FIELDS = {
+    "mechanism_connected": 0,
+    "selected_mechanism_id": "",
+    "account_get": 0,
+    "selected_account_iban": "",
+    "pause_dialog_state": "",
+    "from_data_state": "",
+    "tan_data_response": "",
+    "challenge": "",
+}
+
+
+def apply_retention_policies():
+    """
+        Scheduler entry (daily): compacts old sync history, purges expired session state and recordings of every
+        statement import, then the delivered outbox events. An import that is syncing is skipped until the next run.
+    """
+    for stmt in frappe.get_all("FinTS Statement Import", filters={"fints_account": ["is", "set"]},
+                               fields=["name", "fints_account"]):
+        policy = get_retention_policy(stmt.fints_account)
+        try:
+            # The lock commits the work when it is released, and rolls it back on an error
+            with fints_account_lock(stmt.name, wait=RETENTION_LOCK_WAIT):
+                compact_sync_history(stmt.name, policy.payload_days)
+                purge_session_state(stmt.name, policy.session_days)
+                purge_recordings(stmt.name, policy.recording_days)
+        except FinTSSyncInProgressError:
+            continue
+        except Exception:
+            frappe.log_error(title="FinTS Retention", message=traceback.format_exc())
+
+    purge_transaction_events()
+    frappe.db.commit()
+
+
+def get_retention_policy(fints_account=None):
+    """
+        Returns the retention periods of a FinTS account in days.
+    """
+    values = frappe.db.get_value("FinTS Settings", fints_account,
+                                 ["payload_retention_days", "session_retention_days", "recording_retention_days"],
+                                 as_dict=True) or {}
+    return frappe._dict({
+        "payload_days": cint(values.get("payload_retention_days")) or DEFAULT_PAYLOAD_RETENTION_DAYS,
+        "session_days": cint(values.get("session_retention_days")) or DEFAULT_SESSION_RETENTION_DAYS,
+        "recording_days": cint(values.get("recording_retention_days")) or DEFAULT_RECORDING_RETENTION_DAYS
+    })
+
+
+def compact_sync_history(docname=None, payload_days=DEFAULT_PAYLOAD_RETENTION_DAYS):
+    """
+        Replaces the sync history rows older than payload_days by one 'Compacted' row per month.
+        The compacted row keeps the number of syncs and transactions, the date range, the credit and debit sums
+        and the last closing balance of the month, but no payload or profile. A month compacted earlier absorbs the rows
+        that became old since. Every month is compacted under its own savepoint: a month that fails is rolled back
+        and logged, the others are kept. Must run under fints_account_lock.
+        Args:
+            docname (str): The name of the 'FinTS Statement Import' document.
+            payload_days (int): Days of full payloads to keep.
+        Returns:
+            int: The number of removed rows.
+    """
+    cutoff = add_days(now_datetime(), -cint(payload_days))
+    rows = frappe.get_all("FinTS Statement Sync Item",
+                          filters={"parent": docname, "parenttype": "FinTS Statement Import",
+                                   "parentfield": "sync_history", "sync_timestamp": ["<", cutoff]},
+                          fields=["name", "idx", "sync_timestamp", "sync_source", "total", "start_date", "end_date",
+                                  "closing_balance", "continuity_status", "compacted_syncs", "total_credits",
+                                  "total_debits", "profile_file"],
+                          order_by="idx asc")
+
+    months = {}
+    for row in rows:
+        months.setdefault(get_datetime(row.sync_timestamp).strftime("%Y-%m"), []).append(row)
+
+    removed = 0
+    for month, month_rows in months.items():
+        if len(month_rows) == 1 and month_rows[0].sync_source == "Compacted":
+            continue
+
+        frappe.db.savepoint(COMPACTION_SAVEPOINT)
+        try:
+            removed += compact_month(docname, month_rows)
+        except Exception:
+            frappe.db.rollback(save_point=COMPACTION_SAVEPOINT)
+            frappe.log_error(title="FinTS Retention {0} {1}".format(docname, month), message=traceback.format_exc())
+            continue
+        frappe.db.release_savepoint(COMPACTION_SAVEPOINT)
+    return removed
+
+
+def compact_month(docname=None, month_rows=None):
+    """
+        Replaces the sync history rows of one month by a single 'Compacted' row.
+        Args:
+            docname (str): The name of the 'FinTS Statement Import' document.
+            month_rows (list): The rows of the month, in sync order.
+        Returns:
+            int: The number of removed rows.
+    """
+    # Payloads are read a month at a time, the first run may find years of history
+    payloads = dict(frappe.get_all("FinTS Statement Sync Item",
+                                   filters={"name": ["in", [row.name for row in month_rows]]},
+                                   fields=["name", "sync_json"], as_list=True))
+    aggregate = {"compacted_syncs": 0, "total": 0, "total_credits": 0, "total_debits": 0}
+    for row in month_rows:
+        if row.sync_source == "Compacted":
+            aggregate["compacted_syncs"] += cint(row.compacted_syncs)
+            aggregate["total_credits"] += flt(row.total_credits)
+            aggregate["total_debits"] += flt(row.total_debits)
+        else:
+            aggregate["compacted_syncs"] += 1
+            credits, debits = get_payload_totals(payloads.get(row.name))
+            aggregate["total_credits"] += credits
+            aggregate["total_debits"] += debits
+        aggregate["total"] += cint(row.total)
+
+    start_dates = [row.start_date for row in month_rows if row.start_date]
+    end_dates = [row.end_date for row in month_rows if row.end_date]
+    balances = [row for row in month_rows if row.closing_balance is not None]
+    # Takes the place of the oldest row, the history stays in sync order
+    compacted = frappe.get_doc({
+        "doctype": "FinTS Statement Sync Item",
+        "parent": docname,
+        "parenttype": "FinTS Statement Import",
+        "parentfield": "sync_history",
+        "idx": month_rows[0].idx,
+        "sync_timestamp": month_rows[-1].sync_timestamp,
+        "sync_source": "Compacted",
+        "start_date": min(start_dates) if start_dates else None,
+        "end_date": max(end_dates) if end_dates else None,
+        "closing_balance": balances[-1].closing_balance if balances else None,
+        "continuity_status": balances[-1].continuity_status if balances else ""
+    })
+    compacted.update(aggregate)
+    compacted.db_insert()
+    frappe.db.delete("FinTS Statement Sync Item", {"name": ["in", [row.name for row in month_rows]]})
+    # Profiles belong to a single sync, they go with its row
+    for file_url in [row.profile_file for row in month_rows if row.profile_file]:
+        for file_name in frappe.get_all("File", filters={"file_url": file_url}, pluck="name"):
+            frappe.delete_doc("File", file_name, ignore_permissions=True)
+    return len(month_rows)
+
+
+def get_payload_totals(sync_json=None):
+    """
+        Returns the (credits, debits) of the transactions stored in a sync payload, both positive.
+        File import payloads are summaries without transactions, they count as zero.
+    """
+    try:
+        transactions = json.loads(sync_json or "[]")
+    except ValueError:
+        return 0, 0
+    if not isinstance(transactions, list):
+        return 0, 0
+
+    credits = debits = 0
+    for txn_dict in transactions:
+        amount = abs(flt((txn_dict.get("amount") or {}).get("amount")))
+        if txn_dict.get("status") == "C":
+            credits += amount
+        elif txn_dict.get("status") == "D":
+            debits += amount
+    return credits, debits
+
+
+def purge_session_state(docname=None, session_days=DEFAULT_SESSION_RETENTION_DAYS):
+    """
+        Clears the connection state (client and dialog blobs, TAN challenge, steps 1 and 2) of an abandoned import:
+        no sync for session_days, or a TAN challenge left unanswered for STALE_TAN_HOURS.
+        The user connects again like after 'Reset Connection'. Must run under fints_account_lock.
+        Args:
+            docname (str): The name of the 'FinTS Statement Import' document.
+            session_days (int): Days without a sync after which the session state is dropped.
+        Returns:
+            bool: True if the state was cleared.
+    """
+    stmt = frappe.db.get_value("FinTS Statement Import", docname,
+                               ["sync_timestamp", "modified", "auto_sync", "from_data_state", "pause_dialog_state",
+                                "tan_data_response"], as_dict=True)
+    if not (stmt.from_data_state or stmt.pause_dialog_state or stmt.tan_data_response):
+        return False
+
+    now = now_datetime()
+    last_activity = get_datetime(stmt.sync_timestamp or stmt.modified)
+    stale_tan = stmt.tan_data_response and get_datetime(stmt.modified) < add_to_date(now, hours=-STALE_TAN_HOURS)
+    # Automated syncs keep their dialog alive, unless they are stuck on a TAN
+    abandoned = not cint(stmt.auto_sync) and last_activity < add_days(now, -cint(session_days))
+    if not (stale_tan or abandoned):
+        return False
+
+    frappe.db.set_value("FinTS Statement Import", docname, SESSION_STATE_FIELDS, update_modified=False)
+    return True
+
+
+def purge_recordings(docname=None, recording_days=DEFAULT_RECORDING_RETENTION_DAYS):
+    """
+        Deletes the bank response recordings attached to an import that are older than recording_days.
+        Returns:
+            int: The number of deleted files.
+    """
+    files = frappe.get_all("File",
+                           filters={"attached_to_doctype": "FinTS Statement Import", "attached_to_name": docname,
+                                    "file_name": ["like", "fints-recording-%"],
+                                    "creation": ["<", add_days(now_datetime(), -cint(recording_days))]},
+                           pluck="name")
+    for name in files:
+        frappe.delete_doc("File", name, ignore_permissions=True)
+    return len(files)
+
+
+def purge_transaction_events():
+    """
+        Deletes outbox events older than the event retention that every enabled sink has received.
+        Disabled sinks don't hold the purge back: a sink enabled again continues with the oldest event still kept.
+        Returns:
+            int: The number of deleted events.
+    """
+    retention_days = cint(frappe.conf.get("fints_event_retention_days")) or DEFAULT_EVENT_RETENTION_DAYS
+    filters = {"creation": ["<", add_days(now_datetime(), -retention_days)], "sequence": [">", 0]}
+    cursors = frappe.get_all("FinTS Event Sink", filters={"enabled": 1}, pluck="last_event")
+    if cursors:
+        filters["sequence"] = ["between", [1, min(cint(cursor) for cursor in cursors)]]
+
+    names = frappe.get_all("FinTS Transaction Event", filters=filters, pluck="name")
+    if names:
+        frappe.db.delete("FinTS Transaction Event", {"name": ["in", names]})
+    return len(names)
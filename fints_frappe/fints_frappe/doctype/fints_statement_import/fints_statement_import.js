@@ -2,8 +2,37 @@
 // For license information, please see license.txt
 
 frappe.ui.form.on("FinTS Statement Import", {
+    onload: function (frm) {
+        // A backfill runs as a background job, it publishes every imported chunk and its result
+        frappe.realtime.off("fints_backfill_progress");
+        frappe.realtime.on("fints_backfill_progress", function (data) {
+            if (data.docname !== frm.doc.name) {
+                return;
+            }
+            if (!data.done) {
+                frappe.show_progress(__("Backfill"), data.chunk, data.chunks,
+                    __("Imported {0} to {1}", [data.start_date, data.end_date]));
+                return;
+            }
+            frappe.hide_progress();
+            if (data.response.tan_required) {
+                show_tan_prompt_for_statement(frm, data.response);
+            } else {
+                frappe.msgprint({
+                    message: data.response.message,
+                    indicator: data.response.ok ? "blue" : "red"
+                });
+                frm.reload_doc();
+            }
+        });
+    },
+
     refresh: function (frm) {
+        if (frm.doc.sync_status === "In Progress") {
+            frm.set_intro(__("A sync is in progress for this FinTS Account. Reload the form once it has finished."), "orange");
+        }
         if (!frm.is_new()) {
+            render_sync_history(frm, 0);
             // Fetch Transactions
             frm.add_custom_button(__("Fetch Transactions"), function () {
                 frappe.call({
@@ -19,7 +48,7 @@ frappe.ui.form.on("FinTS Statement Import", {
                         } else {
                             frappe.msgprint({
                                 message: r.message.message,
-                                indicator: "blue"
+                                indicator: r.message.in_progress ? "orange" : "blue"
                             });
                             frm.reload_doc();
                         }
@@ -78,6 +107,27 @@ frappe.ui.form.on("FinTS Statement Import", {
             }
         });
     },
+    // Offline: Import Statement File
+    btn_import_file: function (frm) {
+        if (frm.is_dirty()) {
+            return frappe.msgprint(__("Please save the document before importing the file."));
+        }
+        if (!frm.doc.statement_file) {
+            return frappe.msgprint(__("Please attach a MT940/STA or CAMT statement file first."));
+        }
+
+        frappe.call({
+            method: "fints_frappe.fints_frappe.doctype.fints_statement_import.fints_statement_import.import_statement_file",
+            args: {docname: frm.doc.name},
+            freeze: true,
+            freeze_message: __("Queueing file import..."),
+            callback: function (r) {
+                if (!r.exc && r.message) {
+                    frappe.msgprint(r.message.message);
+                }
+            }
+        });
+    },
     // Step 2: Get Account
     btn_get_accounts: function (frm) {
         if (!frm.doc.mechanism_connected || !frm.doc.selected_mechanism_id) {
@@ -109,6 +159,106 @@ frappe.ui.form.on("FinTS Statement Import", {
     }
 });
 
+// Sync history: the rows are not part of the loaded document, they are read page by page
+function render_sync_history(frm, start) {
+    const wrapper = frm.get_field("sync_history_html").$wrapper;
+    frappe.call({
+        method: "fints_frappe.fints_frappe.doctype.fints_statement_import.fints_statement_import.get_sync_history",
+        args: {docname: frm.doc.name, start: start},
+        callback: function (r) {
+            if (r.exc || !r.message) {
+                return;
+            }
+            const rows = r.message.rows;
+            const total = r.message.total;
+            const page_length = 20;
+
+            if (!total) {
+                wrapper.html(`<div class="text-muted">${__("No syncs yet.")}</div>`);
+                return;
+            }
+
+            const body = rows.map(row => `
+                <tr>
+                    <td>${row.idx}</td>
+                    <td>${frappe.datetime.str_to_user(row.sync_timestamp) || ""}</td>
+                    <td>${frappe.utils.escape_html(row.sync_source || "")}</td>
+                    <td>${row.total || 0}${row.compacted_syncs ? ` (${__("{0} syncs", [row.compacted_syncs])})` : ""}</td>
+                    <td>${frappe.datetime.str_to_user(row.start_date) || ""} - ${frappe.datetime.str_to_user(row.end_date) || ""}</td>
+                    <td>${row.closing_balance != null ? format_currency(row.closing_balance) : ""}</td>
+                    <td>${frappe.utils.escape_html(row.continuity_status || "")}</td>
+                    <td>
+                        ${row.sync_source === "Compacted" ? "" : `<button class="btn btn-xs btn-default sync-payload" data-row="${row.name}">${__("View")}</button>`}
+                        ${row.profile_file ? `<button class="btn btn-xs btn-default sync-profile" data-row="${row.name}">${__("Profile")}</button>
+                            <a class="btn btn-xs btn-default" href="${encodeURI(row.profile_file)}" target="_blank">${__("Stacks")}</a>` : ""}
+                    </td>
+                </tr>`).join("");
+
+            wrapper.html(`
+                <table class="table table-bordered table-condensed">
+                    <thead>
+                        <tr>
+                            <th>#</th>
+                            <th>${__("Sync Timestamp")}</th>
+                            <th>${__("Source")}</th>
+                            <th>${__("Total")}</th>
+                            <th>${__("Period")}</th>
+                            <th>${__("Closing Balance")}</th>
+                            <th>${__("Continuity Status")}</th>
+                            <th></th>
+                        </tr>
+                    </thead>
+                    <tbody>${body}</tbody>
+                </table>
+                <div class="flex justify-between align-center">
+                    <span class="text-muted">${__("{0} - {1} of {2}", [start + 1, start + rows.length, total])}</span>
+                    <span>
+                        <button class="btn btn-xs btn-default sync-prev" ${start ? "" : "disabled"}>${__("Previous")}</button>
+                        <button class="btn btn-xs btn-default sync-next" ${start + page_length < total ? "" : "disabled"}>${__("Next")}</button>
+                    </span>
+                </div>`);
+
+            wrapper.find(".sync-prev").on("click", () => render_sync_history(frm, Math.max(start - page_length, 0)));
+            wrapper.find(".sync-next").on("click", () => render_sync_history(frm, start + page_length));
+            wrapper.find(".sync-payload").on("click", function () {
+                show_sync_payload(frm, $(this).attr("data-row"));
+            });
+            wrapper.find(".sync-profile").on("click", function () {
+                show_sync_payload(frm, $(this).attr("data-row"), "profile_summary");
+            });
+        }
+    });
+}
+
+// The JSON payload (or profile summary) of a single sync, fetched on demand
+function show_sync_payload(frm, row_name, fieldname) {
+    frappe.call({
+        method: "fints_frappe.fints_frappe.doctype.fints_statement_import.fints_statement_import.get_sync_payload",
+        args: {docname: frm.doc.name, row_name: row_name, fieldname: fieldname || "sync_json"},
+        freeze: true,
+        freeze_message: __("Loading sync data..."),
+        callback: function (r) {
+            if (r.exc) {
+                return;
+            }
+            let d = new frappe.ui.Dialog({
+                title: fieldname === "profile_summary" ? __("Sync Profile") : __("Sync Data"),
+                size: "extra-large",
+                fields: [
+                    {
+                        fieldname: "sync_json",
+                        fieldtype: "Code",
+                        options: "JSON",
+                        read_only: 1,
+                        default: r.message || ""
+                    }
+                ]
+            });
+            d.show();
+        }
+    });
+}
+
 // Once we have a mechanism list, let the user pick
 function show_mechanisms_dialog(frm, mechs) {
     if (!mechs || mechs.length === 0) {
@@ -193,6 +343,11 @@ function show_tan_prompt_for_statement(frm, server_message) {
                         if (r.message.ok) {
                             frappe.msgprint(r.message.message);
                             frm.reload_doc();
+                        } else if (r.message.in_progress) {
+                            frappe.msgprint({
+                                message: r.message.message,
+                                indicator: "orange"
+                            });
                         }
                     }
                 }
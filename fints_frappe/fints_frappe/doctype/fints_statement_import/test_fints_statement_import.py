@@ -1,9 +1,279 @@
 # Copyright (c) 2025, Ahmad Hussnain and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests.utils import FrappeTestCase
+from frappe.utils import getdate
+
+import os
+import tempfile
+
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_file_import import (
+	iter_camt_chunks, iter_mt940_text_chunks)
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_helpers import (
+	check_balance_continuity, get_statement_balances)
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_parallel import (
+	prepare_chunks, prepare_dict_chunk, prepare_mt940_chunk)
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_recorder import RecordingConnection
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_retention import get_payload_totals
+
+STATEMENTS = (
+	":20:STARTUMSE@@:25:12030000/1234567890@@:28C:00001/001@@"
+	":60F:C250301EUR1000,00@@:61:2503010301DR50,00NMSCNONREF@@:86:005?00LASTSCHRIFT@@"
+	":62F:C250301EUR950,00@@-@@"
+	":20:STARTUMSE@@:25:12030000/1234567890@@:28C:00002/001@@"
+	":60F:C250301EUR950,00@@:61:2503030303CR200,00NTRFNONREF@@:86:166?00GUTSCHRIFT@@"
+	":62F:C250303EUR1150,00@@-"
+)
+
+# The same booking as a bank sends it in MT940 and in CAMT.053
+MT940_STATEMENT = (
+	":20:STARTUMSE\r\n:25:12030000/1234567890\r\n:28C:00001/001\r\n:60F:C250301EUR1000,00\r\n"
+	":61:2503030303CR200,00NTRFNONREF//4711\r\n"
+	":86:166?00GUTSCHRIFT?109310?20EREF+E2E-4711?21SVWZ+Rechnung 42 Muel?22ler?30COBADEFFXXX"
+	"?31DE89370400440532013000?32Muster GmbH\r\n"
+	":62F:C250303EUR1200,00\r\n-"
+)
+CAMT_STATEMENT = """<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.02">
+<BkToCstmrStmt><Stmt>
+<Ntry>
+	<Amt Ccy="EUR">200.00</Amt><CdtDbtInd>CRDT</CdtDbtInd>
+	<BookgDt><Dt>2025-03-03</Dt></BookgDt><ValDt><Dt>2025-03-03</Dt></ValDt>
+	<AcctSvcrRef>2025030300042</AcctSvcrRef>
+	<NtryDtls><TxDtls>
+		<Refs><EndToEndId>E2E-4711</EndToEndId></Refs>
+		<RltdPties><Dbtr><Nm>Muster GmbH</Nm></Dbtr><DbtrAcct><Id><IBAN>DE89370400440532013000</IBAN></Id></DbtrAcct></RltdPties>
+		<RmtInf><Ustrd>Rechnung 42</Ustrd><Ustrd>Müller</Ustrd></RmtInf>
+	</TxDtls></NtryDtls>
+	<AddtlNtryInf>GUTSCHRIFT</AddtlNtryInf>
+</Ntry>
+<Ntry>
+	<Amt Ccy="EUR">9.99</Amt><CdtDbtInd>DBIT</CdtDbtInd>
+	<BookgDt><Dt>2025-03-04</Dt></BookgDt><ValDt><Dt>2025-03-05</Dt></ValDt>
+	<NtryDtls><TxDtls>
+		<Refs><EndToEndId>NOTPROVIDED</EndToEndId></Refs>
+		<RltdPties><Cdtr><Nm>Stadtwerke</Nm></Cdtr></RltdPties>
+	</TxDtls></NtryDtls>
+</Ntry>
+</Stmt></BkToCstmrStmt>
+</Document>
+"""
+# An intraday report: one booked, one pending and one advice-only entry, status as code (camt.052.001.08)
+CAMT_REPORT = """<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.052.001.08">
+<BkToCstmrAcctRpt><Rpt>
+<Ntry>
+	<Amt Ccy="EUR">200.00</Amt><CdtDbtInd>CRDT</CdtDbtInd><Sts><Cd>BOOK</Cd></Sts>
+	<BookgDt><Dt>2025-03-03</Dt></BookgDt><ValDt><Dt>2025-03-03</Dt></ValDt>
+</Ntry>
+<Ntry>
+	<Amt Ccy="EUR">45.90</Amt><CdtDbtInd>DBIT</CdtDbtInd><Sts><Cd>PDNG</Cd></Sts>
+	<ValDt><Dt>2025-03-04</Dt></ValDt>
+	<NtryDtls><TxDtls>
+		<Refs><EndToEndId>E2E-0815</EndToEndId></Refs>
+		<RltdPties><Cdtr><Nm>Versandhaus</Nm></Cdtr></RltdPties>
+	</TxDtls></NtryDtls>
+</Ntry>
+<Ntry>
+	<Amt Ccy="EUR">1000.00</Amt><CdtDbtInd>CRDT</CdtDbtInd><Sts><Cd>INFO</Cd></Sts>
+	<ValDt><Dt>2025-03-10</Dt></ValDt>
+</Ntry>
+</Rpt></BkToCstmrAcctRpt>
+</Document>
+"""
+COMPANY_INFO = {"company": "_Test Company", "bank_account": "_Test Bank Account"}
+
+
+def write_statement_file(content):
+	fd, path = tempfile.mkstemp()
+	with os.fdopen(fd, "wb") as fh:
+		fh.write(content.encode("utf-8") if isinstance(content, str) else content)
+	return path
+
+
+def make_import(**values):
+	stmt_doc = frappe._dict(transaction_mode="Fetch Last 30 Days", last_closing_balance=0, last_closing_date=None,
+							continuity_gap_date=None)
+	stmt_doc.update(values)
+	return stmt_doc
 
 
 class TestFinTSStatementImport(FrappeTestCase):
-	pass
+	def test_statement_balances(self):
+		balances = get_statement_balances(STATEMENTS)
+		self.assertEqual(len(balances), 2)
+		self.assertEqual(float(balances[0]["opening"].amount.amount), 1000.0)
+		self.assertEqual(float(balances[1]["closing"].amount.amount), 1150.0)
+		self.assertEqual(getdate(balances[1]["closing"].date), getdate("2025-03-03"))
+
+	def test_statement_balances_debit(self):
+		balances = get_statement_balances(":60F:D250301EUR10,50@@:62F:D250301EUR20,00@@-")
+		self.assertEqual(float(balances[0]["opening"].amount.amount), -10.5)
+		self.assertEqual(float(balances[0]["closing"].amount.amount), -20.0)
+
+	def test_continuity_initial(self):
+		stmt_doc = make_import()
+		balances = get_statement_balances(STATEMENTS)
+		status = check_balance_continuity(stmt_doc, balances[-1]["closing"], balances, getdate("2025-03-01"))
+		self.assertEqual(status, "Initial")
+		self.assertEqual(stmt_doc.last_closing_balance, 1150.0)
+		self.assertEqual(getdate(stmt_doc.last_closing_date), getdate("2025-03-03"))
+
+	def test_continuity_continuous(self):
+		stmt_doc = make_import(last_closing_balance=1000, last_closing_date="2025-02-28")
+		balances = get_statement_balances(STATEMENTS)
+		status = check_balance_continuity(stmt_doc, balances[-1]["closing"], balances, getdate("2025-02-28"))
+		self.assertEqual(status, "Continuous")
+		self.assertFalse(stmt_doc.continuity_gap_date)
+
+	def test_continuity_refetched_checkpoint_day(self):
+		# Bookings after the last sync on 2025-03-01 moved its closing balance, the next statement opens with it
+		stmt_doc = make_import(last_closing_balance=980, last_closing_date="2025-03-01")
+		balances = get_statement_balances(STATEMENTS)
+		status = check_balance_continuity(stmt_doc, balances[-1]["closing"], balances, getdate("2025-03-01"))
+		self.assertEqual(status, "Continuous")
+
+	def test_continuity_mismatch(self):
+		stmt_doc = make_import(last_closing_balance=900, last_closing_date="2025-02-28")
+		balances = get_statement_balances(STATEMENTS)
+		status = check_balance_continuity(stmt_doc, balances[-1]["closing"], balances, getdate("2025-02-28"))
+		self.assertEqual(status, "Mismatch")
+		self.assertEqual(getdate(stmt_doc.continuity_gap_date), getdate("2025-02-28"))
+		# The checkpoint still moves, only the gap is fetched again
+		self.assertEqual(stmt_doc.last_closing_balance, 1150.0)
+
+	def test_continuity_gap_refetched(self):
+		stmt_doc = make_import(last_closing_balance=1000, last_closing_date="2025-02-28",
+							   continuity_gap_date="2025-02-20")
+		balances = get_statement_balances(STATEMENTS)
+		status = check_balance_continuity(stmt_doc, balances[-1]["closing"], balances, getdate("2025-02-20"))
+		self.assertEqual(status, "Continuous")
+		self.assertFalse(stmt_doc.continuity_gap_date)
+
+	def test_continuity_window_after_checkpoint(self):
+		stmt_doc = make_import(last_closing_balance=1000, last_closing_date="2024-01-31")
+		balances = get_statement_balances(STATEMENTS)
+		status = check_balance_continuity(stmt_doc, balances[-1]["closing"], balances, getdate("2025-03-01"))
+		self.assertEqual(status, "Gap")
+
+	def test_continuity_custom_range(self):
+		stmt_doc = make_import(transaction_mode="Custom", last_closing_balance=500, last_closing_date="2025-02-28")
+		balances = get_statement_balances(STATEMENTS)
+		status = check_balance_continuity(stmt_doc, balances[-1]["closing"], balances, getdate("2025-02-28"))
+		self.assertEqual(status, "")
+		self.assertEqual(stmt_doc.last_closing_balance, 500)
+
+	def test_camt_entries(self):
+		path = write_statement_file(CAMT_STATEMENT)
+		try:
+			chunks = list(iter_camt_chunks(path, chunk_entries=1))
+		finally:
+			os.remove(path)
+
+		self.assertEqual(len(chunks), 2)
+		credit, debit = chunks[0][0], chunks[1][0]
+		self.assertEqual(credit["status"], "C")
+		self.assertEqual(credit["amount"], {"amount": "200.00", "currency": "EUR"})
+		self.assertEqual(credit["applicant_name"], "Muster GmbH")
+		self.assertEqual(credit["applicant_iban"], "DE89370400440532013000")
+		self.assertEqual(credit["purpose"], "Rechnung 42 Müller")
+		self.assertEqual(debit["status"], "D")
+		self.assertEqual(debit["amount"]["amount"], "-9.99")
+		self.assertEqual(debit["date"], "2025-03-05")
+		self.assertEqual(debit["entry_date"], "2025-03-04")
+		self.assertEqual(debit["applicant_name"], "Stadtwerke")
+
+	def test_camt_report_pending(self):
+		path = write_statement_file(CAMT_REPORT)
+		pending = []
+		try:
+			chunks = list(iter_camt_chunks(path, pending=pending))
+		finally:
+			os.remove(path)
+
+		# Only the booked entry is imported, the pending one is staged and the advice is skipped
+		self.assertEqual(len(chunks), 1)
+		self.assertEqual([txn_dict["amount"]["amount"] for txn_dict in chunks[0]], ["200.00"])
+		self.assertEqual(len(pending), 1)
+		self.assertEqual(pending[0]["amount"]["amount"], "-45.90")
+		self.assertEqual(pending[0]["end_to_end_reference"], "E2E-0815")
+		self.assertEqual(pending[0]["applicant_name"], "Versandhaus")
+
+	def test_mt940_chunks_keep_statements(self):
+		path = write_statement_file(STATEMENTS.replace("@@", "\r\n").encode("iso-8859-1"))
+		try:
+			chunks = list(iter_mt940_text_chunks(path, chunk_bytes=10))
+		finally:
+			os.remove(path)
+
+		self.assertEqual(len(chunks), 2)
+		self.assertTrue(all(chunk.startswith(":20:") for chunk in chunks))
+		self.assertIn(":62F:C250301EUR950,00", chunks[0])
+		self.assertIn(":62F:C250303EUR1150,00", chunks[1])
+
+	def test_camt_and_mt940_hash_alike(self):
+		path = write_statement_file(CAMT_STATEMENT)
+		try:
+			camt_dicts, _rows = next(prepare_chunks(prepare_dict_chunk, iter_camt_chunks(path), COMPANY_INFO,
+													parallel=False))
+		finally:
+			os.remove(path)
+		mt940_dicts, _rows = next(prepare_chunks(prepare_mt940_chunk, [MT940_STATEMENT], COMPANY_INFO,
+												 parallel=False))
+
+		self.assertEqual(mt940_dicts[0]["hash"], camt_dicts[0]["hash"])
+		self.assertNotEqual(camt_dicts[0]["hash"], camt_dicts[1]["hash"])
+
+	def test_identical_bookings_numbered(self):
+		booking = {"status": "D", "amount": {"amount": "-3.50", "currency": "EUR"}, "date": "2025-03-03",
+				   "entry_date": "2025-03-03", "purpose": "Kaffee"}
+		chunks = [[dict(booking)], [dict(booking), dict(booking, date="2025-03-04")]]
+		prepared = list(prepare_chunks(prepare_dict_chunk, chunks, COMPANY_INFO, parallel=False))
+		hashes = [txn_dict["hash"] for txn_dicts, rows in prepared for txn_dict in txn_dicts]
+		self.assertEqual(len(set(hashes)), 3)
+		# A refetch numbers them the same way
+		refetched = list(prepare_chunks(prepare_dict_chunk, [[dict(booking), dict(booking)]], COMPANY_INFO,
+										parallel=False))
+		self.assertEqual([txn_dict["hash"] for txn_dict in refetched[0][0]], hashes[:2])
+		self.assertEqual(prepared[1][1][0]["hash"], hashes[1])
+
+	def test_recording_scrubbed(self):
+		statement = MT940_STATEMENT.encode("iso-8859-1")
+		message = (b"HIUPD:4:6:4+1234567890::280:12030000+DE02120300001234567890+user1+1+EUR+Max Mustermann++Giro'"
+				   b"HIKAZ:5:7:3+@" + str(len(statement)).encode() + b"@" + statement +
+				   b"'HKIDN:2:2+280:12030000+user1+0+1'")
+		recorder = RecordingConnection(None, secrets=["user1"])
+		scrubbed = recorder.scrub(message)
+
+		# Same length, binary fields keep their framing
+		self.assertEqual(len(scrubbed), len(message))
+		for value in (b"1234567890", b"12030000", b"Max Mustermann", b"Muster GmbH", b"Rechnung", b"E2E-4711",
+					  b"DE89370400440532013000", b"user1"):
+			self.assertNotIn(value, scrubbed)
+		# Posting text, prima nota and amounts stay, one BLZ gets one pseudonym
+		for value in (b"?00GUTSCHRIFT", b"?109310", b"CR200,00", b"SVWZ+", b"Giro"):
+			self.assertIn(value, scrubbed)
+		blz = recorder.pseudonymize(b"12030000")
+		self.assertIn(b":25:" + blz + b"/", scrubbed)
+		self.assertIn(b"280:" + blz + b"+", scrubbed)
+
+		start = scrubbed.index(b":20:")
+		txn_dicts, _rows = prepare_mt940_chunk(scrubbed[start:start + len(statement)].decode("iso-8859-1"),
+											   COMPANY_INFO)
+		self.assertEqual(txn_dicts[0]["amount"]["amount"], "200.00")
+
+	def test_payload_totals(self):
+		payload = frappe.as_json([
+			{"status": "C", "amount": {"amount": "200.00", "currency": "EUR"}},
+			{"status": "D", "amount": {"amount": "-50.00", "currency": "EUR"}},
+			{"status": "D", "amount": {"amount": "-25.50", "currency": "EUR"}},
+			{"status": "", "amount": {"amount": "10.00", "currency": "EUR"}},
+			{"status": "C"}
+		])
+		self.assertEqual(get_payload_totals(payload), (200.0, 75.5))
+
+	def test_payload_totals_without_transactions(self):
+		# Empty and broken payloads, and the summaries of file imports
+		for payload in (None, "", "[]", "not json", frappe.as_json({"total": 3})):
+			self.assertEqual(get_payload_totals(payload), (0, 0))
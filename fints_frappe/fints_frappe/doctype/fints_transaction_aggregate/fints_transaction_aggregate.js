@@ -0,0 +1,8 @@
+// Copyright (c) 2025, Ahmad Hussnain and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("FinTS Transaction Aggregate", {
+// 	refresh(frm) {
+
+// 	},
+// });
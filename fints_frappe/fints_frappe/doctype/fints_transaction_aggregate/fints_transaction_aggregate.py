@@ -0,0 +1,237 @@
+# Copyright (c) 2025, Ahmad Hussnain and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import flt, get_first_day, getdate, now_datetime
+
+import hashlib
+import traceback
+
+# Rows written per INSERT statement
+UPSERT_BATCH_SIZE = 500
+# Bank Transactions read per page by rebuild_transaction_aggregates
+REBUILD_PAGE_LENGTH = 10000
+# The rebuild job of a Bank Account holds its lock at most this long (the job timeout)
+REBUILD_LOCK_TIMEOUT = 3600
+# Bank Transaction fields an aggregate is computed from
+AGGREGATE_SOURCE_FIELDS = ["name", "bank_account", "date", "deposit", "withdrawal", "currency", "bank_party_iban",
+                           "bank_party_name", "purpose_code"]
+
+
+class FinTSTransactionAggregate(Document):
+    pass
+
+
+def on_doctype_update():
+    # Reports read one account and dimension over a date range
+    frappe.db.add_index("FinTS Transaction Aggregate", ["bank_account", "dimension", "posting_date"])
+
+
+def update_transaction_aggregates(transactions=None, bank_account=None):
+    """
+        Adds newly imported transactions to the aggregate rows (daily cash flow, counterparties, purpose codes).
+        Runs in the same database transaction as the Bank Transaction inserts.
+        Args:
+            transactions (list): The hashed transaction dictionaries that have been inserted.
+            bank_account (str): The name of the 'Bank Account'.
+    """
+    if not transactions or not bank_account:
+        return
+
+    upsert_aggregates(list(get_aggregate_buckets(transactions, bank_account).values()))
+
+
+def get_aggregate_buckets(transactions=None, bank_account=None):
+    """
+        Sums transactions into the aggregate rows they belong to.
+        Returns:
+            dict: Aggregate row dictionaries by name.
+    """
+    buckets = {}
+    for txn_dict in transactions:
+        amount = flt(txn_dict.get("amount", {}).get("amount", 0))
+        currency = txn_dict.get("amount", {}).get("currency") or ""
+        posting_date = getdate(txn_dict.get("date"))
+        month = get_first_day(posting_date)
+        counterparty = txn_dict.get("applicant_iban") or txn_dict.get("applicant_name") or ""
+
+        for dimension, bucket_date, value in (("Day", posting_date, ""),
+                                              ("Counterparty", month, counterparty),
+                                              ("Purpose Code", month, txn_dict.get("purpose_code") or "")):
+            add_to_bucket(buckets, bank_account, dimension, value, bucket_date, currency, amount)
+    return buckets
+
+
+def add_to_bucket(buckets, bank_account, dimension, value, posting_date, currency, amount):
+    """
+        Adds one amount to the in-memory bucket of an aggregate row.
+    """
+    key = get_aggregate_name(bank_account, dimension, value, posting_date, currency)
+    bucket = buckets.setdefault(key, {
+        "name": key,
+        "bank_account": bank_account,
+        "dimension": dimension,
+        "dimension_value": (value or "")[:140],
+        "posting_date": posting_date,
+        "currency": currency,
+        "inflow": 0,
+        "outflow": 0,
+        "transaction_count": 0,
+    })
+    if amount >= 0:
+        bucket["inflow"] += amount
+    else:
+        bucket["outflow"] += abs(amount)
+    bucket["transaction_count"] += 1
+
+
+def get_aggregate_name(bank_account, dimension, value, posting_date, currency):
+    """
+        Returns the deterministic name of an aggregate row, the name doubles as its unique key.
+    """
+    key = "|".join([bank_account, dimension, value or "", str(posting_date), currency or ""])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def upsert_aggregates(rows=None):
+    """
+        Inserts the aggregate rows or adds their totals to the existing ones.
+        Args:
+            rows (list): Aggregate row dictionaries as built by add_to_bucket.
+    """
+    columns = ["name", "creation", "modified", "owner", "modified_by", "docstatus", "bank_account", "dimension",
+               "dimension_value", "posting_date", "currency", "inflow", "outflow", "transaction_count"]
+    if frappe.db.db_type == "postgres":
+        on_conflict = """ON CONFLICT (name) DO UPDATE SET
+            inflow = `tabFinTS Transaction Aggregate`.inflow + EXCLUDED.inflow,
+            outflow = `tabFinTS Transaction Aggregate`.outflow + EXCLUDED.outflow,
+            transaction_count = `tabFinTS Transaction Aggregate`.transaction_count + EXCLUDED.transaction_count,
+            modified = EXCLUDED.modified"""
+    else:
+        on_conflict = """ON DUPLICATE KEY UPDATE
+            inflow = inflow + VALUES(inflow),
+            outflow = outflow + VALUES(outflow),
+            transaction_count = transaction_count + VALUES(transaction_count),
+            modified = VALUES(modified)"""
+
+    timestamp = now_datetime()
+    user = frappe.session.user
+    for start in range(0, len(rows or []), UPSERT_BATCH_SIZE):
+        batch = rows[start:start + UPSERT_BATCH_SIZE]
+        values = []
+        for row in batch:
+            values.extend([row["name"], timestamp, timestamp, user, user, 0, row["bank_account"], row["dimension"],
+                           row["dimension_value"], row["posting_date"], row["currency"], row["inflow"],
+                           row["outflow"], row["transaction_count"]])
+        placeholders = ", ".join(["({0})".format(", ".join(["%s"] * len(columns)))] * len(batch))
+        frappe.db.sql("""INSERT INTO `tabFinTS Transaction Aggregate` ({0}) VALUES {1} {2}""".format(
+            ", ".join("`{0}`".format(c) for c in columns), placeholders, on_conflict), values)
+
+
+def remove_bank_transaction(doc=None, method=None):
+    """
+        doc_events of Bank Transaction (on_cancel, on_trash): takes a submitted, imported transaction
+        out of the aggregates again. A draft or an already cancelled one was never (or is no longer) counted.
+    """
+    if not doc.get("hash") or not doc.get("bank_account"):
+        return
+    if method == "on_trash" and doc.docstatus != 1:
+        return
+
+    buckets = get_aggregate_buckets([get_bank_transaction_dict(doc)], doc.bank_account)
+    for row in buckets.values():
+        frappe.db.sql("""UPDATE `tabFinTS Transaction Aggregate`
+            SET inflow = inflow - %s, outflow = outflow - %s, transaction_count = transaction_count - %s,
+                modified = %s
+            WHERE name = %s""", (row["inflow"], row["outflow"], row["transaction_count"], now_datetime(), row["name"]))
+
+
+def get_bank_transaction_dict(bank_transaction=None):
+    """
+        Returns the fields of a Bank Transaction in the shape of a hashed transaction dictionary.
+    """
+    return {
+        "date": bank_transaction.get("date"),
+        "amount": {"amount": flt(bank_transaction.get("deposit")) - flt(bank_transaction.get("withdrawal")),
+                   "currency": bank_transaction.get("currency")},
+        "applicant_iban": bank_transaction.get("bank_party_iban"),
+        "applicant_name": bank_transaction.get("bank_party_name"),
+        "purpose_code": bank_transaction.get("purpose_code"),
+    }
+
+
+@frappe.whitelist(methods=["POST"])
+def rebuild_transaction_aggregates(bank_account=None):
+    """
+        Queues a rebuild of the aggregate rows from the imported Bank Transactions.
+        Args:
+            bank_account (str): Only rebuild this 'Bank Account'. All accounts if empty.
+        Returns:
+            dict: Response confirming that the rebuild has been queued.
+    """
+    frappe.only_for("System Manager")
+    frappe.enqueue(build_transaction_aggregates, queue="long", timeout=3600, bank_account=bank_account)
+    return {
+        "ok": True,
+        "message": _("The rebuild of the transaction aggregates has been queued.")
+    }
+
+
+def build_transaction_aggregates(bank_account=None):
+    """
+        Rebuilds the aggregate rows from the imported (hashed) Bank Transactions, one Bank Account at a time.
+        Args:
+            bank_account (str): Only rebuild this 'Bank Account'. All accounts if empty.
+    """
+    if bank_account:
+        bank_accounts = [bank_account]
+    else:
+        bank_accounts = frappe.get_all("Bank Transaction", filters={"docstatus": 1, "hash": ["is", "set"]},
+                                       pluck="bank_account", distinct=True)
+
+    for account in bank_accounts:
+        try:
+            rebuild_account_aggregates(account)
+        except Exception:
+            frappe.db.rollback()
+            frappe.log_error(title="FinTS Transaction Aggregate", message=traceback.format_exc())
+
+
+def rebuild_account_aggregates(bank_account=None):
+    """
+        Replaces the aggregate rows of one Bank Account. Delete and rebuild are a single database transaction:
+        an import of the account blocks on the deleted rows until the rebuild commits and is then added on top,
+        it is neither lost nor counted twice. A second rebuild of the account is turned away by the lock.
+        Args:
+            bank_account (str): The name of the 'Bank Account'.
+    """
+    lock = frappe.cache().lock(frappe.cache().make_key("fints_aggregate_rebuild:{0}".format(bank_account)),
+                               timeout=REBUILD_LOCK_TIMEOUT, blocking_timeout=0)
+    if not lock.acquire():
+        frappe.throw(_("The aggregates of Bank Account {0} are already being rebuilt.").format(bank_account))
+
+    try:
+        frappe.db.delete("FinTS Transaction Aggregate", {"bank_account": bank_account})
+
+        # Keyset paging: every page starts after the last name of the previous one, no offset to skip over
+        last_name = None
+        while True:
+            filters = {"docstatus": 1, "hash": ["is", "set"], "bank_account": bank_account}
+            if last_name:
+                filters["name"] = [">", last_name]
+            rows = frappe.get_all("Bank Transaction", filters=filters, fields=AGGREGATE_SOURCE_FIELDS,
+                                  order_by="name asc", limit_page_length=REBUILD_PAGE_LENGTH)
+            if not rows:
+                break
+
+            update_transaction_aggregates([get_bank_transaction_dict(row) for row in rows], bank_account)
+            last_name = rows[-1].name
+        # Before the lock is released, the next rebuild starts from the committed rows
+        frappe.db.commit()
+    finally:
+        try:
+            lock.release()
+        except Exception:
+            pass
@@ -0,0 +1,127 @@
+# Copyright (c) 2025, Ahmad Hussnain and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import cint
+
+import json
+
+# Bank Transaction fields every event carries per transaction
+EVENT_TRANSACTION_FIELDS = ["date", "transaction_type", "deposit", "withdrawal", "currency", "description",
+                            "reference_number", "bank_party_name", "bank_party_iban", "party_type", "party",
+                            "gl_account", "cost_center", "transaction_rule", "hash"]
+# Upper bound of events per get_transaction_events call
+MAX_EVENTS_PER_PAGE = 500
+DISPATCH_JOB_ID = "fints_dispatch_transaction_events"
+
+
+class FinTSTransactionEvent(Document):
+    pass
+
+
+def record_transaction_event(company_info=None, booked=None):
+    """
+        Writes one outbox event for a batch of newly created Bank Transactions.
+        Runs in the database transaction of the inserts, a rolled back import never emits an event.
+        Args:
+            company_info (dict): Contains company-related details like company name and bank account.
+            booked (list): (row, bank_transaction_name) tuples, row being the Bank Transaction fields.
+        Returns:
+            int: The name of the event or None if nothing was booked.
+    """
+    if not booked:
+        return None
+
+    transactions = []
+    for row, bank_transaction in booked:
+        transaction = {"name": bank_transaction}
+        transaction.update({fieldname: row.get(fieldname) for fieldname in EVENT_TRANSACTION_FIELDS})
+        transactions.append(transaction)
+
+    dates = [str(transaction["date"]) for transaction in transactions if transaction["date"]]
+    event = frappe.get_doc({
+        "doctype": "FinTS Transaction Event",
+        "event_type": "Transactions Imported",
+        "bank_account": company_info.get("bank_account"),
+        "company": company_info.get("company"),
+        "transaction_count": len(transactions),
+        "from_date": min(dates) if dates else None,
+        "to_date": max(dates) if dates else None,
+        "payload": json.dumps(transactions, default=str)
+    }).insert(ignore_permissions=True)
+
+    # Deliver soon after the import commits, the scheduler picks up anything a failed job left behind
+    frappe.enqueue(
+        "fints_frappe.fints_frappe.doctype.fints_event_sink.fints_event_sink.dispatch_transaction_events",
+        queue="short",
+        job_id=DISPATCH_JOB_ID,
+        deduplicate=True,
+        enqueue_after_commit=True
+    )
+    return event.name
+
+
+def assign_event_sequence():
+    """
+        Numbers the committed events that have no sequence yet, in the order they were created.
+        Names are allocated at insert time and a long import can commit after a newer short one, so a cursor
+        over names could skip an event. Sequences are only given to committed rows by the single dispatcher,
+        a cursor over them never does. Must run under the dispatch lock.
+        Returns:
+            int: The number of sequenced events.
+    """
+    unsequenced = frappe.get_all("FinTS Transaction Event", filters={"sequence": 0}, pluck="name",
+                                 order_by="name asc")
+    if not unsequenced:
+        return 0
+
+    sequence = cint(frappe.db.get_value("FinTS Transaction Event", {}, "max(sequence)"))
+    for name in unsequenced:
+        sequence += 1
+        frappe.db.set_value("FinTS Transaction Event", name, "sequence", sequence, update_modified=False)
+    frappe.db.commit()
+    return len(unsequenced)
+
+
+def get_events_after(cursor=0, limit=MAX_EVENTS_PER_PAGE, bank_account=None):
+    """
+        Returns the sequenced events following a cursor, oldest first, with their payload decoded.
+        Args:
+            cursor (int): The sequence of the last event the consumer has seen, 0 for the start.
+            limit (int): The maximum number of events.
+            bank_account (str): Only events of this Bank Account (optional).
+        Returns:
+            list: The events as dictionaries.
+    """
+    filters = {"sequence": [">", cint(cursor)]}
+    if bank_account:
+        filters["bank_account"] = bank_account
+
+    events = frappe.get_all("FinTS Transaction Event", filters=filters,
+                            fields=["name", "sequence", "creation", "event_type", "bank_account", "company",
+                                    "transaction_count", "from_date", "to_date", "payload"],
+                            order_by="sequence asc", page_length=cint(limit))
+    for event in events:
+        event["transactions"] = json.loads(event.pop("payload") or "[]")
+    return events
+
+
+@frappe.whitelist()
+def get_transaction_events(cursor=0, limit=100, bank_account=None):
+    """
+        Pull endpoint for consumers: the events after their cursor instead of polling Bank Transaction.
+        Args:
+            cursor (int): The 'next_cursor' of the previous call, 0 for the start.
+            limit (int): The maximum number of events (at most MAX_EVENTS_PER_PAGE).
+            bank_account (str): Only events of this Bank Account (optional).
+        Returns:
+            dict: The events and the cursor to pass next time.
+    """
+    frappe.has_permission("FinTS Transaction Event", "read", throw=True)
+
+    events = get_events_after(cursor, min(cint(limit) or 100, MAX_EVENTS_PER_PAGE), bank_account)
+    return {
+        "events": events,
+        "next_cursor": events[-1]["sequence"] if events else cint(cursor)
+    }
@@ -0,0 +1,72 @@
+# Copyright (c) 2025, Ahmad Hussnain and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import cint
+
+import os
+import json
+
+from fints_frappe.fints_frappe.doctype.fints_event_sink.fints_event_sink import (
+	dispatch_transaction_events, get_sink_file_path)
+
+SINK_NAME = "_Test FinTS File Sink"
+
+
+def make_event(count=1):
+	return frappe.get_doc({
+		"doctype": "FinTS Transaction Event",
+		"event_type": "Transactions Imported",
+		"transaction_count": count,
+		"payload": json.dumps([{"name": "BT-{0:04d}".format(index)} for index in range(count)])
+	}).insert(ignore_permissions=True).name
+
+
+def get_max_sequence():
+	return cint(frappe.db.get_value("FinTS Transaction Event", {}, "max(sequence)"))
+
+
+class TestFinTSTransactionEvent(FrappeTestCase):
+	# The dispatcher commits its sequences and cursors, the test cleans up after itself
+	def setUp(self):
+		self.events = []
+		frappe.delete_doc_if_exists("FinTS Event Sink", SINK_NAME)
+		self.sink = frappe.get_doc({
+			"doctype": "FinTS Event Sink",
+			"sink_name": SINK_NAME,
+			"enabled": 1,
+			"sink_type": "File",
+			"file_path": "fints-test/{0}.jsonl".format(frappe.generate_hash(length=10)),
+			"batch_size": 2,
+			"last_event": get_max_sequence()
+		}).insert(ignore_permissions=True)
+		frappe.db.commit()
+
+	def tearDown(self):
+		path = get_sink_file_path(self.sink)
+		if os.path.exists(path):
+			os.remove(path)
+		frappe.db.delete("FinTS Transaction Event", {"name": ["in", self.events]})
+		frappe.delete_doc_if_exists("FinTS Event Sink", SINK_NAME)
+		frappe.db.commit()
+
+	def dispatch(self, count):
+		self.events.extend(make_event(index + 1) for index in range(count))
+		frappe.db.commit()
+		dispatch_transaction_events()
+
+	def test_sequences_gapless(self):
+		first = cint(self.sink.last_event) + 1
+		# Five events in two runs, batches of two: the consumer sees every sequence once and in order
+		self.dispatch(3)
+		self.dispatch(2)
+
+		with open(get_sink_file_path(self.sink)) as fh:
+			batches = [json.loads(line) for line in fh if line.strip()]
+		sequences = [event["sequence"] for batch in batches for event in batch["events"]]
+		self.assertEqual(sequences, list(range(first, first + 5)))
+		self.assertEqual([len(batch["events"]) for batch in batches], [2, 1, 2])
+		self.assertEqual(cint(frappe.db.get_value("FinTS Event Sink", SINK_NAME, "last_event")), first + 4)
+		self.assertFalse(frappe.get_all("FinTS Transaction Event",
+										filters={"name": ["in", self.events], "sequence": 0}))
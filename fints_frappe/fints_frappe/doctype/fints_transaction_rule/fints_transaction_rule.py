@@ -0,0 +1,202 @@
+# Copyright (c) 2025, Ahmad Hussnain and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import cint, flt
+
+import re
+
+# Redis key of the rule set version, every change to a rule bumps it
+RULE_VERSION_KEY = "fints_transaction_rule_version"
+RULE_FIELDS = ["name", "priority", "bank_account", "match_type", "text_field", "pattern", "counterparty_iban",
+               "creditor_id", "transaction_type", "min_amount", "max_amount", "party_type", "party", "gl_account",
+               "cost_center"]
+
+# Compiled matchers of this process, per site: (version, matcher)
+_matchers = {}
+# Key of a keyword trie node that ends a keyword, never a character of one
+KEYWORD_END = ""
+
+
+class FinTSTransactionRule(Document):
+    def validate(self):
+        if self.match_type == "Regex" and self.pattern:
+            try:
+                re.compile(self.pattern)
+            except re.error as e:
+                frappe.throw(_("The pattern is not a valid regular expression: {0}").format(e))
+
+        if self.min_amount and self.max_amount and flt(self.min_amount) > flt(self.max_amount):
+            frappe.throw(_("Min Amount must not be greater than Max Amount."))
+
+        if not (self.pattern or self.counterparty_iban or self.creditor_id or self.transaction_type
+                or self.min_amount or self.max_amount):
+            frappe.throw(_("Please set at least one condition."))
+
+        if self.party and not self.party_type:
+            frappe.throw(_("Please set the Party Type of the Party."))
+
+    def on_update(self):
+        invalidate_rule_matcher()
+
+    def on_trash(self):
+        invalidate_rule_matcher()
+
+
+def invalidate_rule_matcher():
+    """
+        Makes every process recompile the rules before the next import batch.
+    """
+    frappe.cache().incr(frappe.cache().make_key(RULE_VERSION_KEY))
+
+
+def get_rule_matcher():
+    """
+        Returns the compiled matcher of the enabled rules, cached per process until a rule changes.
+        Returns:
+            TransactionRuleMatcher: The matcher or None if there are no enabled rules.
+    """
+    version = cint(frappe.cache().get(frappe.cache().make_key(RULE_VERSION_KEY)))
+    cached = _matchers.get(frappe.local.site)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    rules = frappe.get_all("FinTS Transaction Rule", filters={"enabled": 1}, fields=RULE_FIELDS,
+                           order_by="priority desc, name asc")
+    matcher = TransactionRuleMatcher(rules) if rules else None
+    _matchers[frappe.local.site] = (version, matcher)
+    return matcher
+
+
+class TransactionRuleMatcher:
+    """
+        All enabled rules compiled once. The keywords of every keyword rule share one lookahead alternation
+        and one trie, so a transaction text is scanned once per field, whatever the number of rules.
+        Every keyword occurring in the text is found, also one that is a prefix of or overlaps another;
+        which rule wins is decided by priority alone.
+    """
+
+    def __init__(self, rules):
+        self.rules = []
+        # keyword (lower case) -> indexes of the rules using it
+        self.keywords = {}
+        for index, rule in enumerate(rules):
+            compiled = frappe._dict(rule)
+            compiled.counterparty_iban = normalize_iban(rule.counterparty_iban)
+            compiled.creditor_id = (rule.creditor_id or "").strip().upper()
+            compiled.regex = None
+            if rule.pattern and rule.match_type == "Regex":
+                compiled.regex = re.compile(rule.pattern, re.IGNORECASE)
+            elif rule.pattern:
+                for keyword in rule.pattern.splitlines():
+                    keyword = keyword.strip().lower()
+                    if keyword:
+                        self.keywords.setdefault(keyword, set()).add(index)
+            self.rules.append(compiled)
+
+        self.keyword_regex = None
+        self.keyword_trie = {}
+        if self.keywords:
+            # Zero width, so finditer stops at every position where any keyword starts, overlapping or not
+            self.keyword_regex = re.compile("(?=(?:{0}))".format("|".join(re.escape(keyword)
+                                                                        for keyword in self.keywords)))
+            for keyword in self.keywords:
+                node = self.keyword_trie
+                for char in keyword:
+                    node = node.setdefault(char, {})
+                node[KEYWORD_END] = keyword
+
+    def keyword_hits(self, text):
+        """
+            Returns the indexes of the keyword rules whose keywords occur in the text.
+            The regex finds the start positions, the trie collects every keyword starting there:
+            'amazon' and 'amazon prime' both hit in 'AMAZON PRIME 123'.
+        """
+        hits = set()
+        if not self.keyword_regex or not text:
+            return hits
+
+        text = text.lower()
+        for match in self.keyword_regex.finditer(text):
+            node = self.keyword_trie
+            for char in text[match.start():]:
+                node = node.get(char)
+                if node is None:
+                    break
+                if KEYWORD_END in node:
+                    hits.update(self.keywords[node[KEYWORD_END]])
+        return hits
+
+    def match(self, txn_dict, row):
+        """
+            Returns the first rule (by priority) matching a transaction.
+            Args:
+                txn_dict (dict): The transaction dictionary.
+                row (dict): The mapped Bank Transaction fields.
+            Returns:
+                frappe._dict: The matching rule or None.
+        """
+        purpose = txn_dict.get("purpose") or ""
+        posting_text = txn_dict.get("posting_text") or ""
+        purpose_hits = self.keyword_hits(purpose)
+        posting_text_hits = self.keyword_hits(posting_text)
+        iban = normalize_iban(txn_dict.get("applicant_iban"))
+        creditor_id = (txn_dict.get("applicant_creditor_id") or "").strip().upper()
+        amount = flt(row.get("deposit")) or flt(row.get("withdrawal"))
+
+        for index, rule in enumerate(self.rules):
+            if rule.bank_account and rule.bank_account != row.get("bank_account"):
+                continue
+            if rule.counterparty_iban and rule.counterparty_iban != iban:
+                continue
+            if rule.creditor_id and rule.creditor_id != creditor_id:
+                continue
+            if rule.transaction_type and rule.transaction_type != row.get("transaction_type"):
+                continue
+            if rule.min_amount and amount < flt(rule.min_amount):
+                continue
+            if rule.max_amount and amount > flt(rule.max_amount):
+                continue
+            if rule.pattern:
+                if rule.text_field == "Purpose":
+                    texts, hits = [purpose], purpose_hits
+                elif rule.text_field == "Posting Text":
+                    texts, hits = [posting_text], posting_text_hits
+                else:
+                    texts, hits = [purpose, posting_text], purpose_hits | posting_text_hits
+                if rule.regex:
+                    if not any(rule.regex.search(text) for text in texts):
+                        continue
+                elif index not in hits:
+                    continue
+            return rule
+        return None
+
+    def apply(self, txn_dict, row):
+        """
+            Sets the actions of the matching rule on the Bank Transaction fields.
+            Returns:
+                bool: True if a rule matched.
+        """
+        rule = self.match(txn_dict, row)
+        if not rule:
+            return False
+
+        if rule.party:
+            row["party_type"] = rule.party_type
+            row["party"] = rule.party
+        if rule.gl_account:
+            row["gl_account"] = rule.gl_account
+        if rule.cost_center:
+            row["cost_center"] = rule.cost_center
+        row["transaction_rule"] = rule.name
+        return True
+
+
+def normalize_iban(iban=None):
+    """
+        Upper case IBAN without spaces.
+    """
+    return (iban or "").replace(" ", "").upper()
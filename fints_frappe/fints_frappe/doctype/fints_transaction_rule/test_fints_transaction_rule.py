@@ -0,0 +1,49 @@
+# Copyright (c) 2025, Ahmad Hussnain and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from fints_frappe.fints_frappe.doctype.fints_transaction_rule.fints_transaction_rule import TransactionRuleMatcher
+
+
+def make_rule(name, pattern, priority=0, **values):
+	rule = frappe._dict(name=name, priority=priority, match_type="Keyword", text_field="Purpose", pattern=pattern,
+						bank_account=None, counterparty_iban=None, creditor_id=None, transaction_type=None,
+						min_amount=0, max_amount=0, party_type=None, party=None, gl_account=None, cost_center=None)
+	rule.update(values)
+	return rule
+
+
+def match(rules, purpose, **row):
+	# The rules come ordered like get_rule_matcher reads them
+	rules = sorted(rules, key=lambda rule: (-rule.priority, rule.name))
+	rule = TransactionRuleMatcher(rules).match({"purpose": purpose}, dict({"withdrawal": 9.99}, **row))
+	return rule.name if rule else None
+
+
+class TestFinTSTransactionRule(FrappeTestCase):
+	def test_longer_keyword_by_priority(self):
+		rules = [make_rule("Amazon", "amazon", priority=0), make_rule("Prime", "amazon prime", priority=1)]
+		self.assertEqual(match(rules, "AMAZON PRIME 123"), "Prime")
+		self.assertEqual(match(rules, "AMAZON MARKETPLACE"), "Amazon")
+
+	def test_prefix_keyword_by_priority(self):
+		# The shorter keyword starts at the same position as the longer one and still hits
+		rules = [make_rule("Amazon", "amazon", priority=1), make_rule("Prime", "amazon prime", priority=0)]
+		self.assertEqual(match(rules, "AMAZON PRIME 123"), "Amazon")
+
+	def test_prefix_keyword_when_longer_rule_does_not_apply(self):
+		rules = [make_rule("Amazon", "amazon", priority=0),
+				 make_rule("Prime", "amazon prime", priority=1, transaction_type="Credit")]
+		self.assertEqual(match(rules, "AMAZON PRIME 123", transaction_type="Debit"), "Amazon")
+
+	def test_overlapping_keywords(self):
+		rules = [make_rule("Stadtwerke", "stadtwerke", priority=0), make_rule("Werke", "werkes", priority=1)]
+		self.assertEqual(match(rules, "Abschlag STADTWERKE Musterstadt"), "Stadtwerke")
+		self.assertEqual(match(rules, "Abschlag STADTWERKES"), "Werke")
+
+	def test_no_keyword(self):
+		rules = [make_rule("Amazon", "amazon\nprime video")]
+		self.assertIsNone(match(rules, "Rechnung 42"))
+		self.assertEqual(match(rules, "Prime Video Abo"), "Amazon")
@@ -0,0 +1,40 @@
+// Copyright (c) 2025, Ahmad Hussnain and contributors
+// For license information, please see license.txt
+
+frappe.query_reports["FinTS Cash Flow Analytics"] = {
+    filters: [
+        {
+            fieldname: "view",
+            label: __("View"),
+            fieldtype: "Select",
+            options: "Daily Cash Flow\nTop Counterparties\nPurpose Codes",
+            default: "Daily Cash Flow",
+            reqd: 1
+        },
+        {
+            fieldname: "bank_account",
+            label: __("Bank Account"),
+            fieldtype: "Link",
+            options: "Bank Account"
+        },
+        {
+            fieldname: "from_date",
+            label: __("From Date"),
+            fieldtype: "Date",
+            default: frappe.datetime.add_months(frappe.datetime.get_today(), -1)
+        },
+        {
+            fieldname: "to_date",
+            label: __("To Date"),
+            fieldtype: "Date",
+            default: frappe.datetime.get_today()
+        },
+        {
+            fieldname: "top_n",
+            label: __("Top N"),
+            fieldtype: "Int",
+            default: 20,
+            depends_on: "eval:doc.view != 'Daily Cash Flow'"
+        }
+    ]
+};
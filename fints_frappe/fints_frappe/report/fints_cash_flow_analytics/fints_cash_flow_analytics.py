@@ -0,0 +1,140 @@
+# Copyright (c) 2025, Ahmad Hussnain and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt, get_first_day
+
+# Reads only the FinTS Transaction Aggregate rows that are maintained on import,
+# never the Bank Transaction table itself.
+
+
+def execute(filters=None):
+    filters = frappe._dict(filters or {})
+    view = filters.get("view") or "Daily Cash Flow"
+
+    if view == "Daily Cash Flow":
+        columns, data = get_daily_columns(), get_daily_data(filters)
+        return columns, data, None, get_daily_chart(data)
+
+    dimension = "Counterparty" if view == "Top Counterparties" else "Purpose Code"
+    return get_dimension_columns(dimension), get_dimension_data(filters, dimension)
+
+
+def get_conditions(filters, dimension):
+    """
+        Returns the filters on the aggregate rows of a dimension.
+        Counterparty and Purpose Code rows are monthly buckets, so their from_date is moved to the first of the month.
+    """
+    conditions = {"dimension": dimension}
+    if filters.get("bank_account"):
+        conditions["bank_account"] = filters.bank_account
+
+    from_date = filters.get("from_date")
+    if from_date and dimension != "Day":
+        from_date = get_first_day(from_date)
+    if from_date and filters.get("to_date"):
+        conditions["posting_date"] = ["between", [from_date, filters.to_date]]
+    elif from_date:
+        conditions["posting_date"] = [">=", from_date]
+    elif filters.get("to_date"):
+        conditions["posting_date"] = ["<=", filters.to_date]
+    return conditions
+
+
+def get_daily_columns():
+    return [
+        {"fieldname": "posting_date", "label": _("Date"), "fieldtype": "Date", "width": 110},
+        {"fieldname": "bank_account", "label": _("Bank Account"), "fieldtype": "Link", "options": "Bank Account",
+         "width": 200},
+        {"fieldname": "currency", "label": _("Currency"), "fieldtype": "Link", "options": "Currency", "width": 80},
+        {"fieldname": "inflow", "label": _("Inflow"), "fieldtype": "Currency", "options": "currency", "width": 130},
+        {"fieldname": "outflow", "label": _("Outflow"), "fieldtype": "Currency", "options": "currency",
+         "width": 130},
+        {"fieldname": "net", "label": _("Net"), "fieldtype": "Currency", "options": "currency", "width": 130},
+        {"fieldname": "transaction_count", "label": _("Transactions"), "fieldtype": "Int", "width": 110},
+    ]
+
+
+def get_daily_data(filters):
+    data = frappe.get_all(
+        "FinTS Transaction Aggregate",
+        filters=get_conditions(filters, "Day"),
+        fields=["posting_date", "bank_account", "currency", "inflow", "outflow", "transaction_count"],
+        order_by="posting_date asc, bank_account asc"
+    )
+    for row in data:
+        row.net = flt(row.inflow) - flt(row.outflow)
+    return data
+
+
+def get_daily_chart(data):
+    if not data:
+        return None
+
+    totals = {}
+    for row in data:
+        total = totals.setdefault(row.posting_date, [0, 0])
+        total[0] += flt(row.inflow)
+        total[1] += flt(row.outflow)
+    return {
+        "data": {
+            "labels": [str(d) for d in totals],
+            "datasets": [
+                {"name": _("Inflow"), "values": [t[0] for t in totals.values()]},
+                {"name": _("Outflow"), "values": [t[1] for t in totals.values()]},
+            ],
+        },
+        "type": "bar",
+    }
+
+
+def get_dimension_columns(dimension):
+    return [
+        {"fieldname": "dimension_value", "label": _(dimension), "fieldtype": "Data", "width": 260},
+        {"fieldname": "currency", "label": _("Currency"), "fieldtype": "Link", "options": "Currency", "width": 80},
+        {"fieldname": "inflow", "label": _("Inflow"), "fieldtype": "Currency", "options": "currency", "width": 130},
+        {"fieldname": "outflow", "label": _("Outflow"), "fieldtype": "Currency", "options": "currency",
+         "width": 130},
+        {"fieldname": "net", "label": _("Net"), "fieldtype": "Currency", "options": "currency", "width": 130},
+        {"fieldname": "transaction_count", "label": _("Transactions"), "fieldtype": "Int", "width": 110},
+    ]
+
+
+def get_dimension_data(filters, dimension):
+    """
+        Returns the top_n values of a dimension ranked by volume. There is one group per counterparty, so ranking
+        and limit run in the database.
+    """
+    where, values = get_sql_conditions(get_conditions(filters, dimension))
+    values["top_n"] = cint(filters.get("top_n")) or 20
+    data = frappe.db.sql("""
+        SELECT dimension_value, currency, SUM(inflow) AS inflow, SUM(outflow) AS outflow,
+            SUM(transaction_count) AS transaction_count
+        FROM `tabFinTS Transaction Aggregate`
+        WHERE {0}
+        GROUP BY dimension_value, currency
+        ORDER BY SUM(inflow) + SUM(outflow) DESC, dimension_value ASC
+        LIMIT %(top_n)s""".format(where), values, as_dict=True)
+    for row in data:
+        row.dimension_value = row.dimension_value or _("Not Set")
+        row.net = flt(row.inflow) - flt(row.outflow)
+    return data
+
+
+def get_sql_conditions(conditions):
+    """
+        Returns the WHERE clause and its values for the filters built by get_conditions.
+    """
+    clauses, values = [], {}
+    for fieldname, condition in conditions.items():
+        if not isinstance(condition, list):
+            clauses.append("`{0}` = %({0})s".format(fieldname))
+            values[fieldname] = condition
+        elif condition[0] == "between":
+            clauses.append("`{0}` BETWEEN %({0}_from)s AND %({0}_to)s".format(fieldname))
+            values[fieldname + "_from"], values[fieldname + "_to"] = condition[1]
+        else:
+            clauses.append("`{0}` {1} %({0})s".format(fieldname, condition[0]))
+            values[fieldname] = condition[1]
+    return " AND ".join(clauses), values
@@ -145,26 +145,29 @@ app_license = "mit"
 # 	}
 # }
 
+doc_events = {
+	"Bank Transaction": {
+		"on_cancel": "fints_frappe.fints_frappe.doctype.fints_transaction_aggregate.fints_transaction_aggregate.remove_bank_transaction",
+		"on_trash": "fints_frappe.fints_frappe.doctype.fints_transaction_aggregate.fints_transaction_aggregate.remove_bank_transaction"
+	}
+}
+
 # Scheduled Tasks
 # ---------------
 
-# scheduler_events = {
-# 	"all": [
-# 		"fints_frappe.tasks.all"
-# 	],
-# 	"daily": [
-# 		"fints_frappe.tasks.daily"
-# 	],
-# 	"hourly": [
-# 		"fints_frappe.tasks.hourly"
-# 	],
-# 	"weekly": [
-# 		"fints_frappe.tasks.weekly"
-# 	],
-# 	"monthly": [
-# 		"fints_frappe.tasks.monthly"
-# 	],
-# }
+scheduler_events = {
+	"daily_long": [
+		"fints_frappe.fints_frappe.doctype.fints_statement_import.fints_retention.apply_retention_policies"
+	],
+	"cron": {
+		"*/15 * * * *": [
+			"fints_frappe.fints_frappe.doctype.fints_statement_import.fints_quota.schedule_auto_syncs"
+		],
+		"* * * * *": [
+			"fints_frappe.fints_frappe.doctype.fints_event_sink.fints_event_sink.dispatch_transaction_events"
+		]
+	}
+}
 
 # Testing
 # -------
@@ -0,0 +1,7 @@
+from fints_frappe.fints_frappe.doctype.fints_transaction_aggregate.fints_transaction_aggregate import (
+    build_transaction_aggregates)
+
+
+def execute():
+    # Bank Transactions imported before the aggregates existed
+    build_transaction_aggregates()
@@ -0,0 +1,37 @@
+import frappe
+from frappe.utils import flt
+
+from fints_frappe.fints_frappe.doctype.fints_statement_import.fints_parallel import (
+    get_numbered_hash, get_transaction_fingerprint)
+
+
+def execute():
+    # The hash used to cover the whole mt940 dictionary, a CAMT import of the same booking never matched it.
+    # The stored fields are enough for the canonical hash, renumbered day by day in the order they were imported.
+    dates = frappe.get_all("Bank Transaction", filters={"hash": ["is", "set"]}, pluck="date", distinct=True,
+                           order_by="date asc")
+    for date in dates:
+        occurrences = {}
+        for row in frappe.get_all("Bank Transaction", filters={"hash": ["is", "set"], "date": date},
+                                  fields=["name", "hash", "date", "entry_date", "transaction_type", "deposit",
+                                          "withdrawal", "currency", "end_to_end_reference", "description"],
+                                  order_by="creation asc, name asc"):
+            fingerprint = get_transaction_fingerprint(get_stored_transaction_dict(row))
+            occurrences[fingerprint] = occurrences.get(fingerprint, 0) + 1
+            txn_hash = get_numbered_hash(fingerprint, occurrences[fingerprint])
+            if txn_hash != row.hash:
+                frappe.db.set_value("Bank Transaction", row.name, "hash", txn_hash, update_modified=False)
+
+
+def get_stored_transaction_dict(row=None):
+    """
+        Returns a Bank Transaction in the shape of the mt940 JSON, as far as the canonical transaction reads it.
+    """
+    return {
+        "status": {"Credit": "C", "Debit": "D"}.get(row.transaction_type) or ("C" if flt(row.deposit) else "D"),
+        "amount": {"amount": flt(row.deposit) - flt(row.withdrawal), "currency": row.currency},
+        "date": row.date,
+        "entry_date": row.entry_date,
+        "end_to_end_reference": row.end_to_end_reference,
+        "purpose": row.description,
+    }